@@ -2,209 +2,202 @@
 Game world for "mh"
 
 this will create a pickle that can be read by the library
+
+the maps are compiled first, and kept in the build folder.  a map is only
+compiled again if it, its tilesets or the code that compiles it change.  if
+nothing has changed since the last build, nothing is done.  see
+lib2d/worldbuild.py.
+
+    python buildworld.py            build the world if anything changed
+    python buildworld.py -f         build it anyway
 """
 
 import pygame
-pygame.mixer.init()
 
 from lib2d.env import Environment, Area
 from lib2d.avatar import Avatar, Animation, StaticAnimation
 from lib2d.objects import AvatarObject
-from lib2d import res, tmxloader
+from lib2d.worldbuild import WorldBuilder
+from lib2d.preload import areaAssets
+from lib2d import res
 from lib.rpg import Hero, NPC
 
 from collections import defaultdict
-
-
-
-# build the initial environment
-uni = Environment()
-uni.name = 'MH'
-uni.setGUID(0)
-
-# build our avatars and heros
-avatar = Avatar()
-ani = Animation("warrior-male-stand.png", "stand", 1, 4)
-avatar.add(ani)
-ani = Animation("warrior-male-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-ani = Animation("warrior-male-attack.png", "attack", 4, 4, 60)
-avatar.add(ani)
-avatar.play("walk")
-npc = Hero()
-npc.setName("Rat")
-npc.setAvatar(avatar)
-npc.setGUID(1)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = Animation("townfolk-male-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-npc = NPC()
-npc.setName("Mayor")
-npc.setAvatar(avatar)
-npc.setGUID(2)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = Animation("ranger-male-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-npc = NPC()
-npc.setName("Bolt")
-npc.setAvatar(avatar)
-npc.setGUID(3)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = Animation("healer-male-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-npc = NPC()
-npc.setName("Ax")
-npc.setAvatar(avatar)
-npc.setGUID(4)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = Animation("healer-female-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-npc = NPC()
-npc.setName("Tooth")
-npc.setAvatar(avatar)
-npc.setGUID(5)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = Animation("magician-male-walk.png", "walk", [0,1,2,1], 4)
-avatar.add(ani)
-npc = NPC()
-npc.setName("Nail")
-npc.setAvatar(avatar)
-npc.setGUID(6)
-uni.add(npc)
-
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "barrel", (9,1), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = True
-item.setName("Barrel")
-item.setAvatar(avatar)
-item.setGUID(513)
-uni.add(item)
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "sign", (11,1), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Sign")
-item.setAvatar(avatar)
-item.setGUID(514)
-uni.add(item) 
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "rock", (8,9), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = True
-item.setName("Rock")
-item.setAvatar(avatar)
-item.setGUID(515)
-uni.add(item) 
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "stump", (8,7), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Stump")
-item.setAvatar(avatar)
-item.setGUID(516)
-uni.add(item) 
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "stump", (8,7), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Stump")
-item.setAvatar(avatar)
-item.setGUID(517)
-uni.add(item) 
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "stump", (8,7), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Stump")
-item.setAvatar(avatar)
-item.setGUID(518)
-uni.add(item) 
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "stump", (8,7), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Stump")
-item.setAvatar(avatar)
-item.setGUID(519)
-uni.add(item)
-
-avatar = Avatar()
-ani = StaticAnimation("16x16-forest-town.png", "stump", (8,7), (16,16))
-avatar.add(ani)
-item = AvatarObject()
-item.pushable = False
-item.setName("Stump")
-item.setAvatar(avatar)
-item.setGUID(520)
-uni.add(item)
-
-
-
-# build the areas to explore
-
-village = Area()
-uni.add(village)
-village.setMap("village.tmx")
-village.setName("Village")
-village.setGUID(1001)
-
-
-home = Area()
-uni.add(home)
-home.setMap("building0.tmx")
-home.setName("Building0")
-home.setGUID(1002)
-
-
-# finialize exits by adding the needed references
-
-allAreas = [ i for i in uni.getChildren() if isinstance(i, Area) ]
-allExits = defaultdict(list)
-
-# make table of all exits
-for area in allAreas:
-    for guid in area.exits.keys():
-        allExits[guid].append(area)
-        print guid, area
-
-# set the exits properly
-for guid, areaList in allExits.items():
-    if len(areaList) == 2:
-        areaList[0].exits[guid] = (areaList[0].exits[guid][0], areaList[1].guid)
-        areaList[1].exits[guid] = (areaList[1].exits[guid][0], areaList[0].guid)
-
-        print areaList[0], areaList[0].exits
-        print areaList[1], areaList[1].exits
-
-
-uni.save("mh")
+from glob import glob
+import os.path
+
+
+
+savename = "mh"
+cachedir = "build"
+
+
+# the heros and npcs:
+#   class, name, guid, [ (image, animation name, frames, directions, timing) ]
+
+characters = [
+    (Hero, "Rat", 1, [
+        ("warrior-male-stand.png", "stand", 1, 4, None),
+        ("warrior-male-walk.png", "walk", [0,1,2,1], 4, None),
+        ("warrior-male-attack.png", "attack", 4, 4, 60)]),
+    (NPC, "Mayor", 2, [
+        ("townfolk-male-walk.png", "walk", [0,1,2,1], 4, None)]),
+    (NPC, "Bolt", 3, [
+        ("ranger-male-walk.png", "walk", [0,1,2,1], 4, None)]),
+    (NPC, "Ax", 4, [
+        ("healer-male-walk.png", "walk", [0,1,2,1], 4, None)]),
+    (NPC, "Tooth", 5, [
+        ("healer-female-walk.png", "walk", [0,1,2,1], 4, None)]),
+    (NPC, "Nail", 6, [
+        ("magician-male-walk.png", "walk", [0,1,2,1], 4, None)]),
+]
+
+
+# the items:
+#   name, guid, pushable, (image, animation name, tile, size)
+
+items = [
+    ("Barrel", 513, True,  ("16x16-forest-town.png", "barrel", (9,1), (16,16))),
+    ("Sign",   514, False, ("16x16-forest-town.png", "sign", (11,1), (16,16))),
+    ("Rock",   515, True,  ("16x16-forest-town.png", "rock", (8,9), (16,16))),
+    ("Stump",  516, False, ("16x16-forest-town.png", "stump", (8,7), (16,16))),
+    ("Stump",  517, False, ("16x16-forest-town.png", "stump", (8,7), (16,16))),
+    ("Stump",  518, False, ("16x16-forest-town.png", "stump", (8,7), (16,16))),
+    ("Stump",  519, False, ("16x16-forest-town.png", "stump", (8,7), (16,16))),
+    ("Stump",  520, False, ("16x16-forest-town.png", "stump", (8,7), (16,16))),
+]
+
+
+# the areas to explore:
+#   name, guid, map
+
+areas = [
+    ("Village",   1001, "village.tmx"),
+    ("Building0", 1002, "building0.tmx"),
+]
+
+
+
+def buildInputs(builder):
+    """
+    Return a hash of everything that the world is made from.  The classes of
+    the objects are pickled, so the code is part of it.
+    """
+
+    files = []
+    for klass, name, guid, animations in characters:
+        files.extend(res.imagePath(a[0]) for a in animations)
+    for name, guid, pushable, animation in items:
+        files.append(res.imagePath(animation[0]))
+
+    files.extend(sorted(glob(os.path.join("lib", "*.py"))))
+    files.extend(sorted(glob(os.path.join("lib2d", "*.py"))))
+    files.append(__file__)
+
+    maps = [ builder.mapDigest(res.mapPath(a[2])) for a in areas ]
+    return builder.hashFiles(files, (characters, items, areas, maps))
+
+
+def buildWorld(compiled):
+    """
+    Make the world from the compiled maps
+    """
+
+    # build the initial environment
+    uni = Environment()
+    uni.name = 'MH'
+    uni.setGUID(0)
+
+    # build our avatars and heros
+    for klass, name, guid, animations in characters:
+        avatar = Avatar()
+        for filename, aniname, frames, directions, timing in animations:
+            avatar.add(Animation(filename, aniname, frames, directions,
+                                 timing))
+        if klass is Hero:
+            avatar.play("walk")
+
+        npc = klass()
+        npc.setName(name)
+        npc.setAvatar(avatar)
+        npc.setGUID(guid)
+        uni.add(npc)
+
+    for name, guid, pushable, (filename, aniname, tile, size) in items:
+        avatar = Avatar()
+        avatar.add(StaticAnimation(filename, aniname, tile, size))
+        item = AvatarObject()
+        item.pushable = pushable
+        item.setName(name)
+        item.setAvatar(avatar)
+        item.setGUID(guid)
+        uni.add(item)
+
+    # build the areas to explore
+    for name, guid, mapname in areas:
+        area = Area()
+        uni.add(area)
+        area.setMap(mapname, compiled[res.mapPath(mapname)])
+        area.setName(name)
+        area.setGUID(guid)
+
+    # finialize exits by adding the needed references
+
+    allAreas = [ i for i in uni.getChildren() if isinstance(i, Area) ]
+    allExits = defaultdict(list)
+
+    # make table of all exits
+    for area in allAreas:
+        for guid in area.exits.keys():
+            allExits[guid].append(area)
+
+    # set the exits properly
+    for guid, areaList in allExits.items():
+        if len(areaList) == 2:
+            areaList[0].exits[guid] = (areaList[0].exits[guid][0],
+                                       areaList[1].guid)
+            areaList[1].exits[guid] = (areaList[1].exits[guid][0],
+                                       areaList[0].guid)
+
+    # what to preload for each area, so the game doesn't have to load the
+    # objects in an area to find out
+    uni.preloads = dict((area.guid, areaAssets(area)) for area in allAreas)
+
+    return uni
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="build the world for mh")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="build the world even if nothing changed")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of maps to compile at once")
+    options = parser.parse_args()
+
+    pygame.mixer.init()
+
+    builder = WorldBuilder(cachedir, options.jobs)
+    inputs = buildInputs(builder)
+    exists = os.path.exists(savename + "-index.txt")
+
+    if exists and not options.force and builder.isCurrent(savename, inputs):
+        print "{} is up to date".format(savename)
+        return
+
+    compiled = builder.compileMaps([ res.mapPath(a[2]) for a in areas ])
+    for path in builder.compiled:
+        print "compiled", os.path.basename(path)
+    for path in builder.cached:
+        print "cached  ", os.path.basename(path)
+
+    uni = buildWorld(compiled)
+    uni.save(savename)
+    builder.setCurrent(savename, inputs)
+    print "saved", savename
+
+
+# the maps are compiled in other processes, which may import this
+if __name__ == "__main__":
+    main()
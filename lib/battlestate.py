@@ -339,6 +339,7 @@ class StackState(GameState):
 
                 if target.hp <=0 :
                     target.isAlive = False
+                    target.markChanged("isAlive")
 
                 if not spell.finished:
                     self.parent.stale_spells.append((spell, caller, target))
@@ -61,6 +61,9 @@ class TextDialog(GameState):
 
 
     def draw(self, surface):
+        # the text is only drawn once, then nothing changes until it is closed
+        dirty = []
+
         if self.blank:
             self.blank = False
 
@@ -71,6 +74,7 @@ class TextDialog(GameState):
             x, y = 0.0313 * sw, 0.6667 * sh
             w, h = 0.9375 * sw, 0.2917 * sh
             self.border.draw(surface, (x, y, w, h))
+            dirty.append(Rect(x, y, w, h))
            
             fullpath = res.fontPath("dpcomic.ttf")
             font = pygame.font.Font(fullpath, fontSize)
@@ -89,7 +93,7 @@ class TextDialog(GameState):
                                            int(fontSize*1.25), font=self.font)
                 title_image = banner.render()
                 x, y = 0.4688 * sw, 0.625 * sh
-                surface.blit(title_image, (x, y))
+                dirty.append(surface.blit(title_image, (x, y)))
 
             # show arrow
             #x, y = 0.0625 * sw, 0.9167 * sh
@@ -100,6 +104,8 @@ class TextDialog(GameState):
             self.wait_sound.stop()
             self.wait_sound.play()
 
+        return dirty
+
 
     def handle_commandlist(self, cmdlist):
         for cls, cmd, arg in cmdlist:
@@ -164,15 +170,19 @@ class ChoiceDialog(GameState):
         pass
 
     def draw(self, surface):
+        # only the parts drawn this frame are returned
+        dirty = []
+
         # fade in the dialog box background
         if self.state == 0:
-            surface.blit(self.bkg, (10,160))
+            dirty.append(surface.blit(self.bkg, (10,160)))
             self.counter += 1
             if self.counter == 6:
                 self.bkg.set_alpha(0)
                 self.bkg = self.bkg.convert()
             elif self.counter == 7:
-                surface.fill((128,128,128), (14, 146, self.bkg.get_size()))
+                dirty.append(surface.fill((128,128,128),
+                                          ((14, 146), self.bkg.get_size())))
                 print "fill"
                 self.counter = 0
                 self.state = 1
@@ -181,7 +191,7 @@ class ChoiceDialog(GameState):
         # fade in the title, if any
         elif self.state == 1:
             if self.title != None:
-                surface.blit(self.title_image, (15,150))
+                dirty.append(surface.blit(self.title_image, (15,150)))
                 self.counter += 1
                 if self.counter == 3:
                     self.state = 2
@@ -201,14 +211,15 @@ class ChoiceDialog(GameState):
 
             for line in wrap(self.text, self.wrap_width):
                 banner = TextBanner(line, size=self.text_size)
-                surface.blit(banner.render(self.background), (x,y))
+                dirty.append(surface.blit(banner.render(self.background),
+                                          (x,y)))
                 y += banner.font.size(line)[1]
 
             self.menu = cMenu(Rect((25,210),(280, 30)),
                 5, 5, 'horizontal', 10,
                 [('Yes', self.yes),
                 ('No', self.no)],
-                font="fonts/dpcomic.ttf", font_size=16)
+                font="dpcomic.ttf", font_size=16)
 
             self.menu.ready()
             self.wait_sound.stop()
@@ -216,7 +227,9 @@ class ChoiceDialog(GameState):
             self.state = 3
 
         elif self.state == 3:
-            self.menu.draw(surface)
+            dirty = self.menu.draw(surface)
+
+        return dirty
 
     def handle_event(self, event):
         if self.state > 2:
@@ -20,21 +20,27 @@ class PauseState(GameState):
         GameState.__init__(self, driver)
 
     def activate(self):
-        pass
+        self.blank = True
 
     # when focus is given again
     def reactivate(self):
-        pass
+        self.blank = True
 
     # when losing focus
     def deactivate(self):
         pass
 
     def draw(self, surface):
-        self.world.draw(surface)
+        # the world is paused, so it only needs to be drawn once
+        if self.blank:
+            self.blank = False
+            self.world.draw(surface)
+            return None
+        return []
 
     # time is ms since last call
     def update(self, time):
+        pass
 
     def handle_event(self, event):
         self.world.handle(event)
@@ -1,5 +1,6 @@
 from lib2d.tilemap import BufferedTilemapRenderer
 from lib2d.objects import AvatarObject
+from lib2d.atlas import packAvatars
 
 from pygame.rect import Rect
 
@@ -13,16 +14,27 @@ class AreaCamera(object):
     """
     Base class for displaying maps.  Not really featured, here, you should
     subclass it.
+
+    Only avatars of objects near the camera's extent are considered for
+    drawing.  The area's object index is used to find them, so the avatars
+    that are off screen are never touched.
     """
 
+    # avatar images can be larger than the object's bbox
+    # this is how far outside the extent to look for avatars, in pixels
+    cullMargin = 32
+
     def __init__(self, area, extent=None, tmxdata=None):
         self.area = area
         self.set_extent(extent)
         self.zoom = 1.0
         self.avatars = []
+        self._avatarsByObject = {}
 
         # create a renderer for the map
-        self.maprender = BufferedTilemapRenderer(tmxdata, self.extent.size)
+        self.maprender = BufferedTilemapRenderer(tmxdata, self.extent.size,
+                                                 chunkSize=8,
+                                                 blitBudget=2000)
 
         self.map_width = tmxdata.tilewidth * tmxdata.width
         self.map_height = tmxdata.tileheight*tmxdata.height
@@ -38,6 +50,10 @@ class AreaCamera(object):
             if isinstance(child, AvatarObject):
                 child.avatar.update(0)              # hack to re-init avatar
                 self.avatars.append(child.avatar)
+                self._avatarsByObject[child] = child.avatar
+
+        # put all the frames into a few surfaces
+        self.atlas = packAvatars(self.avatars)
 
 
     def set_extent(self, extent):
@@ -53,7 +69,7 @@ class AreaCamera(object):
 
 
     def update(self, time):
-        self.maprender.update(None)
+        self.maprender.update(time)
         [ a.update(time) for a in self.avatars ]
 
 
@@ -92,9 +108,20 @@ class AreaCamera(object):
         raise NotImplementedError
 
 
+    def getNearbyAvatars(self):
+        """
+        Return avatars whose objects are within cullMargin of the extent
+        """
+
+        m = self.cullMargin * 2
+        near = self.area.getObjectsInRect(self.extent.inflate(m, m))
+        byObject = self._avatarsByObject
+        return [ byObject[obj] for obj in near if obj in byObject ]
+
+
     def draw(self, surface, origin=(0,0)):
         avatars = []
-        for a in self.avatars:
+        for a in self.getNearbyAvatars():
             aWidth, aHeight = a.get_size()
             d, w, h = a.getSize()
             x, y = self.toSurface(a.getPosition())
@@ -110,7 +137,7 @@ class AreaCamera(object):
         onScreen = [ (a.image, r, 2) for a, r in avatars ]
         onScreen.sort(key=screenSorter)
 
-        self.maprender.draw(surface, onScreen, origin)
+        return self.maprender.draw(surface, onScreen, origin)
 
 
     def toScreen(self, pos):
@@ -101,11 +101,13 @@ class LivingObject(AvatarObject):
     def stick(self):
         self.parent.stick(self)
         self.stuck = True
+        self.markChanged("stuck")
 
 
     def unstick(self):
         self.parent.unstick(self)
         self.stuck = False
+        self.markChanged("stuck")
 
 
     def getObjectInFront(self):
@@ -144,6 +146,7 @@ class LivingObject(AvatarObject):
                 self.parent.movePosition(other, (dx, dy, dz))
                 self.arms = LIFT
                 self.join = other
+                self.markChanged("arms", "join")
                 self.parent.join(self, other)
                 return True
 
@@ -170,6 +173,7 @@ class LivingObject(AvatarObject):
             self.parent.unjoin(self, self.join)
             self.arms = None
             self.join = None
+            self.markChanged("arms", "join")
             return True
    
 
@@ -186,6 +190,7 @@ class LivingObject(AvatarObject):
                 self.parent.join(self, other)
                 self.arms = GRAB
                 self.join = other
+                self.markChanged("arms", "join")
                 return True
 
         return False 
@@ -199,6 +204,7 @@ class LivingObject(AvatarObject):
         self.parent.unjoin(self, self.join)
         self.arms = None
         self.join = None
+        self.markChanged("arms", "join")
         return True
 
 
@@ -1,3 +1,4 @@
+from lib2d import res
 import pygame
 import os
 
@@ -16,7 +17,8 @@ def load(iterator):
     classes = globals().keys()
     classes = [ i for i in classes if not i[0] == "_" ]
 
-    remove = ("load", "tilesheet", "get_icon", "pygame", "os", "icon_size", "Spell")
+    remove = ("load", "tilesheet", "get_icon", "pygame", "os", "icon_size",
+              "Spell", "res")
     [ classes.remove(i) for i in remove ]
     ret = []
 
@@ -28,11 +30,20 @@ def load(iterator):
 
     return ret
 
-tilesheet = os.path.join("resources", "misc", "spellicons.png")
+tilesheet = "spellicons.png"
 icon_size = (32, 32)
 
 def get_icon(position):
-    image = pygame.image.load(tilesheet)
+    """
+    icons are cached, so the tilesheet is only opened once
+    """
+
+    position = tuple(position)
+    return res.cache.get(("spell icon", position),
+                         lambda: _cut_icon(position))
+
+def _cut_icon(position):
+    image = res.loadImage(tilesheet, alpha=True)
     x = position[0] * icon_size[0]
     y = position[1] * icon_size[1]
     icon = pygame.Surface(icon_size, pygame.SRCALPHA)
@@ -88,6 +99,7 @@ class Attack(Spell):
 
     def update(self):
         self.target.hp -= self.caller.str
+        self.target.markChanged("hp")
         self.caller.avatar.play("attack00")
         self.text = "{0}".format(self.caller.str)
 
@@ -111,6 +123,7 @@ class Poison(Spell):
 
         self.target.condition += POISONED
         self.target.hp -= 2
+        self.target.markChanged("condition", "hp")
         self.text = "-{0}".format(self.strength)
 
     def finish(self):
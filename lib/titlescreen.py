@@ -65,6 +65,7 @@ class TitleScreen(GameState):
         self.change_delay = 8000        # seconds until map moves to next point
         self.map_fadeout = 60.0         # must be a float
         self.last_update = 0
+        self.lastFrame = None
         self.surfaceQueue = queue()
         self.subpixelQueue = queue()
 
@@ -135,6 +136,15 @@ class TitleScreen(GameState):
 
 
     def draw(self, surface):
+        # the maps only need to be drawn again if one moved or is fading out
+        frame = [ (i[5].at(i[0], i[1]), int(i[0]), int(i[1]), i[4])
+                  for i in self.maps ]
+
+        if frame == self.lastFrame:
+            return self.menu.draw(surface)
+
+        self.lastFrame = frame
+
         if len(self.maps) == 0:
             surface.fill((0,0,0))
             msg = TextBanner("Please wait...", (128, 128, 128), size=10)
@@ -7,6 +7,7 @@ from lib2d.buttons import *
 from lib2d.vec import Vec2d
 from lib2d.quadtree import QuadTree, FrozenRect
 from lib2d import tmxloader, res, gui
+from lib2d.preload import preloader
 
 from math import sqrt, atan2
 from operator import itemgetter
@@ -100,6 +101,21 @@ class WorldState(GameState):
         self.background = (203, 204, 177)
         self.foreground = (0, 0, 0)
         self.blank = True
+        self.lastLog = None
+
+        # areas behind exits are loaded in the background when the hero is
+        # this many tiles away from them
+        self.preloadDistance = 6
+        self.preloadBudget = 2000       # microseconds per update
+        self.preloaded = set()          # guids of areas already requested
+
+        # if the world was loaded from a save, it is saved to autosaveName
+        # this often (milliseconds).  the first autosave copies the save it
+        # was loaded from, so that one (the world as it was built) is never
+        # changed.
+        self.autosaveName = "save0"
+        self.autosaveInterval = 5000
+        self.autosaveTimer = 0
 
 
     def activate(self):
@@ -124,7 +140,9 @@ class WorldState(GameState):
 
         # load the tmx data here.  it will be shared with the camera.
         self.tmxdata = tmxloader.load_pygame(
-                       self.area.mappath, force_colorkey=(128,128,0))
+                       self.area.mappath, force_colorkey=(128,128,0),
+                       cache=True, atlas=True,
+                       image_loader=preloader.loadTileset)
 
         # attach a camera
         sw, sh = sd.get_size()
@@ -134,6 +152,7 @@ class WorldState(GameState):
                                  tmxdata=self.tmxdata)
 
         self.mapBorder = pygame.Rect((0,0,mw+6,mh+6))
+        self.mapRect = pygame.Rect((4,4,mw,mh))
         self.msgBorder = pygame.Rect((0,mh,sw,sh-mh))
         self.hudBorder = pygame.Rect((mw,0,sw-mw,mh+6))
 
@@ -165,6 +184,9 @@ class WorldState(GameState):
                     if key[4:].lower() == "sound":
                         self.sounds[value] = res.loadSound(value)
 
+        # the hero may have started close to an exit
+        self.preloadExits()
+
         # determine if the hero is on an exit warp.
         # if so, then we need to ignore collisions with it until the player
         # moves off of the exit.
@@ -193,28 +215,57 @@ class WorldState(GameState):
         surface.blit(i, (sx+ 10, sy+30))
 
 
+    def reactivate(self):
+        # another state may have drawn over us
+        self.blank = True
+
+
     def draw(self, surface):
         sx, sy = surface.get_size()
 
         if self.blank:
             self.blank = False
+            self.lastLog = None
             surface.fill(self.background)
             self.drawSidebar(surface, self.hudBorder)
+            dirty = None
+        else:
+            dirty = []
 
-        # the main map
-        self.camera.center(self.area.getPosition(self.hero))
-        self.camera.draw(surface, origin=(4, 4))
-
-        # borders
-        self.borderFilled.draw(surface, self.msgBorder)
-        self.border.draw(surface, self.mapBorder)
-
+        # the message log only needs to be drawn when it changes.  it is
+        # drawn first, so the map is always over the part they share
         log = "\n".join(self.area.messages[-5:])
-        rect = self.msgBorder.inflate(-16,-12)
-        gui.drawText(surface, log, (0,0,0), rect, self.msgFont)
+        borderClips = [ self.mapRect ]
+        if not log == self.lastLog:
+            self.lastLog = log
+            self.borderFilled.draw(surface, self.msgBorder)
+            rect = self.msgBorder.inflate(-16,-12)
+            gui.drawText(surface, log, (0,0,0), rect, self.msgFont)
+            borderClips.append(self.msgBorder)
+            if dirty is not None:
+                dirty.append(self.msgBorder)
+
+        # the main map.  the camera returns a rect if all of it changed,
+        # otherwise a list of the parts that did
+        self.camera.center(self.area.getPosition(self.hero))
+        mapRect = self.camera.draw(surface, origin=(4, 4))
+        partial = dirty is not None and isinstance(mapRect, list)
+
+        # borders.  they are blended with what is under them, so they are
+        # only drawn again over the parts that were just drawn
+        if partial:
+            for clip in borderClips:
+                surface.set_clip(clip)
+                self.border.draw(surface, self.mapBorder)
+            surface.set_clip(None)
+            dirty.extend(mapRect)
 
+        else:
+            self.border.draw(surface, self.mapBorder)
+            if dirty is not None:
+                dirty.append(self.mapBorder.union(mapRect))
 
-        return
+        return dirty
 
         # debug stuff...may/may not work
         for obj, pos in self.area.getPositions():
@@ -236,10 +287,57 @@ class WorldState(GameState):
                      (sx, sy)))
     
  
+    def preloadExits(self):
+        """
+        Start loading the areas behind the exits that the hero is near
+        """
+
+        # exits are (horizontal, vertical), but positions in the area are
+        # (vertical, horizontal).  see AreaCamera.toSurface.
+        y, x, z = self.area.getPosition(self.hero)
+        dx = self.preloadDistance * self.tmxdata.tileheight
+        dy = self.preloadDistance * self.tmxdata.tilewidth
+
+        # kept when the world was built.  the areas themselves are not
+        # loaded, since that would load everything in them.
+        preloads = getattr(self.area.getRoot(), "preloads", {})
+
+        for param in self.area.exits.values():
+            try:
+                (ex, ey, el), guid = param
+            except:
+                continue
+
+            if guid is None or guid in self.preloaded:
+                continue
+
+            if abs(ex - x) <= dx and abs(ey - y) <= dy:
+                self.preloaded.add(guid)
+                assets = preloads.get(guid, None)
+                if assets is not None:
+                    preloader.preloadArea(assets)
+
+
+    def autosave(self):
+        """
+        Write the changes to the world since the last save, if it has one
+        """
+
+        root = self.area.getRoot()
+        if root.__dict__.get("_store", None) is not None:
+            root.autosave(self.autosaveName)
+
+
     def update(self, time):
 
         self.area.update(time)
         self.camera.update(time)
+        preloader.update(self.preloadBudget)
+
+        self.autosaveTimer += time
+        if self.autosaveTimer >= self.autosaveInterval:
+            self.autosaveTimer = 0
+            self.autosave()
 
         if self.walkSoundPlaying > 0:
             self.walkSoundPlaying += time
@@ -279,6 +377,8 @@ class WorldState(GameState):
                     self.walkSoundPlaying += time
                     self.walkSound.play()
 
+                self.preloadExits()
+
 
                 """
                 # test for collisions with exits
@@ -0,0 +1,292 @@
+"""
+texture atlases: pack lots of small surfaces into a few large ones.
+
+every frame of every animation and every tile of a map is normally its own
+surface.  with a lot of actors on the screen, that is a lot of little
+allocations, and the blitter is always jumping between them.  an atlas copies
+them into a few large pages and hands back subsurfaces of the pages, which can
+be blitted just like the originals.
+
+    >>> atlas = TextureAtlas()
+    >>> frames = atlas.pack(frames)
+
+surfaces can only share a page if they are blitted the same way, so they are
+sorted by pixel format, per-pixel alpha, colorkey and surface alpha first.
+pages are only as large as they need to be.
+
+Copyright 2010, 2011  Leif Theden
+
+
+This file is part of lib2d.
+
+lib2d is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+lib2d is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pygame
+
+
+
+class TextureAtlas(object):
+    """
+    Packs surfaces into pages.  Each call to pack() makes new pages, so pack
+    as much as possible at once.
+    """
+
+    def __init__(self, pageSize=(1024, 1024)):
+        self.pageSize = pageSize
+        self.pages = []
+        self.packed = 0     # number of surfaces packed
+
+
+    def __len__(self):
+        return len(self.pages)
+
+
+    def getMemory(self):
+        """
+        Return the number of bytes used by the pages
+        """
+
+        return sum(p.get_width() * p.get_height() * p.get_bytesize()
+                   for p in self.pages)
+
+
+    def pack(self, surfaces):
+        """
+        Return a list of subsurfaces of the atlas with the same images as
+        surfaces, in the same order.
+
+        Surfaces that are larger than a page are not packed and are returned
+        as they are.  So are any entries that are not surfaces, like the 0s
+        in tmxdata.images.  A surface that is passed more than once is only
+        packed once.
+        """
+
+        pw, ph = self.pageSize
+        result = list(surfaces)
+        groups = {}         # blitting mode: list of indexes into result
+        seen = {}           # id of surface: first index it was found at
+
+        for i, surface in enumerate(result):
+            if not isinstance(surface, pygame.Surface):
+                continue
+
+            if id(surface) in seen:
+                continue
+
+            w, h = surface.get_size()
+            if w > pw or h > ph or w == 0 or h == 0:
+                continue
+
+            seen[id(surface)] = i
+            groups.setdefault(blitMode(surface), []).append(i)
+
+        for mode, indexes in groups.iteritems():
+            sizes = [ result[i].get_size() for i in indexes ]
+            pages, positions = layout(sizes, self.pageSize)
+
+            template = result[indexes[0]]
+            made = [ self.makePage(size, template) for size in pages ]
+
+            for i, (page, x, y) in zip(indexes, positions):
+                original = result[i]
+                copy(original, made[page], (x, y))
+                result[i] = made[page].subsurface(((x, y),
+                                                   original.get_size()))
+
+            self.pages.extend(made)
+            self.packed += len(indexes)
+
+        # surfaces that were passed more than once
+        for i, surface in enumerate(result):
+            if id(surface) in seen and not seen[id(surface)] == i:
+                result[i] = result[seen[id(surface)]]
+
+        return result
+
+
+    def makePage(self, size, template):
+        """
+        Return a new page that will blit the same way as template
+        """
+
+        if pixelAlpha(template):
+            page = pygame.Surface(size, pygame.SRCALPHA, template)
+            page.fill((0, 0, 0, 0))
+            return page
+
+        page = pygame.Surface(size, 0, template)
+        colorkey = template.get_colorkey()
+        if colorkey is not None:
+            page.fill(colorkey)
+            page.set_colorkey(colorkey)
+
+        alpha = template.get_alpha()
+        if alpha is not None:
+            page.set_alpha(alpha)
+
+        return page
+
+
+
+def pixelAlpha(surface):
+    """
+    Return True if surface has an alpha channel.  SRCALPHA is also set for
+    surfaces with only surface alpha in SDL 1.2, so it can't be used.
+    """
+
+    return bool(surface.get_masks()[3])
+
+
+def blitMode(surface):
+    """
+    Return a key that is the same for surfaces that can share a page
+    """
+
+    flags = pixelAlpha(surface)
+    colorkey = surface.get_colorkey()
+    if colorkey is not None:
+        colorkey = tuple(colorkey)
+
+    return (surface.get_bitsize(), surface.get_masks(), flags, colorkey,
+            None if flags else surface.get_alpha())
+
+
+def copy(source, dest, position):
+    """
+    Copy the pixels of source to dest without blending
+    """
+
+    if pixelAlpha(source):
+        # a normal blit would blend with the empty page; adding to it doesn't
+        dest.blit(source, position, None, pygame.BLEND_RGBA_ADD)
+
+    else:
+        # the colorkey of the page is the same, so keyed pixels stay keyed.
+        # the page has the surface alpha too, so don't blend with it here.
+        alpha = source.get_alpha()
+        if alpha is None:
+            dest.blit(source, position)
+        else:
+            source.set_alpha(None)
+            dest.blit(source, position)
+            source.set_alpha(alpha)
+
+
+def layout(sizes, (pw, ph)):
+    """
+    Place rects on pages with shelves.
+
+    Rects are placed from tallest to shortest into rows (shelves), using the
+    shelf that leaves the least space above the rect.  Returns a list of page
+    sizes, and a list of (page, x, y) for each of the sizes.
+    """
+
+    order = sorted(xrange(len(sizes)), key=lambda i: (-sizes[i][1],
+                                                      -sizes[i][0]))
+    positions = [None] * len(sizes)
+    pages = []      # [width used, height used, shelves]
+
+    for i in order:
+        w, h = sizes[i]
+        best = None
+        for p, (used, bottom, shelves) in enumerate(pages):
+            for shelf in shelves:
+                y, height, x = shelf
+                if h <= height and x + w <= pw:
+                    if best is None or height - h < best[0]:
+                        best = (height - h, p, shelf)
+
+        if best is None:
+            # start a new shelf on the last page, or a new page
+            if not pages or pages[-1][1] + h > ph:
+                pages.append([0, 0, []])
+            page = pages[-1]
+            shelf = [page[1], h, 0]
+            page[2].append(shelf)
+            page[1] += h
+            best = (0, len(pages) - 1, shelf)
+
+        waste, p, shelf = best
+        positions[i] = (p, shelf[2], shelf[0])
+        shelf[2] += w
+        pages[p][0] = max(pages[p][0], shelf[2])
+
+    return [ (used, bottom) for used, bottom, shelves in pages ], positions
+
+
+def packAnimations(animations, atlas=None):
+    """
+    Pack the frames of loaded animations into an atlas.  Works with the
+    animations from both avatar and animation.
+
+    Animations that were loaded from the same file will share frames.
+    Returns the atlas.
+    """
+
+    if atlas is None:
+        atlas = TextureAtlas()
+
+    frames = []
+    packing = []        # (animation, index into frames, number of frames)
+    shared = {}         # (class, filename, frames): animation to copy
+
+    for ani in animations:
+        images = getattr(ani, "images", None)
+        if images:
+            key = (ani.__class__, getattr(ani, "filename", None), len(images))
+            if key[1] is not None:
+                if key in shared:
+                    packing.append((ani, shared[key], len(images)))
+                    continue
+                shared[key] = len(frames)
+            packing.append((ani, len(frames), len(images)))
+            frames.extend(images)
+
+        # static animations only have one image
+        elif isinstance(getattr(ani, "image", None), pygame.Surface):
+            packing.append((ani, len(frames), 0))
+            frames.append(ani.image)
+
+    frames = atlas.pack(frames)
+
+    for ani, start, count in packing:
+        if count:
+            ani.images = frames[start:start+count]
+        else:
+            ani.image = frames[start]
+            if isinstance(getattr(ani, "frames", None), list) and \
+               ani.frames and isinstance(ani.frames[0], pygame.Surface):
+                ani.frames = [ani.image]
+
+    return atlas
+
+
+def packAvatars(avatars, atlas=None):
+    """
+    Pack the frames of all the animations of the avatars into an atlas.
+    Returns the atlas.
+    """
+
+    animations = []
+    for avatar in avatars:
+        animations.extend(avatar.animations.itervalues())
+
+    atlas = packAnimations(animations, atlas)
+
+    # the avatars may be holding on to the old frames
+    for avatar in avatars:
+        avatar.curImage = None
+
+    return atlas
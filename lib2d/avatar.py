@@ -56,6 +56,13 @@ class Avatar(GameObject):
         self._is_paused = False
 
 
+    def __getstate__(self):
+        # the image is found again when it is drawn
+        d = GameObject.__getstate__(self)
+        d['curImage'] = None
+        return d
+
+
     def _updateCache(self):
         angle = self.getOrientation()
 
@@ -101,6 +108,7 @@ class Avatar(GameObject):
     @visible.setter
     def visible(self, value):
         self._is_visible = bool(value)
+        self.markChanged("_is_visible")
 
 
     @property
@@ -116,6 +124,7 @@ class Avatar(GameObject):
     @paused.setter
     def paused(self, value):
         self._is_paused = bool(value)
+        self.markChanged("_is_paused")
 
 
     def update(self, time):
@@ -165,6 +174,7 @@ class Avatar(GameObject):
                 else:
                     self.setFrame(self.loop_frame)
                     self.looped += 1
+                    self.markChanged("looped")
 
             # loop forever, don't count the loops
             else:
@@ -232,12 +242,16 @@ class Avatar(GameObject):
         if callback:
             self.callback = (callback, arg)
 
+        # the frame and timer change every frame, so they are not marked
+        self.markChanged("curAnimation", "loop", "loop_frame", "looped",
+                         "callback")
         self.setFrame(start_frame)
 
 
     def add(self, other):
         if isinstance(other, Animation):
             self.animations[other.name] = other
+            self.markChanged("animations")
             if self.default == None:
                 self.setDefault(other)
             
@@ -262,13 +276,14 @@ class Avatar(GameObject):
 
         if isinstance(name, Animation):
             self.default = name
-            return
         else:
             try:
                 self.default = self.getAnimation(name)
             except KeyError:
                 return
 
+        self.markChanged("default")
+
 
     def __str__(self):
         return "<Avatar %s>" % id(self)
@@ -313,6 +328,13 @@ class Animation(GameObject):
         self.images = []
 
 
+    def __getstate__(self):
+        # surfaces can't be pickled.  they are loaded again by load()
+        d = GameObject.__getstate__(self)
+        d['images'] = []
+        return d
+
+
     def load(self):
         """
         load the images for use with pygame
@@ -382,6 +404,14 @@ class StaticAnimation(Animation):
 
         self.image = None
 
+
+    def __getstate__(self):
+        d = GameObject.__getstate__(self)
+        d['image'] = None
+        d.pop('frames', None)
+        return d
+
+
     def returnNew(self):
         new = StaticAnimation(self.filename, self.name, self.tile, self.size)
         return new
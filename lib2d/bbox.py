@@ -1,3 +1,6 @@
+from array import array
+
+
 def intersect(a, b):
     return (((a.back   >= b.back   and a.back   < b.front)   or
              (b.back   >= a.back   and b.back   < a.front))  and
@@ -245,3 +248,297 @@ class BBox(object):
     @property
     def z(self):
         return self._z
+
+
+
+class BBoxStore(object):
+    """
+    Dict-like container that maps objects to bboxes, but keeps the values in
+    six contiguous arrays (x, y, z, w, h, d) instead of a BBox per object.
+
+    Each object is given a slot in the arrays when it is added.  Setting the
+    bbox of an object just writes the six values into its slot, so nothing is
+    allocated when objects move around.  The arrays can be used directly
+    for bulk operations, see asArrays().
+
+    Getting an item returns a BBoxView, which can be used like a BBox.  Views
+    are LIVE: they will change when the object is moved.  Use copy() on the
+    view to get a BBox that won't change.
+    """
+
+    def __init__(self, initial=None):
+        self.x = array('d')
+        self.y = array('d')
+        self.z = array('d')
+        self.w = array('d')
+        self.h = array('d')
+        self.d = array('d')
+        self.slots = {}     # obj: slot
+        self._views = {}    # obj: BBoxView
+        self._free = []     # slots that can be reused
+
+        if initial:
+            for obj, bbox in initial.items():
+                self[obj] = bbox
+
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['_views'] = {}
+        return d
+
+
+    def __len__(self):
+        return len(self.slots)
+
+
+    def __contains__(self, obj):
+        return obj in self.slots
+
+
+    def __iter__(self):
+        return iter(self.slots)
+
+
+    def __getitem__(self, obj):
+        try:
+            return self._views[obj]
+        except KeyError:
+            view = BBoxView(self, self.slots[obj])
+            self._views[obj] = view
+            return view
+
+
+    def __setitem__(self, obj, bbox):
+        x, y, z, w, h, d = bbox
+
+        try:
+            i = self.slots[obj]
+        except KeyError:
+            if self._free:
+                i = self._free.pop()
+            else:
+                i = len(self.x)
+                for a in (self.x, self.y, self.z, self.w, self.h, self.d):
+                    a.append(0.0)
+            self.slots[obj] = i
+
+        self.x[i] = x
+        self.y[i] = y
+        self.z[i] = z
+        self.w[i] = w
+        self.h[i] = h
+        self.d[i] = d
+
+
+    def __delitem__(self, obj):
+        self._free.append(self.slots.pop(obj))
+        self._views.pop(obj, None)
+
+
+    def keys(self):
+        return self.slots.keys()
+
+
+    def items(self):
+        return [ (obj, self[obj]) for obj in self.slots ]
+
+
+    def values(self):
+        return [ self[obj] for obj in self.slots ]
+
+
+    def get(self, obj, default=None):
+        if obj in self.slots:
+            return self[obj]
+        return default
+
+
+    def pop(self, obj, *default):
+        try:
+            bbox = BBox(self[obj])
+        except KeyError:
+            if default: return default[0]
+            raise
+        del self[obj]
+        return bbox
+
+
+    def move(self, obj, x, y, z):
+        """
+        Move an object in place
+        """
+
+        i = self.slots[obj]
+        self.x[i] += x
+        self.y[i] += y
+        self.z[i] += z
+
+
+    def setOrigin(self, obj, x, y, z):
+        """
+        Put an object somewhere else, in place
+        """
+
+        i = self.slots[obj]
+        self.x[i] = x
+        self.y[i] = y
+        self.z[i] = z
+
+
+    def asArrays(self):
+        """
+        Return the six arrays as numpy arrays and a boolean array of the slots
+        that are in use.  The numpy arrays share memory with the store, so
+        they will reflect changes made after this is called, but they must
+        not be used after objects are added since the store may have grown.
+
+        requires numpy
+        """
+
+        import numpy
+
+        used = numpy.zeros(len(self.x), dtype=bool)
+        used[self.slots.values()] = True
+
+        return tuple(numpy.frombuffer(a, dtype=float) for a in
+                     (self.x, self.y, self.z, self.w, self.h, self.d)) + (used,)
+
+
+class BBoxView(object):
+    """
+    Read only view of a bbox in a BBoxStore.  Can be used where a BBox is
+    expected.  See BBoxStore.
+    """
+
+    __slots__ = ['_store', '_slot']
+
+    def __init__(self, store, slot):
+        self._store = store
+        self._slot = slot
+
+
+    def __repr__(self):
+        return "<bbox view: {} {} {} {} {} {}>".format(*self)
+
+
+    def __len__(self): return 6
+
+
+    def __getitem__(self, key):
+        s = self._store
+        if key == 0:
+            return s.x[self._slot]
+        elif key == 1:
+            return s.y[self._slot]
+        elif key == 2:
+            return s.z[self._slot]
+        elif key == 3:
+            return s.w[self._slot]
+        elif key == 4:
+            return s.h[self._slot]
+        elif key == 5:
+            return s.d[self._slot]
+        raise IndexError, key
+
+
+    def __iter__(self):
+        s, i = self._store, self._slot
+        return iter((s.x[i], s.y[i], s.z[i], s.w[i], s.h[i], s.d[i]))
+
+
+    def copy(self):
+        return BBox(self)
+
+
+    def move(self, x, y, z):
+        s, i = self._store, self._slot
+        return BBox(s.x[i] + x, s.y[i] + y, s.z[i] + z,
+                    s.w[i],     s.h[i],     s.d[i])
+
+
+    def collidebbox(self, other):
+        return intersect(self, BBox(other))
+
+
+    def collidelistall(self, l):
+        return [ i for i, bbox in enumerate(l)
+                if intersect(self, bbox) ]
+
+
+    @property
+    def back(self):
+        return self._store.x[self._slot]
+
+
+    @property
+    def left(self):
+        return self._store.y[self._slot]
+
+
+    @property
+    def bottom(self):
+        return self._store.z[self._slot]
+
+
+    @property
+    def front(self):
+        return self._store.x[self._slot] + self._store.d[self._slot]
+
+
+    @property
+    def right(self):
+        return self._store.y[self._slot] + self._store.w[self._slot]
+
+
+    @property
+    def top(self):
+        return self._store.z[self._slot] + self._store.h[self._slot]
+
+
+    @property
+    def size(self):
+        s, i = self._store, self._slot
+        return s.d[i], s.w[i], s.h[i]
+
+
+    @property
+    def origin(self):
+        s, i = self._store, self._slot
+        return s.x[i], s.y[i], s.z[i]
+
+
+    @property
+    def bottomcenter(self):
+        s, i = self._store, self._slot
+        return s.x[i] + s.d[i] / 2, s.y[i] + s.w[i] / 2, s.z[i]
+
+
+    @property
+    def width(self):
+        return self._store.w[self._slot]
+
+
+    @property
+    def height(self):
+        return self._store.h[self._slot]
+
+
+    @property
+    def depth(self):
+        return self._store.d[self._slot]
+
+
+    @property
+    def x(self):
+        return self._store.x[self._slot]
+
+
+    @property
+    def y(self):
+        return self._store.y[self._slot]
+
+
+    @property
+    def z(self):
+        return self._store.z[self._slot]
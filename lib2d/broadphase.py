@@ -0,0 +1,234 @@
+"""
+Broad-phase collision detection for objects in an area.
+
+A broad phase is a quick way to find objects that *might* be colliding so
+that the slow, exact test only has to be done on a few of them.  Area keeps
+one up to date as objects are moved around and asks it for candidates when
+testing collisions.
+
+All broad phases here share the same interface, so they can be swapped out
+with Area.setBroadPhase().  Each one is created with the extent of the area:
+
+    add(obj, rect)      start tracking obj
+    update(obj, rect)   obj has moved or changed size
+    remove(obj)         stop tracking obj
+    query(rect)         list of objects that overlap the rect
+    pairs()             list of (obj, obj) tuples that overlap each other
+
+rects are (left, top, width, height) and overlap the same way pygame rects
+do: sharing an edge is not a collision.  objects must be hashable.
+"""
+
+from quadtree import DynamicQuadTree
+
+
+
+def overlaps((l1, t1, r1, b1), (l2, t2, r2, b2)):
+    return l1 < r2 and r1 > l2 and t1 < b2 and b1 > t2
+
+
+class BroadPhase(object):
+    """
+    Base class for broad phases.  Doesn't do anything.
+    """
+
+    def __init__(self, extent):
+        pass
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, obj):
+        raise NotImplementedError
+
+    def add(self, obj, rect):
+        raise NotImplementedError
+
+    def update(self, obj, rect):
+        raise NotImplementedError
+
+    def remove(self, obj):
+        raise NotImplementedError
+
+    def query(self, rect):
+        raise NotImplementedError
+
+    def pairs(self):
+        raise NotImplementedError
+
+
+class QuadTreeBroadPhase(BroadPhase):
+    """
+    Broad phase that uses a DynamicQuadTree.
+
+    Good for areas where the objects are clumped together in a few places.
+    """
+
+    def __init__(self, extent, **kwargs):
+        BroadPhase.__init__(self, extent)
+        self.tree = DynamicQuadTree(extent, **kwargs)
+        self.handles = {}
+
+
+    def __len__(self):
+        return len(self.handles)
+
+
+    def __contains__(self, obj):
+        return obj in self.handles
+
+
+    def add(self, obj, rect):
+        self.handles[obj] = self.tree.insert(rect, obj)
+
+
+    def update(self, obj, rect):
+        self.tree.move(self.handles[obj], rect)
+
+
+    def remove(self, obj):
+        self.tree.remove(self.handles.pop(obj))
+
+
+    def query(self, rect):
+        return self.tree.hit(rect)
+
+
+    def pairs(self):
+        hitHandles = self.tree.hitHandles
+        pairs = []
+
+        for handle in self.handles.itervalues():
+            rect = (handle.left, handle.top,
+                    handle.right - handle.left, handle.bottom - handle.top)
+
+            # each pair will be found twice, so only keep one of them
+            pairs.extend((handle.value, other.value)
+                         for other in hitHandles(rect)
+                         if id(other) < id(handle))
+
+        return pairs
+
+
+class SpatialHash(BroadPhase):
+    """
+    Broad phase that divides the area into a uniform grid of cells.
+
+    Each object is filed under every cell it touches.  Moving an object
+    around inside the same cells is just an assignment, which makes this
+    very fast for lots of small objects that move a little bit every update.
+
+    cell_size should be a bit larger than the typical object.
+    """
+
+    def __init__(self, extent, cell_size=32):
+        BroadPhase.__init__(self, extent)
+        self.cell_size = cell_size
+        self.cells = {}     # (x, y): set of objects in that cell
+        self.rects = {}     # obj: (left, top, right, bottom)
+        self.ranges = {}    # obj: (x0, y0, x1, y1) range of cells it is in
+
+
+    def __len__(self):
+        return len(self.rects)
+
+
+    def __contains__(self, obj):
+        return obj in self.rects
+
+
+    def _cellRange(self, (l, t, r, b)):
+        size = self.cell_size
+
+        # objects that end exactly on a cell border do not touch the next one
+        return (int(l // size), int(t // size),
+                int((r - 1) // size) if r > l else int(l // size),
+                int((b - 1) // size) if b > t else int(t // size))
+
+
+    def _file(self, obj, (x0, y0, x1, y1)):
+        cells = self.cells
+        for y in xrange(y0, y1 + 1):
+            for x in xrange(x0, x1 + 1):
+                try:
+                    cells[(x, y)].add(obj)
+                except KeyError:
+                    cells[(x, y)] = set([obj])
+
+
+    def _unfile(self, obj, (x0, y0, x1, y1)):
+        cells = self.cells
+        for y in xrange(y0, y1 + 1):
+            for x in xrange(x0, x1 + 1):
+                cell = cells[(x, y)]
+                cell.discard(obj)
+                if not cell:
+                    del cells[(x, y)]
+
+
+    def add(self, obj, rect):
+        l, t, w, h = rect
+        rect = (l, t, l + w, t + h)
+        cellRange = self._cellRange(rect)
+        self.rects[obj] = rect
+        self.ranges[obj] = cellRange
+        self._file(obj, cellRange)
+
+
+    def update(self, obj, rect):
+        l, t, w, h = rect
+        rect = (l, t, l + w, t + h)
+        cellRange = self._cellRange(rect)
+        self.rects[obj] = rect
+
+        old = self.ranges[obj]
+        if not old == cellRange:
+            self._unfile(obj, old)
+            self._file(obj, cellRange)
+            self.ranges[obj] = cellRange
+
+
+    def remove(self, obj):
+        del self.rects[obj]
+        self._unfile(obj, self.ranges.pop(obj))
+
+
+    def query(self, rect):
+        l, t, w, h = rect
+        rect = (l, t, l + w, t + h)
+        x0, y0, x1, y1 = self._cellRange(rect)
+        cells = self.cells
+        rects = self.rects
+
+        found = set()
+        for y in xrange(y0, y1 + 1):
+            for x in xrange(x0, x1 + 1):
+                try:
+                    found.update(cells[(x, y)])
+                except KeyError:
+                    pass
+
+        return [ obj for obj in found if overlaps(rect, rects[obj]) ]
+
+
+    def pairs(self):
+        rects = self.rects
+        seen = set()
+        pairs = []
+
+        for cell in self.cells.itervalues():
+            if len(cell) < 2: continue
+
+            cell = list(cell)
+            for i, a in enumerate(cell):
+                ra = rects[a]
+                for b in cell[i+1:]:
+                    # objects that share more than one cell are only
+                    # reported once
+                    key = (a, b) if id(a) < id(b) else (b, a)
+                    if key in seen: continue
+                    seen.add(key)
+                    if overlaps(ra, rects[b]):
+                        pairs.append(key)
+
+        return pairs
@@ -74,6 +74,8 @@ class cMenu():
 
         self.banner_style = banner_style          # type of font to use
         self.dirty = True
+        self.drawn = []                           # (rect, color, text) of the
+                                                  # items when last drawn
 
         # This dictionary contains the alignment orientation of the buttons
         # related to each other.  It shifts the button within the bounds of
@@ -108,12 +110,24 @@ class cMenu():
         self.menu_items.append(button)
 
     def draw(self, surface):
+        """
+        draw the menu.  returns the rects of the items that look different
+        than they did the last time the menu was drawn.
+        """
+
         if self.update_buttons:
             self.position_items()
             self.render()
             self.update_buttons = False
 
-        [ surface.blit(b.image, b.rect) for b in self.menu_items ]
+        drawn = [ (surface.blit(b.image, b.rect), tuple(b.color), b.text)
+                  for b in self.menu_items ]
+
+        dirty = [ i[0] for i in drawn if i not in self.drawn ]
+        dirty.extend(i[0] for i in self.drawn if i not in drawn)
+        self.drawn = drawn
+
+        return dirty
 
     @property
     def drawables(self):
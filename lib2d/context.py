@@ -21,6 +21,7 @@ along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
 import gfx
 import pygame
 from lib2d.objects import GameObject
+from profiler import FrameProfiler, EVENTS, UPDATE, DRAW, DISPLAY
 from collections import deque
 from itertools import cycle, islice
 from pygame.locals import *
@@ -155,6 +156,7 @@ class ContextDriver(object):
         self.inputs = []
 
         self.lameduck = None
+        self.profiler = None        # FrameProfiler, if enabled
 
 
         if parent != None:
@@ -190,6 +192,23 @@ class ContextDriver(object):
         self._screen = self.parent.get_screen()
 
 
+    def enable_profiler(self, size=300, overlay=False):
+        """
+        Start timing each phase of the main loop.  Returns the profiler.
+
+        If overlay is True, a graph of the frame times will be drawn over the
+        screen.  See the profiler module.
+        """
+
+        self.profiler = FrameProfiler(size, 1000.0 / self.target_fps)
+        self.profiler.overlay = overlay
+        return self.profiler
+
+
+    def disable_profiler(self):
+        self.profiler = None
+
+
     def done(self):
         """
         deactivate the current state and activate the next state, if any
@@ -309,6 +328,11 @@ class ContextDriver(object):
 
             time = clock.tick(self.target_fps)
 
+            profiler = self.profiler
+            if profiler:
+                profiler.frame()
+                profiler.start(EVENTS)
+
 
 # =============================================================================
 # EVENT HANDLING ==============================================================
@@ -337,31 +361,53 @@ class ContextDriver(object):
 
                 event = event_poll()
 
+            if profiler:
+                profiler.stop()
+
 # =============================================================================
 # STATE UPDATING AND DRAWING HANDLING =========================================
 
             if current_state() is currentState:
 
+                if profiler:
+                    profiler.start(DRAW)
+
                 dirty = currentState.draw(self._screen)
+
+                if profiler:
+                    profiler.stop()
+                    if profiler.overlay:
+                        rect = profiler.draw(self._screen)
+                        if dirty is not None:
+                            dirty = [dirty, rect]
+                    profiler.start(DISPLAY)
+
                 gfx.update_display(dirty)
                 #gfx.update_display()
 
+                if profiler:
+                    profiler.stop()
+
                 # looks awkward?  because it is.  forcibly give small updates
                 # to each object so we don't draw too often.
 
                 time = time / 5.0
 
-                currentState.update(time)
+                update = currentState.update
+                if profiler:
+                    update = profiler.timed(UPDATE, update)
+
+                update(time)
                 currentState = current_state()
                 if not currentState == lastState: continue
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == lastState: continue
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == lastState: continue
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == lastState: continue
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
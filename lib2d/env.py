@@ -3,7 +3,8 @@ import res
 from objects import GameObject
 from math import pi
 from pygame import Rect
-from bbox import BBox
+from bbox import BBox, BBoxStore, intersect
+import broadphase
 
 cardinalDirs = {"north": pi*1.5, "east": 0.0, "south": pi/2, "west": pi}
 
@@ -18,6 +19,15 @@ class DummyQuadTree(object):
     def hit(self, rect):
         return False
 
+    def hitIndexes(self, rect, out=None, limit=0):
+        return 0
+
+    def hitBatch(self, rects, matrix=False):
+        import numpy
+        if matrix:
+            return numpy.zeros((len(rects), 0), dtype=bool)
+        return numpy.zeros(len(rects), dtype=bool)
+
 class Environment(GameObject):
     """
     A game world where objects exist.
@@ -42,6 +52,17 @@ class Area(Environment):
     against the quadtree that is closest.  if there is no quadtree, no
     collision testing will be done.
 
+    objects are also kept in a broad phase (see the broadphase module) once
+    the extent is set, so testing for collisions between objects and finding
+    the objects inside a rect do not have to check every object in the area.
+    the broad phase can be changed with setBroadPhase().
+
+    by default, each object's position is an immutable BBox, so every move
+    creates a new one.  for areas with lots of moving objects, call
+    useBBoxStore() to keep the positions in flat arrays instead.  objects
+    that are moved, turned, added or removed are remembered (see markMoved),
+    so an autosave only writes the positions of those.
+
     for speed, there are a few hacks to be aware of:
         objects move in 3d space, but level geometry is 2d space
         when using pygame rects, the y value maps to the z value in the area
@@ -74,11 +95,73 @@ class Area(Environment):
         self.extent = None       # absolute boundries of the area
         self.joins = []
         self._oldPositions = {}  # used in collision handling
+        self._objectIndex = None # broad phase of objects, built when needed
+        self._broadphaseClass = broadphase.QuadTreeBroadPhase
+        self._broadphaseArgs = {}
 
         self.messages = []
 
         self.time = 0
 
+    def __getstate__(self):
+        # the object index is rebuilt when needed, so don't save it
+        d = Environment.__getstate__(self)
+        d['_objectIndex'] = None
+        d.pop('_moved', None)
+        return d
+
+
+    def markMoved(self, obj):
+        """
+        remember that obj was moved, turned, added or removed, so the next
+        autosave writes where it is.  see getMoved.
+        """
+
+        try:
+            self.__dict__["_moved"].add(obj)
+        except KeyError:
+            self.__dict__["_moved"] = set([obj])
+
+
+    def getMoved(self, objects):
+        """
+        return a dict of the position and orientation of each of the objects,
+        for applyMoved.  objects that are not in the area are None.
+        """
+
+        moved = {}
+        for obj in objects:
+            if obj in self.objects:
+                moved[obj] = (tuple(self.objects[obj]),
+                              self.orientations.get(obj, 0.0))
+
+            # objects that were never saved don't have to be removed
+            elif obj.guid is not None:
+                moved[obj] = None
+
+        return moved
+
+
+    def applyMoved(self, moved):
+        """
+        put objects where getMoved said they were
+        """
+
+        for obj, value in moved.items():
+            if value is None:
+                self.objects.pop(obj, None)
+                self.orientations.pop(obj, None)
+                self._oldPositions.pop(obj, None)
+            else:
+                bbox, angle = value
+                self.objects[obj] = BBox(bbox)
+                self._oldPositions[obj] = BBox(bbox)
+                self.orientations[obj] = angle
+
+        # the index is out of date
+        self._objectIndex = None
+
+
     def update(self, time):
         self.time += time
         [ o.update(time) for o in self.objects ]
@@ -91,6 +174,7 @@ class Area(Environment):
         """
 
         self.joins.append((obj1, obj2))
+        self.markChanged("joins")
 
 
     def unjoin(self, obj1, obj2):
@@ -100,6 +184,7 @@ class Area(Environment):
 
         try:
             self.joins.remove((obj1, obj2))
+            self.markChanged("joins")
             return True
         except:
             return False
@@ -111,6 +196,39 @@ class Area(Environment):
         """
 
         self.extent = Rect(rect)
+        self.markChanged("extent")
+
+        # index depends on the extent, so it must be rebuilt
+        self._objectIndex = None
+
+
+    def useBBoxStore(self):
+        """
+        keep the bboxes of objects in a BBoxStore instead of a dict.
+
+        moving objects will no longer create new BBox objects, and the
+        positions of all objects can be accessed as arrays through
+        self.objects.  note that getBBox and getOldPosition will then return
+        views that change as the object moves.
+        """
+
+        if not isinstance(self.objects, BBoxStore):
+            self.objects = BBoxStore(self.objects)
+            self._oldPositions = BBoxStore(self._oldPositions)
+            self.markChanged("objects", "_oldPositions")
+
+
+    def setBroadPhase(self, klass, **kwargs):
+        """
+        set the class used to find objects that may be colliding.
+        it will be created with the extent of the area and any keywords
+        passed here.  see the broadphase module.
+        """
+
+        self._broadphaseClass = klass
+        self._broadphaseArgs = kwargs
+        self._objectIndex = None
+        self.markChanged("_broadphaseClass", "_broadphaseArgs")
 
 
     def setLayerGeometry(self, layer, rects):
@@ -122,6 +240,7 @@ class Area(Environment):
 
         self.geometry[layer] = quadtree.FastQuadTree(rects)
         self.geoRect = rects
+        self.markChanged("geometry", "geoRect")
 
 
     def testCollideGeometry(self, bbox):
@@ -135,7 +254,7 @@ class Area(Environment):
         layer = 4
 
         try:
-            hit = self.geometry[layer].hit(self.toRect(bbox))
+            hit = self.geometry[layer].hitIndexes(self.toRect(bbox), None, 1)
             return True if hit else False
         except KeyError:
             msg = "Area Layer {} does not have a collision layer"
@@ -145,15 +264,109 @@ class Area(Environment):
             raise Exception, msg.format(layer)
 
 
+    def testCollideGeometryMany(self, bboxes):
+        """
+        test many bboxes against the layer geometry at once.
+
+        returns a numpy array of bools, True where the bbox collides.
+        this is much faster than calling testCollideGeometry for each bbox
+        when moving lots of objects every update.  requires numpy.
+        """
+
+        # TODO: calc layer value
+        layer = 4
+
+        rects = [ (b.left, b.back, b.width, b.depth) for b in bboxes ]
+
+        try:
+            return self.geometry[layer].hitBatch(rects)
+        except KeyError:
+            msg = "Area Layer {} does not have a collision layer"
+            print msg.format(layer)
+            import numpy
+            return numpy.zeros(len(rects), dtype=bool)
+
+
+    def getObjectIndex(self):
+        """
+        Return the broad phase that holds the objects in this area.  It will
+        be built if needed.  Returns None if the extent has not been set.
+        """
+
+        if self._objectIndex is None and self.extent is not None:
+            self._objectIndex = self._broadphaseClass(self.extent,
+                                                      **self._broadphaseArgs)
+            for obj, bbox in self.objects.items():
+                self._indexObject(obj, bbox)
+
+        return self._objectIndex
+
+
+    def _indexObject(self, obj, bbox):
+        """
+        Keep the object index in sync with the object's bbox
+        """
+
+        if self._objectIndex is None: return
+
+        # same as toRect(), but without making a new Rect
+        rect = (bbox.left, bbox.back, bbox.width, bbox.depth)
+        if obj in self._objectIndex:
+            self._objectIndex.update(obj, rect)
+        else:
+            self._objectIndex.add(obj, rect)
+
+
+    def getObjectsInRect(self, rect):
+        """
+        Return list of objects whose 'bottom plane' overlaps the rect.
+        The rect should be in the same coordinate space as toRect().
+        """
+
+        index = self.getObjectIndex()
+        if index is None:
+            rect = Rect(rect)
+            return [ obj for (obj, bbox) in self.objects.items()
+                   if rect.colliderect(self.toRect(bbox)) ]
+
+        return index.query(rect)
+
+
     def testCollideObjects(self, bbox):
-        values = []
-        keys = []
+        index = self.getObjectIndex()
+
+        if index is None:
+            values = []
+            keys = []
+
+            for obj, b in self.objects.items():
+                values.append(b)
+                keys.append(obj)
+
+            return [ keys[i] for i in bbox.collidelistall(values) ]
+
+        objects = self.objects
+        rect = (bbox.left, bbox.back, bbox.width, bbox.depth)
+        return [ obj for obj in index.query(rect)
+               if intersect(bbox, objects[obj]) ]
+
+
+    def testCollideObjectsAll(self):
+        """
+        return list of all pairs of objects that collide with each other.
+        all the objects are checked in one pass.
+        """
+
+        index = self.getObjectIndex()
+        objects = self.objects
 
-        for obj, b in self.objects.items():
-            values.append(b)
-            keys.append(obj)
+        if index is None:
+            items = objects.items()
+            return [ (a, b) for i, (a, ba) in enumerate(items)
+                     for (b, bb) in items[i+1:] if intersect(ba, bb) ]
 
-        return [ keys[i] for i in bbox.collidelistall(values) ]
+        return [ (a, b) for (a, b) in index.pairs()
+               if intersect(objects[a], objects[b]) ]
 
 
     def testCollideGeometryAll(self):
@@ -177,6 +390,8 @@ class Area(Environment):
         else:
             self.objects[obj] = bbox
             self._oldPositions[obj] = bbox
+            self._indexObject(obj, bbox)
+            self.markMoved(obj)
             return True
     
 
@@ -209,36 +424,91 @@ class Area(Environment):
             except:
                 raise
         self.orientations[obj] = angle
+        self.markMoved(obj)
 
 
     def add(self, obj):
         Environment.add(self, obj)
         self.objects[obj] = self.defaultPosition()
         self.orientations[obj] = 0.0
+        self._indexObject(obj, self.objects[obj])
+        self.markMoved(obj)
+
+
+    def remove(self, obj):
+        Environment.remove(self, obj)
+        self.objects.pop(obj, None)
+        self.orientations.pop(obj, None)
+        self._oldPositions.pop(obj, None)
+        if self._objectIndex is not None and obj in self._objectIndex:
+            self._objectIndex.remove(obj)
+        self.markMoved(obj)
 
 
     def setPosition(self, obj, (x, y, z)):
         """ Attempt to move object in 3d space.  Returns true if able. """
 
-        size = self.objects[obj].size
-        bbox = BBox((x, y, z), size)
+        bbox, old = self._tryOrigin(obj, (x, y, z))
         collide = self.testCollideGeometry(bbox)
 
         # object collides with something else, cannot set new position
         if collide:
+            self._undoOrigin(obj, old)
             return False
 
         # object is within areas extent and doesn't collide, so set it
         elif self.extent.contains(self.toRect(bbox)):
-            self._oldPositions[obj] = self.objects[obj] 
-            self.objects[obj] = bbox
+            self._keepOrigin(obj, bbox, old)
             return True
 
         # object is outside bounds of area, can't move it
         else:
+            self._undoOrigin(obj, old)
             return False
 
 
+    def _tryOrigin(self, obj, (x, y, z), relative=False):
+        """
+        Return a bbox of obj at (x, y, z), or moved by it if relative, and
+        where obj was.
+
+        if the bboxes are in a BBoxStore, the object is moved in the store
+        instead of making a new bbox, and the bbox is a view of it.  either
+        way, _keepOrigin or _undoOrigin must be called after.
+        """
+
+        objects = self.objects
+        if isinstance(objects, BBoxStore):
+            bbox = objects[obj]
+            old = bbox.origin
+            if relative:
+                objects.move(obj, x, y, z)
+            else:
+                objects.setOrigin(obj, x, y, z)
+            return bbox, old
+
+        bbox = objects[obj]
+        if relative:
+            return bbox.move(x, y, z), None
+        return BBox(x, y, z, bbox.width, bbox.height, bbox.depth), None
+
+
+    def _keepOrigin(self, obj, bbox, old):
+        if old is None:
+            self._oldPositions[obj] = self.objects[obj]
+            self.objects[obj] = bbox
+        else:
+            self._oldPositions[obj] = old + (bbox.width, bbox.height,
+                                             bbox.depth)
+        self._indexObject(obj, bbox)
+        self.markMoved(obj)
+
+
+    def _undoOrigin(self, obj, old):
+        if old is not None:
+            self.objects.setOrigin(obj, *old)
+
+
     def toRect(self, bbox):
         """
         Make a rect that represents the object's 'bottom plane'.
@@ -255,10 +525,11 @@ class Area(Environment):
     def movePosition(self, obj, (x, y, z), push=False):
         """ Attempt to move an object in 3d space.  Returns True if able. """ 
 
-        bbox = self.objects[obj].move(x, y, z)
+        bbox, old = self._tryOrigin(obj, (x, y, z), True)
 
         # collides with level geometry, cannot move
         if self.testCollideGeometry(bbox):
+            self._undoOrigin(obj, old)
             return False
 
         # test for collisions with other objects
@@ -284,35 +555,39 @@ class Area(Environment):
                 if self.extent.contains(self.toRect(bbox)):
 
                     # we are able to move 
-                    self._oldPositions[obj] = self.objects[obj]
-                    self.objects[obj] = bbox
+                    self._keepOrigin(obj, bbox, old)
 
                     # recursively push other objects
                     # if any of them cannot be push, just go back
                     for other in collide:
                         if not self.movePosition(other, (x, y, z), True):
                             self.objects[obj] = self._oldPositions[obj]
+                            self._indexObject(obj, self.objects[obj])
                             return False
 
                     return True
     
             # one of the objects cannot be pushed
+            self._undoOrigin(obj, old)
             return False
 
         # no collisions, so move the object
         elif self.extent.contains(self.toRect(bbox)):
-            self._oldPositions[obj] = self.objects[obj]
-            self.objects[obj] = bbox
+            self._keepOrigin(obj, bbox, old)
 
             self.messages.append("{} {} moves".format(self.time, obj.name))
             return True
+
+        # outside of the area
+        self._undoOrigin(obj, old)
+        return False
  
             
     def getPosition(self, obj):
         return self.objects[obj].origin
 
 
-    def setMap(self, mapname):
+    def setMap(self, mapname, compiled=None):
         """
         set the area to use the specified map
 
@@ -321,77 +596,40 @@ class Area(Environment):
 
         This object must already be connected to the data tree, otherwise
         object loading will not work...and loading will fail.
-        """
-
-        def toWorld(data, (x, y, l)):
-            """ translate tiled map coordinates to world coordinates """
-            return y*data.tileheight, x*data.tilewidth, l
-
 
-        import tmxloader
+        compiled is what compileMap returns for the map.  if it isn't passed,
+        the map is compiled here.
+        """
 
         self.mappath = res.mapPath(mapname)
-        data = tmxloader.load_tmx(self.mappath)
+        self.markChanged("mappath")
+        if compiled is None:
+            compiled = compileMap(self.mappath)
 
         # set the boundries (extent) of this map
-        self.setExtent(((0,0), \
-            (data.width * data.tilewidth, data.height * data.tileheight)))
-
-        props = data.getTilePropertiesByLayer(-1)
-
-   
-        # load the level geometry and set it 
-        rects = tmxloader.buildDistributionRects(data, -1)
-        self.setLayerGeometry(4, rects)
-
-        # load the npc's and place them in the default positions 
-        npcs = [ p for p in props if p[1].get('group', None) == 'npc' ] 
-
-        for (gid, prop) in npcs:
-            pos = data.getTileLocation(gid)
-            if len(pos) > 1:
-                msg = "control gid: {} is used in more than one locaton"
-                raise Exception, msg.format(gid)
-
-            x, y, z = toWorld(data, pos[0])
-            x += data.tileheight     # needed to position objects correctly
-            y += data.tilewidth / 2  # needed to position objects correctly
-            obj = self._parent.getChildByGUID(int(prop['guid']))
+        self.setExtent(compiled["extent"])
+        self.setLayerGeometry(4, [ Rect(r) for r in compiled["geometry"] ])
 
+        # place the npc's in their default positions
+        for guid, bbox in compiled["npcs"]:
+            obj = self._parent.getChildByGUID(guid)
             self.add(obj)
-            w, h, d = (10, 6, 8)
-            bbox = BBox(x-d, y, z, d, w, h)
-            self.setBBox(obj, bbox)
+            self.setBBox(obj, BBox(bbox))
             self.setOrientation(obj, "south")
-  
-        # load the items and place them where they should go
-        # items can have duplicate entries
-        items = [ p for p in props if p[1].get('group', None) == 'item' ]
-        done = [] 
-
-        for (gid, prop) in items:
-            if gid in done: continue
-            done.append(gid)
-
-            locations = data.getTileLocation(gid)
-            obj = self._parent.getChildByGUID(int(prop['guid']))
-            copy = False
 
-            for x, y, l in locations:
-                x, y, z = toWorld(data, (x, y, l))
-                x += data.tileheight     # needed to position objects correctly
-                y += data.tilewidth / 2  # needed to position objects correctly
+        # place the items where they should go
+        for guid, bboxes in compiled["items"]:
+            obj = self._parent.getChildByGUID(guid)
+            copy = False
 
+            for bbox in bboxes:
                 # objects cannot exists in multiple locations, so a copy is
                 # made for each
                 if copy:
                     obj = obj.copy()
 
                 self.add(obj)
-                z = 0
-                w, h, d = (10, 6, 8)
-                bbox = BBox(x-d, y, z, d, w, h)
-                self.setBBox(obj, bbox)
+                self.setBBox(obj, BBox(bbox))
                 self.setOrientation(obj, "south")
                 copy = True 
 
@@ -399,12 +637,9 @@ class Area(Environment):
         # here only the exits and positions are saved
         # another class will have to finalize the exits by adding a ref to
         # guid of the other area
-        exits = [ p for p in props if p[1].get('group', None) == 'door' ]
-        for gid, prop in exits:
-            x, y, l = data.getTileLocation(gid)[0]
-            y *= data.tilewidth
-            x *= data.tileheight
-            self.exits[prop['guid']] = ((x, y, l), None)
+        for guid, position in compiled["exits"]:
+            self.exits[guid] = (position, None)
+        self.markChanged("exits")
 
 
     def stick(self, obj):
@@ -413,3 +648,77 @@ class Area(Environment):
 
     def unstick(self, obj):
         pass
+
+
+
+def compileMap(path):
+    """
+    read what an area needs from a tmx map: the extent, the geometry and where
+    the npcs, items and exits are.  the result is only made of numbers,
+    strings and tuples, so it can be made in another process and kept for
+    the next time the world is built.  see Area.setMap.
+    """
+
+    def toWorld(data, (x, y, l)):
+        """ translate tiled map coordinates to world coordinates """
+        return y*data.tileheight, x*data.tilewidth, l
+
+
+    import tmxloader
+
+    data = tmxloader.load_tmx(path)
+    props = data.getTilePropertiesByLayer(-1)
+
+    compiled = {}
+    compiled["extent"] = ((0,0), \
+        (data.width * data.tilewidth, data.height * data.tileheight))
+
+    # this is only done once, so take the time to get as few as possible
+    rects = tmxloader.buildDistributionRects(data, -1, minimal=True)
+    compiled["geometry"] = [ tuple(rect) for rect in rects ]
+
+    # the npc's default positions
+    npcs = [ p for p in props if p[1].get('group', None) == 'npc' ] 
+    compiled["npcs"] = []
+
+    for (gid, prop) in npcs:
+        pos = data.getTileLocation(gid)
+        if len(pos) > 1:
+            msg = "control gid: {} is used in more than one locaton"
+            raise Exception, msg.format(gid)
+
+        x, y, z = toWorld(data, pos[0])
+        x += data.tileheight     # needed to position objects correctly
+        y += data.tilewidth / 2  # needed to position objects correctly
+        w, h, d = (10, 6, 8)
+        compiled["npcs"].append((int(prop['guid']), (x-d, y, z, d, w, h)))
+
+    # items can have duplicate entries
+    items = [ p for p in props if p[1].get('group', None) == 'item' ]
+    compiled["items"] = []
+    done = [] 
+
+    for (gid, prop) in items:
+        if gid in done: continue
+        done.append(gid)
+
+        bboxes = []
+        for x, y, l in data.getTileLocation(gid):
+            x, y, z = toWorld(data, (x, y, l))
+            x += data.tileheight     # needed to position objects correctly
+            y += data.tilewidth / 2  # needed to position objects correctly
+            z = 0
+            w, h, d = (10, 6, 8)
+            bboxes.append((x-d, y, z, d, w, h))
+
+        compiled["items"].append((int(prop['guid']), bboxes))
+
+    exits = [ p for p in props if p[1].get('group', None) == 'door' ]
+    compiled["exits"] = []
+    for gid, prop in exits:
+        x, y, l = data.getTileLocation(gid)[0]
+        y *= data.tilewidth
+        x *= data.tileheight
+        compiled["exits"].append((prop['guid'], (x, y, l)))
+
+    return compiled
@@ -104,6 +104,19 @@ class GameState(object):
         pass
 
 
+    def interpolate(self, alpha):
+        """
+        Called before draw() when the state driver is using a fixed timestep
+        and interpolation is enabled.
+
+        Alpha is the fraction (0-1) of a timestep that has passed since the
+        last update.  Positions can be blended by this much toward where they
+        will be after the next update to smooth out movement.
+        """
+
+        pass
+
+
     def handle_command(self, command):
         """
         Called when there is an input command to process
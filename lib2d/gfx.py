@@ -22,6 +22,7 @@ from vec import Vec2d
 
 from pygame.transform import scale, scale2x
 from pygame.display import flip
+from pygame import Rect
 import pygame, os.path, pprint
 
 
@@ -30,6 +31,15 @@ import pygame, os.path, pprint
 a few utilities for making retro looking games by scaling the screen
 and providing a few functions for handling screen changes
 
+update_display is passed whatever the state's draw method returned, which
+describes what has changed on the screen:
+    None                the whole screen
+    a rect              just that area
+    a list of either    all of the areas; nested lists are ok
+    an empty list       nothing, so the display is not touched
+
+only the changed areas are scaled and sent to the display, so states that
+don't change much (dialogs, menus) cost next to nothing to draw.
 """
 
 DEBUG = False
@@ -48,6 +58,11 @@ update_display = None
 double_buffer = False
 hwsurface = False
 surface_flags = 0
+exact_scale = False
+
+# if the dirty areas cover more than this much of the screen, just update
+# the whole thing.  it is faster than a lot of small updates.
+full_update_ratio = 0.5
 
 
 
@@ -65,15 +80,92 @@ def init():
     # determine if we can use hardware accelerated surfaces or not
     pygame.display.set_caption("RPG World Test")
 
+def get_dirty_rects(dirty):
+    """
+    Return list of rects that are on the screen from a value returned by a
+    draw method.  Returns None if the whole screen should be updated.
+    """
+
+    if dirty is None:
+        return None
+
+    screen_rect = screen.get_rect()
+    rects = []
+    stack = [dirty]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            return None
+        elif isinstance(item, list):
+            stack.extend(item)
+        else:
+            rect = screen_rect.clip(item)
+            if rect.width and rect.height:
+                rects.append(rect)
+
+    # too much has changed to be worth it
+    area = sum(r.width * r.height for r in rects)
+    if area >= screen_rect.width * screen_rect.height * full_update_ratio:
+        return None
+
+    return rects
+
+
+def update_display_direct(dirty):
+    rects = get_dirty_rects(dirty)
+
+    if rects is None or double_buffer:
+        flip()
+
+    elif rects:
+        pygame.display.update(rects)
+
+
 # is it redundant to have a pygame buffer, and one for pixalization?  maybe...
 
 def update_display_scaled2x(dirty):
-    scale2x(screen, screen_surface)
-    flip()
+    rects = get_dirty_rects(dirty)
+
+    if rects is None or double_buffer:
+        scale2x(screen, screen_surface)
+        flip()
+        return
+
+    # scale2x looks at neighboring pixels, so scale a slightly larger area
+    # then only copy the part that was dirty
+    screen_rect = screen.get_rect()
+    updated = []
+    for rect in rects:
+        area = rect.inflate(2, 2).clip(screen_rect)
+        scaled = scale2x(screen.subsurface(area))
+        x, y = (rect.left - area.left) * 2, (rect.top - area.top) * 2
+        dest = Rect(rect.left*2, rect.top*2, rect.width*2, rect.height*2)
+        screen_surface.blit(scaled, dest, (x, y, dest.width, dest.height))
+        updated.append(dest)
+
+    pygame.display.update(updated)
+
 
 def update_display_scaled(dirty):
-    scale(screen, screen_dim, screen_surface)
-    flip()
+    rects = get_dirty_rects(dirty)
+
+    # only scale parts of the screen if each pixel maps to a whole block of
+    # pixels on the display; otherwise the edges won't match up
+    if rects is None or double_buffer or not exact_scale:
+        scale(screen, screen_dim, screen_surface)
+        flip()
+        return
+
+    s = pix_scale
+    updated = []
+    for rect in rects:
+        dest = Rect(rect.left*s, rect.top*s, rect.width*s, rect.height*s)
+        scale(screen.subsurface(rect), dest.size,
+              screen_surface.subsurface(dest))
+        updated.append(dest)
+
+    pygame.display.update(updated)
+
 
 def set_screen(dim, scale=1, transform=None):
 
@@ -89,14 +181,14 @@ def set_screen(dim, scale=1, transform=None):
         pixel_buffer = None
         pix_scale = 1
         buffer_dim = None
-        update_display = flip
+        update_display = update_display_direct
         screen_surface = pygame.display.set_mode(screen_dim, surface_flags)
         screen = screen_surface
 
 def set_scale(scale, transform="scale"):
     from pygame.surface import Surface
 
-    global pixelize, pix_scale, buffer_dim, screen, update_display, screen_surface, screen_dim
+    global pixelize, pix_scale, buffer_dim, screen, update_display, screen_surface, screen_dim, exact_scale
 
     if transform == "scale2x":
         pix_scale = 2
@@ -107,6 +199,7 @@ def set_scale(scale, transform="scale"):
 
     pixelize = True
     buffer_dim = tuple([ int(i / pix_scale) for i in screen_dim ])
+    exact_scale = tuple(i * pix_scale for i in buffer_dim) == tuple(screen_dim)
     screen_surface = pygame.display.set_mode(screen_dim, surface_flags)
     screen = Surface(buffer_dim, surface_flags)
     #screen_surface = pygame.display.set_mode(screen_dim)
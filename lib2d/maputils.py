@@ -1,90 +1,304 @@
 import gfx
 from pygame import Rect
+from itertools import groupby
+from collections import deque
 
 
-def simplify(all_points, tilewidth, tileheight):
+"""
+turn a grid of tiles into a small number of rects that cover the same area.
+
+    0 1 1 1 0 0 0
+    0 1 1 0 0 0 0
+    0 0 0 0 0 4 0
+    0 0 0 0 0 4 0
+    0 0 0 0 0 0 0
+    0 0 1 1 1 1 1
+
+the tiles that are set will be covered by rects that do not overlap:
+
+    ..######......
+    ..####........
+    ..........##..
+    ..........##..
+    ..............
+    ....##########
+
+the default method merges runs of tiles in each row with the same runs in the
+rows below them.  it is fast and does well with the blocky shapes that maps
+usually have.  the minimal method will find the smallest possible number of
+rects, but is slower.  it is worth it for collision layers that are only
+built once and then tested against all the time.
+"""
+
+
+
+def decompose(grid, tilewidth=1, tileheight=1, minimal=False):
+    """
+    return a list of rects that cover the cells of grid that are set
+
+    grid is a list of rows, and a cell is set if it is true.  the rects are
+    scaled by tilewidth and tileheight.
+    """
+
+    if minimal:
+        rects = _decomposeMinimal(grid)
+    else:
+        rects = _decomposeRuns(grid)
+
+    return [ Rect(x*tilewidth, y*tileheight, w*tilewidth, h*tileheight)
+             for x, y, w, h in rects ]
+
+
+def _decomposeRuns(grid):
+    # runs that are still growing downwards.  (left, right): top
+    growing = {}
+    rects = []
+    y = -1
+
+    for y, row in enumerate(grid):
+        runs = set()
+        x = 0
+        for value, cells in groupby(row, bool):
+            length = sum(1 for i in cells)
+            if value:
+                runs.add((x, x + length))
+            x += length
+
+        for (left, right), top in growing.items():
+            if not (left, right) in runs:
+                rects.append((left, top, right - left, y - top))
+                del growing[(left, right)]
+
+        for run in runs:
+            if not run in growing:
+                growing[run] = y
+
+    y += 1
+    for (left, right), top in growing.items():
+        rects.append((left, top, right - left, y - top))
+
+    rects.sort(key=lambda r: (r[1], r[0]))
+    return rects
+
+
+def _decomposeMinimal(grid):
     """
-    klugde:
+    minimum partition of the set cells into rects.
 
-    "A kludge (or kluge) is a workaround, a quick-and-dirty solution,
-    a clumsy or inelegant, yet effective, solution to a problem, typically
-    using parts that are cobbled together."
+    the concave corners of the shapes have to be cut away to make rects.  a
+    cut that joins two concave corners (a chord) takes care of both, so as
+    many chords as possible are chosen, without any of them crossing.  that
+    is a maximum independent set of the chord intersection graph, which is
+    bipartite (horizontal vs vertical chords), so it can be found from a
+    maximum matching.  every concave corner that is left gets its own cut.
+    """
+
+    height = len(grid)
+    width = max([ len(row) for row in grid ] or [0])
+
+    # pad the grid so that the cells outside of it are always empty
+    cells = [ bytearray(width + 2) ]
+    for row in grid:
+        padded = bytearray(width + 2)
+        for x, value in enumerate(row):
+            if value:
+                padded[x + 1] = 1
+        cells.append(padded)
+    cells.append(bytearray(width + 2))
+
+    def filled(x, y):
+        return cells[y + 1][x + 1]
+
+    # concave corners are grid points with three of the four cells around
+    # them set.  the missing cell is stored as an offset: (-1 or 0, -1 or 0)
+    concave = {}
+    for y in xrange(height + 1):
+        above = cells[y]
+        below = cells[y + 1]
+        for x in xrange(width + 1):
+            count = above[x] + above[x+1] + below[x] + below[x+1]
+            if count == 3:
+                if not above[x]:    concave[(x, y)] = (-1, -1)
+                elif not above[x+1]: concave[(x, y)] = (0, -1)
+                elif not below[x]:  concave[(x, y)] = (-1, 0)
+                else:               concave[(x, y)] = (0, 0)
+
+    # find the chords.  they are only searched for towards the right and
+    # downwards so they are not found twice
+    hchords = []    # (y, x1, x2)
+    vchords = []    # (x, y1, y2)
+    for (x, y), (mx, my) in concave.iteritems():
+        if mx == -1:
+            cx = x
+            while filled(cx, y-1) and filled(cx, y):
+                cx += 1
+            if filled(cx, y-1) + filled(cx, y) == 1:
+                hchords.append((y, x, cx))
+
+        if my == -1:
+            cy = y
+            while filled(x-1, cy) and filled(x, cy):
+                cy += 1
+            if filled(x-1, cy) + filled(x, cy) == 1:
+                vchords.append((x, y, cy))
+
+    # chords cross if they intersect or share an end
+    hrows = {}
+    for i, (y, x1, x2) in enumerate(hchords):
+        hrows.setdefault(y, []).append(i)
+
+    crossing = [ [] for i in hchords ]
+    for j, (x, y1, y2) in enumerate(vchords):
+        for y in xrange(y1, y2 + 1):
+            for i in hrows.get(y, ()):
+                if hchords[i][1] <= x <= hchords[i][2]:
+                    crossing[i].append(j)
+
+    chosenH, chosenV = _independentSet(crossing, len(vchords))
+
+    # cuts are stored as the edges between cells that are separated
+    hcuts = set()   # (x, y): cell (x, y-1) is cut from (x, y)
+    vcuts = set()   # (x, y): cell (x-1, y) is cut from (x, y)
 
-    -- wikipedia
-   
-    turn a list of points into a rects 
-    adjacent rects will be combined.
+    for i in chosenH:
+        y, x1, x2 = hchords[i]
+        hcuts.update((x, y) for x in xrange(x1, x2))
 
-    plain english:
-        the input list must be a a list of tuples that represent
-        the areas to be combined into rects
-        the rects will be blended together over solid groups
+    for j in chosenV:
+        x, y1, y2 = vchords[j]
+        vcuts.update((x, y) for y in xrange(y1, y2))
 
-        so if data is something like:
+    # any corner that is left is cut vertically until it hits the edge of
+    # the shape or another cut
+    for (x, y), (mx, my) in sorted(concave.iteritems()):
+        hside = (x, y) if mx == -1 else (x - 1, y)
+        vside = (x, y) if my == -1 else (x, y - 1)
+        if hside in hcuts or vside in vcuts:
+            continue
 
-        0 1 1 1 0 0 0 
-        0 1 1 0 0 0 0 
-        0 0 0 0 0 4 0 
-        0 0 0 0 0 4 0
-        0 0 0 0 0 0 0 
-        0 0 1 1 1 1 1
+        if my == -1:
+            cy = y
+            while 1:
+                vcuts.add((x, cy))
+                cy += 1
+                if not (filled(x-1, cy) and filled(x, cy)): break
+                if (x-1, cy) in hcuts or (x, cy) in hcuts: break
+                if (x, cy) in vcuts: break
+        else:
+            cy = y
+            while 1:
+                cy -= 1
+                vcuts.add((x, cy))
+                if not (filled(x-1, cy-1) and filled(x, cy-1)): break
+                if (x-1, cy) in hcuts or (x, cy) in hcuts: break
+                if (x, cy-1) in vcuts: break
 
-        you'll have the 4 rects that mask the area like this:
+    # the cells are now split into rects; find them
+    rects = []
+    seen = set()
+    for y in xrange(height):
+        for x in xrange(width):
+            if not filled(x, y) or (x, y) in seen:
+                continue
 
-        ..######......
-        ..####........
-        ..........##..
-        ..........##..
-        ..............
-        ....##########
+            left = right = x
+            top = bottom = y
+            seen.add((x, y))
+            queue = deque([(x, y)])
+            while queue:
+                cx, cy = queue.popleft()
+                left = min(left, cx)
+                right = max(right, cx)
+                top = min(top, cy)
+                bottom = max(bottom, cy)
 
-        pretty cool, right?
+                neighbors = ((cx+1, cy, (cx+1, cy) not in vcuts),
+                             (cx-1, cy, (cx, cy) not in vcuts),
+                             (cx, cy+1, (cx, cy+1) not in hcuts),
+                             (cx, cy-1, (cx, cy) not in hcuts))
 
-    there are cases where the number of rectangles is not as low as possible,
-    but i haven't found that it is excessively bad.  certainly much better than
-    making a list of rects, one for each tile on the map!
+                for nx, ny, passable in neighbors:
+                    if passable and filled(nx, ny) and not (nx, ny) in seen:
+                        seen.add((nx, ny))
+                        queue.append((nx, ny))
 
+            rects.append((left, top, right - left + 1, bottom - top + 1))
+
+    rects.sort(key=lambda r: (r[1], r[0]))
+    return rects
+
+
+def _independentSet(edges, rightCount):
+    """
+    maximum independent set of a bipartite graph.
+
+    edges is a list of the right vertices that each left vertex is joined to.
+    returns a list of the left and right vertices in the set.
     """
 
-    def pick_rect(points, rects):
-        ox, oy = sorted([ (sum(p), p) for p in points ])[0][1]
-        x = ox
-        y = oy
-        ex = None            
-
-        while 1:
-            x += 1
-            if not (x, y) in points:
-                if ex == None:
-                    ex = x - 1
-
-                if ((ox, y+1) in points):
-                    if x == ex + 1 :
-                        y += 1
-                        x = ox
-
-                    else:
-                        y -= 1
-                        break
-                else:
-                    if x <= ex: y-= 1
+    leftCount = len(edges)
+    matchLeft = [None] * leftCount
+    matchRight = [None] * rightCount
+
+    # find the maximum matching with augmenting paths.  uses a queue instead
+    # of recursion so large maps will not hit the recursion limit
+    for start in xrange(leftCount):
+        parent = {}     # right vertex: left vertex it was reached from
+        queue = deque([start])
+        found = None
+        while queue and found is None:
+            u = queue.popleft()
+            for v in edges[u]:
+                if v in parent: continue
+                parent[v] = u
+                if matchRight[v] is None:
+                    found = v
                     break
+                queue.append(matchRight[v])
+
+        # flip the edges along the path
+        v = found
+        while v is not None:
+            u = parent[v]
+            nextV = matchLeft[u]
+            matchLeft[u] = v
+            matchRight[v] = u
+            v = nextV
 
-        c_rect = Rect(ox*tilewidth,oy*tileheight,\
-                     (ex-ox+1)*tilewidth,(y-oy+1)*tileheight)
+    # konig's theorem: follow alternating paths from the unmatched left
+    # vertices.  the ones reached on the left and the ones not reached on the
+    # right make the independent set.
+    reachedLeft = set(u for u in xrange(leftCount) if matchLeft[u] is None)
+    reachedRight = set()
+    queue = deque(reachedLeft)
+    while queue:
+        u = queue.popleft()
+        for v in edges[u]:
+            if v in reachedRight: continue
+            reachedRight.add(v)
+            w = matchRight[v]
+            if w is not None and not w in reachedLeft:
+                reachedLeft.add(w)
+                queue.append(w)
 
-        rects.append(c_rect)
+    return (sorted(reachedLeft),
+            [ v for v in xrange(rightCount) if not v in reachedRight ])
 
-        rect = Rect(ox,oy,ex-ox+1,y-oy+1)
-        kill = [ p for p in points if rect.collidepoint(p) ]
-        [ points.remove(i) for i in kill ]
 
-        if points:
-            pick_rect(points, rects)
+def simplify(all_points, tilewidth, tileheight, minimal=False):
+    """
+    turn a list of (x, y) points into rects.  adjacent points are combined.
+
+    see decompose.  the list of points is not changed.
+    """
 
-    rect_list = []
-    while all_points:
-        pick_rect(all_points, rect_list)
+    if not all_points:
+        return []
 
-    return rect_list
+    width = max(x for x, y in all_points) + 1
+    height = max(y for x, y in all_points) + 1
+    grid = [ bytearray(width) for y in xrange(height) ]
+    for x, y in all_points:
+        grid[y][x] = 1
 
+    return decompose(grid, tilewidth, tileheight, minimal)
@@ -5,13 +5,20 @@ import res
 def loadObject(name):
     """
     read this node from disk
+
+    only the root is loaded.  the rest of the objects are loaded from the save
+    when they are needed.  see savestore.
     """
 
     import cPickle as pickle
+    import savestore
 
-    with open(name + "-index.txt") as fh:
-        toc = pickle.load(fh)
+    if savestore.isStore(name):
+        store = savestore.SaveStore(name)
+        store.open()
+        return store.get(store.root)
 
+    # saves from before savestore are one big pickle
     with open(name + "-data.txt") as fh:
         node = pickle.load(fh)
 
@@ -27,6 +34,12 @@ class GameObject(object):
     if you are going to specially handle any object that will become a child of
     the object, YOU MUST HANDLE IT IN add().  failure to do so will cause
     difficult to track bugs.
+
+    an autosave only writes the attributes that were marked as changed since
+    the last save.  any method that changes an attribute that should be saved
+    must call markChanged() with its name.  things that change every frame,
+    like the frame of an animation, are not marked, and are only written by a
+    full save.
     """
 
     def __init__(self, parent=None):
@@ -42,6 +55,46 @@ class GameObject(object):
         self.guid = None
 
 
+    def __getattr__(self, name):
+        # objects loaded from a save only know the guids of their children.
+        # load the children the first time they are needed.
+        if name == "_children":
+            store = self.__dict__.get("_store", None)
+            if store is not None:
+                children = [ store.get(guid) for guid in self._childrenGUID ]
+                self.__dict__["_children"] = children
+
+                index = self._rootIndex()
+                if index is not None:
+                    for child in children:
+                        child._indexInto(index)
+
+                return children
+
+        raise AttributeError, name
+
+
+    def __getstate__(self):
+        # the guid index is rebuilt when needed, so don't save it
+        d = self.__dict__.copy()
+        d.pop("_guidIndex", None)
+        d.pop("_store", None)
+        d.pop("_changed", None)
+        return d
+
+
+    def markChanged(self, *names):
+        """
+        remember that these attributes were changed, so they are written by
+        the next autosave
+        """
+
+        try:
+            self.__dict__["_changed"].update(names)
+        except KeyError:
+            self.__dict__["_changed"] = set(names)
+
+
     def returnNew(self):
         """
         override this if the constructor requires any special arguments
@@ -58,6 +111,9 @@ class GameObject(object):
         new = self.returnNew()
 
         new.__dict__.update(self.__dict__)
+        new.__dict__.pop("_store", None)
+        new.__dict__.pop("_guidIndex", None)
+        new.__dict__.pop("_changed", None)
         new._parent = None
         new._children = []
         new._childrenGUID = []
@@ -116,32 +172,105 @@ class GameObject(object):
 
     def setGUID(self, guid):
         try:
-            self.guid = int(guid)
+            guid = int(guid)
         except:
             raise ValueError, "GUID's must be an integer"
 
+        index = self._rootIndex()
+        if index is not None:
+            if index.get(self.guid, None) is self:
+                del index[self.guid]
+            index[guid] = self
+
+        self.guid = guid
+        self.markChanged("guid")
+
 
     def setName(self, name):
         self.name = name
+        self.markChanged("name")
 
 
     def remove(self, other):
         self._children.remove(other)
+        self.markChanged("_children")
+
+        index = self._rootIndex()
+        if index is not None:
+            for node in other.iterLoaded():
+                if index.get(node.guid, None) is node:
+                    del index[node.guid]
+
+        other._parent = None
+        other.markChanged("_parent")
 
 
     def add(self, other):
         self._children.append(other)
+        self.markChanged("_children")
         if other._parent:
             other._parent.remove(other)
         other.setParent(self)
 
+        # other may have been the root of its own tree
+        oldIndex = other.__dict__.pop("_guidIndex", None)
+        index = self._rootIndex()
+        if index is not None:
+            if oldIndex is None:
+                other._indexInto(index)
+            else:
+                index.update(oldIndex)
+
 
     def hasChild(self, child):
-        for c in self.getChildren():
-            if c == child: return True
+        node = child._parent
+        while node is not None:
+            if node is self: return True
+            node = node._parent
         return False
 
 
+    def iterLoaded(self):
+        """
+        iterate over this object and all of its children that are loaded.
+        unlike getChildren, children that are still in a save are not loaded.
+        """
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            children = node.__dict__.get("_children", None)
+            if children is not None:
+                stack.extend(children)
+
+
+    def getGUIDIndex(self):
+        """
+        return a dict of guid: object for the whole tree that this object is
+        in.  it is kept by the root, and built the first time it is needed.
+        """
+
+        root = self.getRoot()
+        index = root.__dict__.get("_guidIndex", None)
+        if index is None:
+            index = {}
+            root._indexInto(index)
+            root.__dict__["_guidIndex"] = index
+        return index
+
+
+    def _rootIndex(self):
+        # the index of the tree, if it has been built
+        return self.getRoot().__dict__.get("_guidIndex", None)
+
+
+    def _indexInto(self, index):
+        for node in self.iterLoaded():
+            if node.guid is not None:
+                index[node.guid] = node
+
+
     def getChildren(self):
         # should be a breadth-first search
         children = []
@@ -169,8 +298,19 @@ class GameObject(object):
         """
        
         guid = int(guid) 
-        for child in self.getChildren():
-            if child.guid == guid: return child
+
+        index = self.getGUIDIndex()
+        child = index.get(guid, None)
+        if child is not None and self.hasChild(child):
+            return child
+
+        # objects that are still in a save are not in the index yet
+        store = self.getRoot().__dict__.get("_store", None)
+        if store is not None and guid in store:
+            child = store.get(guid)
+            if self.hasChild(child):
+                index[guid] = child
+                return child
 
         msg = "GUID ({}) not found."
         raise Exception, msg.format(guid)
@@ -231,11 +371,18 @@ class GameObject(object):
         game and references cleared.
         """
 
+        index = self._rootIndex()
+        if index is not None:
+            for node in self.iterLoaded():
+                if not node is self and index.get(node.guid, None) is node:
+                    del index[node.guid]
+
         for child in self._children:
             child._parent = None
             child.destroy()
 
         self._children = []
+        self.markChanged("_children")
 
 
     def setParent(self, parent):
@@ -243,38 +390,47 @@ class GameObject(object):
         # the parent's children manually
 
         self._parent = parent
+        self.markChanged("_parent")
 
 
     def save(self, name):
         """
         write the state of this object and all of its children to disk.
-        it will be a pair of files.
+        it will be a pair of files, and a journal after an autosave.
+
+        if this object was loaded from a save, only the objects that were
+        loaded since then will be written, and only if they changed.  all
+        objects will be given a guid if they don't have one.
         """
 
-        import cPickle as pickle
+        from savestore import SaveStore
 
-        # generate unique ID's for all the objects (if not already assigned)
-        i = 0
-        used = set([ child.guid for child in self.getChildren() ])
-        used.add(self.guid)
-        for child in self.getChildren():
-            if child.guid: continue
-            while i in used:
-                i += 1
-            child.setGUID(i)
-            used.add(i)
+        store = self.__dict__.get("_store", None)
+        if store is None:
+            store = SaveStore(name)
+        elif not store.name == name:
+            store.rename(name)
 
-        toc = {}
-        def handleWrite(obj, pickler):
-            toc[obj.guid] = fh.tell()
+        return store.save(self)
+
+
+    def autosave(self, name=None):
+        """
+        quickly save the changes since the last save or autosave.
+
+        only the attributes that were changed are written, to the journal of
+        the save.  if this object wasn't loaded from or saved to a save called
+        name, a full save is done instead.  returns the number of objects
+        written.
+        """
 
-        with open(name + "-data.txt", "w") as fh:
-            pickler = pickle.Pickler(fh, -1)
-            self.serialize(pickler, handleWrite)
+        store = self.__dict__.get("_store", None)
+        if store is None or not (name is None or store.name == name):
+            if name is None:
+                raise ValueError, "object has not been saved yet"
+            return self.save(name)
 
-        with open(name + "-index.txt", "w") as fh:
-            pickler = pickle.Pickler(fh, -1)
-            pickler.dump(toc)
+        return store.autosave(self)
 
 
 class AvatarObject(GameObject):
@@ -288,6 +444,7 @@ class AvatarObject(GameObject):
 
         if isinstance(other, Avatar):
             self._avatar = other
+            self.markChanged("_avatar")
 
         GameObject.add(self, other)
 
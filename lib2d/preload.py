@@ -0,0 +1,288 @@
+"""
+load resources in the background before they are needed.
+
+reading and decoding files is done on a pool of threads.  anything that
+touches the display, like convert(), has to be done in the main thread, so the
+results are handed back and finished when update() is called.  finished images
+and sounds are put in res.cache, so the next res.loadImage() or res.loadSound()
+for them doesn't have to wait.
+
+    >>> from lib2d.preload import preloader, areaAssets
+    >>> assets = areaAssets(area)   # when the world is built
+    ...
+    >>> preloader.preloadArea(assets)
+    ...
+    >>> preloader.update(2000)      # every frame, in the main thread
+
+nothing here is required.  if something wasn't preloaded in time, it will just
+be loaded the normal way.
+
+Copyright 2010, 2011  Leif Theden
+
+
+This file is part of lib2d.
+
+lib2d is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+lib2d is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import res
+
+import pygame
+from threading import Thread
+from Queue import Queue, Empty
+from timeit import default_timer
+import os.path
+
+
+
+class PreloadThread(Thread):
+    """
+    Runs jobs until it gets a None.
+    """
+
+    def __init__(self, requests, results):
+        Thread.__init__(self)
+        self.daemon = True
+        self.requests = requests
+        self.results = results
+
+
+    def run(self):
+        while 1:
+            job = self.requests.get()
+            if job is None:
+                break
+
+            key, decode, args, finish = job
+            try:
+                result = decode(*args)
+            except Exception, e:
+                self.results.put((key, finish, None, e))
+            else:
+                self.results.put((key, finish, result, None))
+
+
+
+class Preloader(object):
+    """
+    Loads resources on a pool of threads.  The threads are started when the
+    first request is made.
+
+    Each request is a key, a function to call in a thread and a function to
+    call in the main thread with the result.  Requests for keys that are
+    already in res.cache or are being loaded are ignored.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.threads = []
+        self.requests = Queue()
+        self.results = Queue()
+        self.requested = set()  # keys that have not been finished
+        self.errors = []        # (key, exception) of jobs that failed
+
+
+    @property
+    def busy(self):
+        return bool(self.requested)
+
+
+    def start(self):
+        while len(self.threads) < self.workers:
+            thread = PreloadThread(self.requests, self.results)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def stop(self):
+        """
+        Stop the threads once they finish the requests that are queued
+        """
+
+        for thread in self.threads:
+            self.requests.put(None)
+        self.threads = []
+
+
+    def request(self, key, decode, finish, *args):
+        """
+        Call decode(*args) in a thread, then finish(result) in update().
+        Returns True if the request was queued.
+        """
+
+        if key in self.requested or key in res.cache:
+            return False
+
+        self.requested.add(key)
+        self.start()
+        self.requests.put((key, decode, args, finish))
+        return True
+
+
+    def update(self, budget=None):
+        """
+        Finish the requests that the threads are done with.  Must be called
+        in the main thread.
+
+        budget is the time to spend, in microseconds.  at least one request is
+        finished each time, if one is ready.  returns the number finished.
+        """
+
+        if not self.requested:
+            return 0
+
+        if budget:
+            deadline = default_timer() + budget / 1000000.0
+
+        finished = 0
+        while 1:
+            try:
+                key, finish, result, error = self.results.get_nowait()
+            except Empty:
+                break
+
+            self.requested.discard(key)
+            if error is None:
+                finish(result)
+            else:
+                # it will fail again when it is loaded, with a better error
+                self.errors.append((key, error))
+
+            finished += 1
+            if budget and default_timer() >= deadline:
+                break
+
+        return finished
+
+
+    def preloadImage(self, name, alpha=False, colorkey=False):
+        """
+        Preload an image for res.loadImage.  The flags must be the same.
+        """
+
+        key = res.imageKey(name, alpha, colorkey)
+
+        def finish(image):
+            res.cache.get(key, lambda: res.convertImage(image, alpha, colorkey))
+
+        return self.request(key, res.decodeImage, finish, name)
+
+
+    def preloadSound(self, filename):
+        """
+        Preload a sound for res.loadSound.
+        """
+
+        key = res.soundKey(filename)
+
+        def finish(sound):
+            if not sound is res.dummySound:
+                res.cache.get(key, lambda: sound)
+
+        return self.request(key, res.decodeSound, finish, filename)
+
+
+    def preloadTileset(self, path):
+        """
+        Preload a tileset image.  Use loadTileset as the image_loader for
+        tmxloader.load_pygame to use it.
+        """
+
+        key = ("tileset", path)
+
+        def finish(image):
+            res.cache.get(key, lambda: image)
+
+        return self.request(key, pygame.image.load, finish, path)
+
+
+    def loadTileset(self, path):
+        """
+        Return the tileset image for path, if it was preloaded, or load it
+        """
+
+        key = ("tileset", path)
+        if key in res.cache:
+            image = res.cache.get(key, None)
+
+            # the tiles will be copied out of it, so it won't be needed again
+            res.cache.drop(key)
+            return image
+
+        return pygame.image.load(path)
+
+
+    def preloadMap(self, path):
+        """
+        Preload a tmx map: the compiled map and its tileset images and sounds
+        """
+
+        import tmxloader
+
+        key = ("map", path)
+
+        def finish(tmxdata):
+            dirname = os.path.dirname(tmxdata.filename)
+            for tileset in tmxdata.tilesets:
+                self.preloadTileset(os.path.join(dirname, tileset.source))
+
+            for i, layer in enumerate(tmxdata.tilelayers):
+                for gid, props in tmxdata.getTilePropertiesByLayer(i):
+                    for name, value in props.items():
+                        if name[4:].lower() == "sound":
+                            self.preloadSound(value)
+
+        # the compiled map is saved, so loading it later will be quick
+        def decode(path):
+            return tmxloader.load_tmx(path, cache=True)
+
+        return self.request(key, decode, finish, path)
+
+
+    def preloadArea(self, assets):
+        """
+        Preload the map of an area and the images of the avatars in it.
+        assets is what areaAssets returned for the area.
+        """
+
+        mappath, images = assets
+        self.preloadMap(mappath)
+        for filename in images:
+            self.preloadImage(filename, False, True)
+
+
+
+def areaAssets(area):
+    """
+    Return the path of the map of an area and the images of the avatars in
+    it, for Preloader.preloadArea.  All of the objects in the area are
+    loaded to find them, so do this when the world is built and keep it.
+    """
+
+    images = set()
+    for child in area.getChildren():
+        avatar = getattr(child, "avatar", None)
+        if avatar is None:
+            continue
+
+        for animation in avatar.animations.itervalues():
+            filename = getattr(animation, "filename", None)
+            if filename:
+                images.add(filename)
+
+    return area.mappath, sorted(images)
+
+
+
+preloader = Preloader()
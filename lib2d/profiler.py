@@ -0,0 +1,232 @@
+"""
+frame time profiler for the main loop.
+
+the state drivers will time each phase of the loop (handling events, updating
+the state, drawing the state, and updating the display) when a profiler is
+enabled.  timings are kept for the last few hundred frames in a ring buffer,
+and can be exported or drawn on the screen as a graph.
+
+    >>> from lib2d.statedriver import driver as sd
+    >>> profiler = sd.enable_profiler(overlay=True)
+    >>> sd.run()
+    >>> profiler.export_csv("frames.csv")
+
+when no profiler is enabled, the drivers do not do any extra work.
+
+Copyright 2010, 2011  Leif Theden
+
+
+This file is part of lib2d.
+
+lib2d is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+lib2d is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from timeit import default_timer
+from array import array
+
+
+EVENTS  = "events"
+UPDATE  = "update"
+DRAW    = "draw"
+DISPLAY = "display"
+
+phases = (EVENTS, UPDATE, DRAW, DISPLAY)
+
+# colors used for the graph
+colors = {
+    EVENTS:  (64, 128, 255),
+    UPDATE:  (64, 255, 64),
+    DRAW:    (255, 192, 0),
+    DISPLAY: (255, 64, 64),
+}
+
+
+class FrameProfiler(object):
+    """
+    Records how long each phase of a frame takes, in milliseconds.
+
+    The drivers call frame() at the start of each frame, then start() and
+    stop() around each phase.  Time is added up if a phase happens more than
+    once in a frame, as update usually does.
+    """
+
+    def __init__(self, size=300, budget=None):
+        """
+        size is the number of frames to remember.
+        budget is the time allowed for each frame in ms.  it is drawn as a
+        line on the graph.
+        """
+
+        self.size = size
+        self.budget = budget
+        self.overlay = False
+        self.timings = dict((p, array('d', [0.0] * size)) for p in phases)
+        self.updates = array('l', [0] * size)    # update calls per frame
+        self.index = -1                          # slot of the current frame
+        self.count = 0                           # slots that have been used
+        self.frames = 0                          # total frames recorded
+
+        self._phase = None
+        self._started = 0.0
+
+
+    def frame(self):
+        """
+        Begin recording a new frame.  The oldest frame will be dropped.
+        """
+
+        i = (self.index + 1) % self.size
+        for timing in self.timings.itervalues():
+            timing[i] = 0.0
+
+        self.updates[i] = 0
+        self.index = i
+        self.frames += 1
+        if self.count < self.size:
+            self.count += 1
+
+
+    def start(self, phase):
+        self._phase = phase
+        self._started = default_timer()
+
+
+    def stop(self):
+        elapsed = (default_timer() - self._started) * 1000.0
+        self.timings[self._phase][self.index] += elapsed
+        if self._phase == UPDATE:
+            self.updates[self.index] += 1
+
+
+    def timed(self, phase, func):
+        """
+        Return a function that calls func and records the time it takes
+        """
+
+        start = self.start
+        stop = self.stop
+
+        def wrapped(*args, **kwargs):
+            start(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stop()
+
+        return wrapped
+
+
+    def records(self):
+        """
+        Return list of dicts for each frame that was recorded, oldest first.
+        """
+
+        first = self.frames - self.count
+        records = []
+
+        for n in xrange(self.count):
+            i = (self.index - self.count + 1 + n) % self.size
+            record = dict((p, self.timings[p][i]) for p in phases)
+            record["total"] = sum(record.values())
+            record["updates"] = self.updates[i]
+            record["frame"] = first + n
+            records.append(record)
+
+        return records
+
+
+    def summary(self):
+        """
+        Return dict of the average and worst time for each phase
+        """
+
+        records = self.records()
+        summary = {}
+
+        for key in phases + ("total",):
+            values = [ r[key] for r in records ] or [0.0]
+            summary[key] = {"mean": sum(values) / len(values),
+                            "max": max(values)}
+
+        return summary
+
+
+    def export_json(self, filename):
+        import json
+
+        data = {"phases": phases,
+                "budget": self.budget,
+                "summary": self.summary(),
+                "frames": self.records()}
+
+        with open(filename, "w") as fh:
+            json.dump(data, fh, indent=1)
+
+
+    def export_csv(self, filename):
+        import csv
+
+        fields = ("frame",) + phases + ("total", "updates")
+
+        with open(filename, "wb") as fh:
+            writer = csv.DictWriter(fh, fields)
+            writer.writerow(dict(zip(fields, fields)))
+            writer.writerows(self.records())
+
+
+    def draw(self, surface, rect=None, scale=2.0):
+        """
+        Draw a graph of the recorded frames.  Each frame is a column, with
+        the phases stacked on top of each other.  scale is pixels per ms.
+
+        Returns the rect that was drawn on.
+        """
+
+        import pygame
+
+        if rect is None:
+            sw, sh = surface.get_size()
+            w = min(self.size, sw)
+            h = min(100, sh)
+            rect = pygame.Rect(sw - w, sh - h, w, h)
+        else:
+            rect = pygame.Rect(rect)
+
+        origClip = surface.get_clip()
+        surface.set_clip(rect)
+
+        fill = surface.fill
+        fill((0, 0, 0), rect)
+
+        # only draw as many frames as will fit
+        shown = min(self.count, rect.width)
+        x = rect.right - shown
+        for n in xrange(shown):
+            i = (self.index - shown + 1 + n) % self.size
+            y = rect.bottom
+            for phase in phases:
+                h = int(self.timings[phase][i] * scale)
+                if h:
+                    y -= h
+                    fill(colors[phase], (x, y, 1, h))
+            x += 1
+
+        if self.budget:
+            y = rect.bottom - int(self.budget * scale)
+            if y > rect.top:
+                fill((255, 255, 255), (rect.left, y, rect.width, 1))
+
+        surface.set_clip(origClip)
+
+        return rect
@@ -1,16 +1,18 @@
 """
-Module contains two classes for quadtree collision detection.
+Module contains classes for quadtree collision detection.
 
 In Lib2d, they are used in various parts in rendering and collision detection
 between 'sprites' and world geometry.
 
-It is important to remember that once the quadtree's are useful for static
-objects (which is why it is being used for world geometry).  There are
-probably better solutions for moving objects.
+It is important to remember that FastQuadTree and QuadTree are only useful for
+static objects (which is why they are being used for world geometry), since
+they have to be rebuilt if anything changes.  For moving objects, use the
+DynamicQuadTree, which supports inserting, moving and removing items.
 """
 
 
 from pygame import Rect
+from array import array
 
 
 class FrozenRect(object):
@@ -77,11 +79,18 @@ class FastQuadTree(object):
     Items being stored in the tree must be a pygame.Rect or have have a
     .rect (pygame.Rect) attribute that is a pygame.Rect
         ...and they must be hashable.
+
+    If the query is done many times per frame, use hitIndexes() instead of
+    hit().  It returns the position of the items in the list that was used
+    to build the tree and does not create any new objects.
+
+    To test a lot of rects at once, use hitBatch().  It requires NumPy.
     """
 
-    __slots__ = ['items', 'cx', 'cy', 'nw', 'sw', 'ne', 'se']
+    __slots__ = ['items', 'indexes', 'cx', 'cy', 'nw', 'sw', 'ne', 'se',
+                 '_flat']
  
-    def __init__(self, items, depth=4, bounding_rect=None):
+    def __init__(self, items, depth=4, bounding_rect=None, indexes=None):
         """Creates a quad-tree.
  
         @param items:
@@ -94,16 +103,24 @@ class FastQuadTree(object):
         @param bounding_rect:
             The bounding rectangle of all of the items in the quad-tree. For
             internal use only.
+
+        @param indexes:
+            Position of each item in the original list. For internal use only.
         """
  
         # The sub-quadrants are empty to start with.
         self.nw = self.ne = self.se = self.sw = None
+        self._flat = None
+
+        if indexes is None:
+            indexes = range(len(items))
         
         # If we've reached the maximum depth then insert all items into this
         # quadrant.
         depth -= 1
         if depth == 0 or not items:
             self.items = items
+            self.indexes = indexes
             return
  
         # Find this quadrant's centre.
@@ -118,12 +135,13 @@ class FastQuadTree(object):
         cy = self.cy = bounding_rect.centery
  
         self.items = []
-        nw_items = []
-        ne_items = []
-        se_items = []
-        sw_items = []
+        self.indexes = []
+        nw_items, nw_indexes = [], []
+        ne_items, ne_indexes = [], []
+        se_items, se_indexes = [], []
+        sw_items, sw_indexes = [], []
  
-        for item in items:
+        for item, index in zip(items, indexes):
             # Which of the sub-quadrants does the item overlap?
             in_nw = item.left <= cx and item.top <= cy
             in_sw = item.left <= cx and item.bottom >= cy
@@ -135,28 +153,41 @@ class FastQuadTree(object):
             # quadrant that it overlaps.
             if in_nw and in_ne and in_se and in_sw:
                 self.items.append(item)
+                self.indexes.append(index)
             else:
-                if in_nw: nw_items.append(item)
-                if in_ne: ne_items.append(item)
-                if in_se: se_items.append(item)
-                if in_sw: sw_items.append(item)
+                if in_nw:
+                    nw_items.append(item)
+                    nw_indexes.append(index)
+                if in_ne:
+                    ne_items.append(item)
+                    ne_indexes.append(index)
+                if in_se:
+                    se_items.append(item)
+                    se_indexes.append(index)
+                if in_sw:
+                    sw_items.append(item)
+                    sw_indexes.append(index)
            
         # Create the sub-quadrants, recursively.
         if nw_items:
             self.nw = FastQuadTree(nw_items, depth, \
-                      (bounding_rect.left, bounding_rect.top, cx, cy))
+                      (bounding_rect.left, bounding_rect.top, cx, cy),
+                      nw_indexes)
  
         if ne_items:
             self.ne = FastQuadTree(ne_items, depth, \
-                      (cx, bounding_rect.top, bounding_rect.right, cy))
+                      (cx, bounding_rect.top, bounding_rect.right, cy),
+                      ne_indexes)
 
         if se_items:
             self.se = FastQuadTree(se_items, depth, \
-                      (cx, cy, bounding_rect.right, bounding_rect.bottom))
+                      (cx, cy, bounding_rect.right, bounding_rect.bottom),
+                      se_indexes)
   
         if sw_items:
             self.sw = FastQuadTree(sw_items, depth, \
-                      (bounding_rect.left, cy, cx, bounding_rect.bottom))
+                      (bounding_rect.left, cy, cx, bounding_rect.bottom),
+                      sw_indexes)
 
 
     def hit(self, rect):
@@ -187,6 +218,211 @@ class FastQuadTree(object):
         return hits
 
 
+    def hitIndexes(self, rect, out=None, limit=0):
+        """Finds the items that overlap a bounding rectangle.
+
+        The position (in the list used to build the tree) of each item that
+        is hit is written into out, starting at 0.  Each item is only
+        written once.  The number of items hit is returned.
+
+        The tree is walked without recursion and nothing is allocated, so
+        this is much kinder to the garbage collector than hit().
+
+        @param rect:
+            The bounding rectangle being tested against the quad-tree. This
+            must possess left, top, right and bottom attributes.
+
+        @param out:
+            A preallocated array or list that will hold the indexes.  It
+            should be at least as long as the list of items.  If None, the
+            hits are only counted.
+
+        @param limit:
+            Stop after this many hits.  Use 1 to simply test for a collision.
+        """
+
+        flat = self._flat
+        if flat is None:
+            flat = self._flat = _FlatQuadTree(self)
+
+        nodes = flat.nodes
+        rects = flat.rects
+        indexes = flat.indexes
+        marks = flat.marks
+        stack = flat.stack
+
+        flat.stamp += 1
+        if flat.stamp == 0xffffffff:
+            for i in xrange(len(marks)): marks[i] = 0
+            flat.stamp = 1
+        stamp = flat.stamp
+
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+
+        count = 0
+        stack[0] = 0
+        sp = 1
+        while sp:
+            sp -= 1
+            n = stack[sp]
+
+            # check the items in this node
+            j = nodes[n+2]
+            end = nodes[n+3]
+            while j < end:
+                k = j * 4
+                if rects[k] < right and rects[k+2] > left and \
+                   rects[k+1] < bottom and rects[k+3] > top:
+                    i = indexes[j]
+                    if not marks[i] == stamp:
+                        marks[i] = stamp
+                        if out is not None:
+                            out[count] = i
+                        count += 1
+                        if count == limit:
+                            return count
+                j += 1
+
+            # check the lower quadrants
+            cx = nodes[n]
+            cy = nodes[n+1]
+            if left <= cx:
+                if top <= cy and nodes[n+4] >= 0:
+                    stack[sp] = nodes[n+4]
+                    sp += 1
+                if bottom >= cy and nodes[n+7] >= 0:
+                    stack[sp] = nodes[n+7]
+                    sp += 1
+            if right >= cx:
+                if top <= cy and nodes[n+5] >= 0:
+                    stack[sp] = nodes[n+5]
+                    sp += 1
+                if bottom >= cy and nodes[n+6] >= 0:
+                    stack[sp] = nodes[n+6]
+                    sp += 1
+
+        return count
+
+
+    def hitBatch(self, rects, matrix=False):
+        """Test many rects against the items in one vectorized pass.
+
+        Requires NumPy.
+
+        @param rects:
+            Nx4 array (or sequence) of rects in (left, top, width, height)
+            format.
+
+        @param matrix:
+            If False, return a boolean array of length N that is True where
+            the rect overlaps any item.  If True, return a NxM boolean array,
+            where M is the number of items used to build the tree.  Use
+            numpy.nonzero() on a row to get the indexes of items that were hit.
+        """
+
+        try:
+            import numpy
+        except ImportError:
+            raise Exception, "FastQuadTree.hitBatch requires NumPy"
+
+        flat = self._flat
+        if flat is None:
+            flat = self._flat = _FlatQuadTree(self)
+
+        if flat.extents is None:
+            # items that are in more than one node will simply be
+            # written more than once
+            extents = numpy.zeros((len(flat.marks), 4))
+            indexes = numpy.array(flat.indexes, dtype=int)
+            extents[indexes] = numpy.array(flat.rects).reshape((-1, 4))
+            flat.extents = extents
+
+        extents = flat.extents
+        rects = numpy.asarray(rects, dtype=float).reshape((-1, 4))
+        left   = rects[:, 0:1]
+        top    = rects[:, 1:2]
+        right  = left + rects[:, 2:3]
+        bottom = top + rects[:, 3:4]
+
+        # keep the size of the temporary arrays reasonable
+        total = len(rects)
+        items = max(len(extents), 1)
+        chunk = max(1, (1 << 20) / items)
+
+        if matrix:
+            result = numpy.zeros((total, len(extents)), dtype=bool)
+        else:
+            result = numpy.zeros(total, dtype=bool)
+
+        il, it, ir, ib = extents.T
+        for i in xrange(0, total, chunk):
+            s = slice(i, i + chunk)
+            hits = ((il < right[s]) & (ir > left[s]) &
+                    (it < bottom[s]) & (ib > top[s]))
+            if matrix:
+                result[s] = hits
+            else:
+                result[s] = hits.any(axis=1)
+
+        return result
+
+
+class _FlatQuadTree(object):
+    """
+    FastQuadTree packed into a few arrays so it can be searched without
+    recursion.  For internal use by FastQuadTree.hitIndexes.
+
+    nodes holds 8 values for each node:
+        centre x, centre y, first item, last item + 1,
+        and the offset of the nw, ne, se, sw children (-1 if missing)
+    rects holds 4 values for each item: left, top, right, bottom
+    """
+
+    __slots__ = ['nodes', 'rects', 'indexes', 'marks', 'stack', 'stamp',
+                 'extents']
+
+    def __init__(self, tree):
+        self.nodes = array('l')
+        self.rects = array('l')
+        self.indexes = array('l')
+
+        # breadth first, so the children can be found after their parent
+        queue = [tree]
+        offsets = {id(tree): 0}
+        highest = -1
+        for node in queue:
+            children = (node.nw, node.ne, node.se, node.sw)
+            for child in children:
+                if child is not None:
+                    offsets[id(child)] = len(offsets) * 8
+                    queue.append(child)
+
+            # leaves do not have a centre, so they are never descended
+            cx = getattr(node, 'cx', 0)
+            cy = getattr(node, 'cy', 0)
+
+            start = len(self.indexes)
+            for item, index in zip(node.items, node.indexes):
+                self.rects.extend((item.left, item.top,
+                                   item.right, item.bottom))
+                self.indexes.append(index)
+                highest = max(highest, index)
+
+            self.nodes.extend((cx, cy, start, len(self.indexes)))
+            self.nodes.extend(offsets[id(c)] if c is not None else -1
+                              for c in children)
+
+        # used to make sure items in more than one node are only hit once
+        self.marks = array('L', [0] * (highest + 1))
+        self.stamp = 0
+
+        # each node can be on the stack only once
+        self.stack = array('l', [0] * len(queue))
+
+        # numpy array of items, built by FastQuadTree.hitBatch
+        self.extents = None
+
+
 class QuadTree(object):
     """Another implementation of a quad-tree.
 
@@ -299,3 +535,300 @@ class QuadTree(object):
 
 
 
+
+
+class QuadTreeHandle(object):
+    """
+    Returned by DynamicQuadTree.insert.  Keep it around to move or remove the
+    item later.  The handle knows which node is holding it, so neither
+    operation has to search the tree.
+    """
+
+    __slots__ = ['left', 'top', 'right', 'bottom', 'value', 'node']
+
+    def __init__(self, rect, value):
+        self.left, self.top, w, h = rect
+        self.right = self.left + w
+        self.bottom = self.top + h
+        self.value = value
+        self.node = None
+
+    @property
+    def rect(self):
+        return Rect(self.left, self.top,
+                    self.right - self.left, self.bottom - self.top)
+
+    def __repr__(self):
+        return "<QuadTreeHandle ({}, {}, {}, {}): {}>".format(
+            self.left, self.top, self.right, self.bottom, self.value)
+
+
+class _DynamicNode(object):
+    """
+    For internal use by DynamicQuadTree.
+    """
+
+    __slots__ = ['left', 'top', 'right', 'bottom', 'cx', 'cy', 'depth',
+                 'parent', 'children', 'items', 'count']
+
+    def __init__(self, parent, depth, (left, top, right, bottom)):
+        self.left, self.top, self.right, self.bottom = left, top, right, bottom
+        self.cx = (left + right) * 0.5
+        self.cy = (top + bottom) * 0.5
+        self.depth = depth
+        self.parent = parent
+        self.children = None
+        self.items = []
+        self.count = 0      # number of items in this node and below
+
+    def quadrant(self, handle):
+        """
+        Return the child that completely contains the handle, or None if it
+        straddles the centre of this node.
+        """
+
+        cx, cy = self.cx, self.cy
+        if handle.right <= cx:
+            if handle.bottom <= cy: return self.children[0]
+            if handle.top >= cy:    return self.children[3]
+        elif handle.left >= cx:
+            if handle.bottom <= cy: return self.children[1]
+            if handle.top >= cy:    return self.children[2]
+        return None
+
+    def contains(self, handle):
+        return (handle.left >= self.left and handle.right <= self.right and
+                handle.top >= self.top and handle.bottom <= self.bottom)
+
+
+class DynamicQuadTree(object):
+    """A quad-tree that can be changed after it is built.
+
+    Unlike the other quadtrees in this module, items can be inserted, moved
+    and removed at any time, so it is suitable for things that move around
+    like sprites and npc's.
+
+    Every item is stored in the deepest node that completely contains it.
+    A node will split into four when it holds more than split_threshold items
+    and will merge its children back into itself when the total number of
+    items under it falls to merge_threshold.
+
+    Items that are outside of the bounds of the tree are kept in the root, so
+    they will still be found, just not quickly.
+
+    Rects are expected in pygame's (left, top, width, height) format.  Queries
+    return the values that were passed to insert().
+    """
+
+    def __init__(self, bounds, split_threshold=8, merge_threshold=4,
+                 max_depth=8):
+        """Creates an empty quad-tree.
+
+        @param bounds:
+            Rect-like area that the tree covers.  Items can be placed outside
+            of it, but they will not benefit from the tree.
+
+        @param split_threshold:
+            Number of items a node can hold before it is split.
+
+        @param merge_threshold:
+            When a node and all of its children hold this many items or less,
+            the children are removed and the items are moved up.
+
+        @param max_depth:
+            Nodes at this depth will never be split.
+        """
+
+        if merge_threshold >= split_threshold:
+            msg = "merge_threshold must be less than split_threshold"
+            raise ValueError, msg
+
+        l, t, w, h = bounds
+        self.bounds = Rect(bounds)
+        self.split_threshold = split_threshold
+        self.merge_threshold = merge_threshold
+        self.max_depth = max_depth
+        self.root = _DynamicNode(None, 0, (l, t, l + w, t + h))
+
+
+    def __len__(self):
+        return self.root.count
+
+
+    def insert(self, rect, value=None):
+        """
+        Add an item to the tree.  Returns a handle that can be passed to
+        move() and remove().
+        """
+
+        handle = QuadTreeHandle(rect, value)
+        self._insert(handle)
+        return handle
+
+
+    def remove(self, handle):
+        """
+        Remove an item from the tree.
+        """
+
+        node = handle.node
+        if node is None:
+            raise ValueError, "Handle is not in this tree"
+
+        node.items.remove(handle)
+        handle.node = None
+
+        # update the counts and find the highest node that is sparse enough
+        # to have its children merged back into it
+        sparse = None
+        while node is not None:
+            node.count -= 1
+            if node.children and node.count <= self.merge_threshold:
+                sparse = node
+            node = node.parent
+
+        if sparse is not None:
+            self._collapse(sparse)
+
+
+    def move(self, handle, rect):
+        """
+        Change the rect of an item already in the tree.
+
+        Most moves are small, so if the item still belongs in the same node
+        then the tree is not changed at all.
+        """
+
+        l, t, w, h = rect
+        node = handle.node
+        handle.left, handle.top = l, t
+        handle.right, handle.bottom = l + w, t + h
+
+        if node is None:
+            raise ValueError, "Handle is not in this tree"
+
+        # outside the node (or tree), so we have to reinsert it
+        if (node.parent is not None) and (not node.contains(handle)):
+            self.remove(handle)
+            self._insert(handle)
+
+        # might fit into a child now
+        elif node.children and node.quadrant(handle):
+            self.remove(handle)
+            self._insert(handle)
+
+
+    def hit(self, rect):
+        """Returns the values of items that overlap a rectangle.
+
+        @param rect:
+            Rect-like object in (left, top, width, height) format
+        """
+
+        return [ handle.value for handle in self.hitHandles(rect) ]
+
+
+    def hitHandles(self, rect):
+        """Returns the handles of items that overlap a rectangle.
+
+        Overlapping is tested the same way as pygame's colliderect: rects that
+        only share an edge do not collide.
+        """
+
+        l, t, w, h = rect
+        r = l + w
+        b = t + h
+
+        hits = []
+        stack = [self.root]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node = pop()
+
+            for i in node.items:
+                if i.left < r and i.right > l and i.top < b and i.bottom > t:
+                    hits.append(i)
+
+            if node.children:
+                for child in node.children:
+                    if child.count and (child.left < r and child.right > l and
+                                        child.top < b and child.bottom > t):
+                        push(child)
+
+        return hits
+
+
+    def values(self):
+        """
+        Return an iterator of all the values stored in the tree
+        """
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for i in node.items:
+                yield i.value
+            if node.children:
+                stack.extend(node.children)
+
+
+    def _insert(self, handle):
+        node = self.root
+
+        # items that are not inside the tree are kept in the root
+        if node.contains(handle):
+            while node.children:
+                child = node.quadrant(handle)
+                if child is None: break
+                node.count += 1
+                node = child
+
+        node.items.append(handle)
+        node.count += 1
+        handle.node = node
+
+        if node.children is None and len(node.items) > self.split_threshold \
+        and node.depth < self.max_depth:
+            self._split(node)
+
+
+    def _split(self, node):
+        l, t, r, b = node.left, node.top, node.right, node.bottom
+        cx, cy = node.cx, node.cy
+        depth = node.depth + 1
+
+        node.children = [ _DynamicNode(node, depth, (l, t, cx, cy)),
+                          _DynamicNode(node, depth, (cx, t, r, cy)),
+                          _DynamicNode(node, depth, (cx, cy, r, b)),
+                          _DynamicNode(node, depth, (l, cy, cx, b)) ]
+
+        # the root may hold items outside of the tree; they must stay put
+        items = node.items
+        node.items = []
+        for handle in items:
+            child = node.quadrant(handle) if node.contains(handle) else None
+            if child is None:
+                node.items.append(handle)
+            else:
+                child.items.append(handle)
+                child.count += 1
+                handle.node = child
+
+        for child in node.children:
+            if len(child.items) > self.split_threshold \
+            and child.depth < self.max_depth:
+                self._split(child)
+
+
+    def _collapse(self, node):
+        stack = list(node.children)
+        node.children = None
+        while stack:
+            child = stack.pop()
+            for handle in child.items:
+                handle.node = node
+                node.items.append(handle)
+            if child.children:
+                stack.extend(child.children)
@@ -27,6 +27,8 @@ simple:
 
 import pygame
 import os.path
+import weakref
+from collections import OrderedDict
 
 
 DEBUG = False
@@ -50,6 +52,214 @@ class NoSound:
 dummySound = NoSound()
 
 
+
+class ResourceCache(object):
+    """
+    Keeps loaded resources so they don't have to be loaded again.
+
+    Resources are kept by a key, usually the path and the flags that it was
+    loaded with.  The ones that were used most recently are kept until
+    their total size goes over the budget (in bytes).  After they have been
+    dropped, they can still be found again if anything else is holding on to
+    them.
+
+    Resources can be pinned so they are never dropped, like the images for
+    the area that the player is in.  Pins are counted, so each pin() needs
+    an unpin().
+
+    Everything that is returned from the cache is shared, so don't change
+    the surfaces that are returned.  Copy them first.
+    """
+
+    def __init__(self, budget=32 * 1024 * 1024):
+        self.budget = budget
+        self.memory = 0                         # bytes used by recent
+        self.recent = OrderedDict()             # key: (resource, size)
+        self.pinned = {}                        # key: [resource, size, pins]
+        self.weak = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self.recent) + len(self.pinned)
+
+
+    def __contains__(self, key):
+        return key in self.recent or key in self.pinned or key in self.weak
+
+
+    def get(self, key, load):
+        """
+        Return the resource for key.  If it isn't cached, load is called to
+        load it.
+        """
+
+        try:
+            resource = self.pinned[key][0]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return resource
+
+        try:
+            resource, size = self.recent.pop(key)
+        except KeyError:
+            resource = self.weak.get(key, None)
+            if resource is None:
+                self.misses += 1
+                resource = load()
+                try:
+                    self.weak[key] = resource
+                except TypeError:
+                    pass
+            else:
+                self.hits += 1
+            size = getSize(resource)
+            self.memory += size
+        else:
+            self.hits += 1
+
+        # most recently used are at the end
+        self.recent[key] = (resource, size)
+        self.trim()
+        return resource
+
+
+    def pin(self, key, load=None):
+        """
+        Keep the resource for key until it is unpinned.  If it isn't cached,
+        it will be loaded with load.  Returns the resource.
+        """
+
+        try:
+            self.pinned[key][2] += 1
+            return self.pinned[key][0]
+        except KeyError:
+            pass
+
+        if key in self:
+            resource = self.get(key, None)
+        elif load is None:
+            raise KeyError, key
+        else:
+            resource = self.get(key, load)
+
+        resource, size = self.recent.pop(key)
+        self.memory -= size
+        self.pinned[key] = [resource, size, 1]
+        return resource
+
+
+    def unpin(self, key):
+        """
+        Undo a pin.  Once all the pins are gone, the resource can be dropped.
+        """
+
+        entry = self.pinned[key]
+        entry[2] -= 1
+        if entry[2] <= 0:
+            del self.pinned[key]
+            self.recent[key] = (entry[0], entry[1])
+            self.memory += entry[1]
+            self.trim()
+
+
+    def trim(self):
+        """
+        Drop the least recently used resources until under the budget
+        """
+
+        recent = self.recent
+        while self.memory > self.budget and len(recent) > 1:
+            key, (resource, size) = recent.popitem(last=False)
+            self.memory -= size
+
+
+    def drop(self, key):
+        """
+        Drop the resource for key, unless it is pinned
+        """
+
+        try:
+            resource, size = self.recent.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.memory -= size
+
+        try:
+            del self.weak[key]
+        except KeyError:
+            pass
+
+
+    def clear(self):
+        """
+        Drop all the resources that are not pinned
+        """
+
+        self.recent.clear()
+        self.weak.clear()
+        self.memory = 0
+
+
+
+def getSize(resource):
+    """
+    Guess how many bytes a resource is using
+    """
+
+    if isinstance(resource, pygame.Surface):
+        return resource.get_width() * resource.get_height() * \
+               resource.get_bytesize()
+
+    try:
+        frequency, format, channels = pygame.mixer.get_init()
+        return int(resource.get_length() * frequency * channels *
+                   (abs(format) / 8))
+    except (AttributeError, TypeError, pygame.error):
+        return 0
+
+
+cache = ResourceCache()
+
+
+def imageKey(name, alpha=False, colorkey=False):
+    return ("image", name, bool(alpha), bool(colorkey))
+
+
+def soundKey(filename):
+    return ("sound", filename)
+
+
+def pinImage(name, alpha=False, colorkey=False):
+    """
+    Load an image and keep it until it is unpinned.  Used to keep the images
+    for an area loaded while the player is in it.
+    """
+
+    return cache.pin(imageKey(name, alpha, colorkey),
+                     lambda: _loadImage(name, alpha, colorkey))
+
+
+def unpinImage(name, alpha=False, colorkey=False):
+    cache.unpin(imageKey(name, alpha, colorkey))
+
+
+def pinSound(filename):
+    sound = loadSound(filename)
+    if not sound is dummySound:
+        cache.pin(soundKey(filename))
+    return sound
+
+
+def unpinSound(filename):
+    if soundKey(filename) in cache.pinned:
+        cache.unpin(soundKey(filename))
+
+
 def setResourcePath(path):
     global _resPath
     _resPath = path
@@ -80,15 +290,41 @@ def imagePath(filename):
     
 
 def loadImage(name, alpha=False, colorkey=False):
+    """
+    Load an image from the images folder.  Images are cached, so the same
+    surface may be returned more than once.  Don't change it.
+    """
+
+    return cache.get(imageKey(name, alpha, colorkey),
+                     lambda: _loadImage(name, alpha, colorkey))
+
+
+def _loadImage(name, alpha, colorkey):
+    return convertImage(decodeImage(name), alpha, colorkey)
+
+
+def decodeImage(name):
+    """
+    Load an image from the images folder without converting it.  This
+    doesn't touch the display, so it can be done in another thread.
+    """
+
     fullpath = imagePath(name)
 
     try:
-        image = pygame.image.load(fullpath)
+        return pygame.image.load(fullpath)
 
     except pygame.error, message:
         msg = "Cannot load image: {}"
         raise Exception, msg.format(fullpath)
 
+
+def convertImage(image, alpha=False, colorkey=False):
+    """
+    Convert a decoded image to the display format, like loadImage does.
+    Must be done in the main thread.
+    """
+
     if alpha:
         image = image.convert_alpha()
 
@@ -107,6 +343,28 @@ def soundPath(filename):
 
 
 def loadSound(filename):
+    """
+    Load a sound from the sounds folder.  Sounds are cached.
+    """
+
+    key = soundKey(filename)
+    if key in cache:
+        return cache.get(key, None)
+
+    sound = decodeSound(filename)
+
+    # the mixer may not be ready yet, so try again next time
+    if sound is dummySound:
+        return sound
+
+    return cache.get(key, lambda: sound)
+
+
+def decodeSound(filename):
+    """
+    Load a sound without using the cache.  Can be done in another thread.
+    """
+
     fullpath = soundPath(filename)
     
     if not pygame.mixer:
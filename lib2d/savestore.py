@@ -0,0 +1,827 @@
+"""
+Random access storage for trees of GameObjects.
+
+Each object is pickled on its own, as a record in the data file.  Any other
+GameObject that it refers to (its parent, objects in an area, etc) is stored
+as a reference to that object's guid instead of being pickled with it.  The
+index file has the position of each record, so any object can be read from
+the data file by its guid without reading the rest.
+
+    name-data.txt       records, one after the other
+    name-index.txt      pickled dict:
+                            version:  STORE_VERSION
+                            root:     guid of the root object
+                            nodes:    {guid: (offset, length, digest)}
+                            refs:     {guid: guids the record refers to}
+                            folded:   (generation, offset) of the journal
+                                      that was last folded, or None
+                            garbage:  bytes of records that are not used
+
+When an object is loaded, its children are not.  They are loaded from the
+store the first time they are used (see GameObject.__getattr__).  Objects it
+refers to are loaded right away, but not their children.
+
+When saving again, only objects that have been loaded can have changed, so
+the others are not touched.  Loaded objects are pickled and compared with
+how they were when they were loaded.  The records that changed are added to
+the end of the data file, and the old ones become garbage.  When there is more
+garbage than records, the data file is rewritten.  Records that can't be
+reached from the root anymore, by following the guids that each record
+refers to, are dropped from the save.  Objects that were removed from the
+tree go this way, unless something that is still in it refers to them.
+
+Autosaves don't write records.  Objects remember which of their attributes
+were changed since they were last saved (see GameObject.markChanged), and
+only those attributes are added to the end of the journal:
+
+    name-journal.txt    header: JOURNAL_MAGIC, generation of the index
+                        batches, one for each autosave:
+                            length and crc32 of the batch
+                            pickled list of entries:
+                                ("record", guid, record)   new objects
+                                ("delta", guid, changes)   pickled dict of
+                                                           attributes
+                                ("moved", guid, moved)     pickled dict of
+                                                           objects moved in
+                                                           an area (see
+                                                           Area.getMoved)
+
+When a save is opened, the journal is read too, and the changes are applied
+to objects as they are loaded.  A full save writes every object that is in
+the journal and starts a new one.  The journal can also be folded into the
+data file in a thread (see compactJournal) while the game keeps running, so
+it doesn't grow forever between full saves.
+
+Each full save or compaction changes the generation in the index.  A journal
+with a different generation is older than the records and is ignored, apart
+from the one that was folded last.  If the game stopped before its new
+journal replaced it, the part after the folded offset is still read.  A
+batch that was only partly written (the game crashed) is ignored as well.
+"""
+
+import cPickle as pickle
+from cStringIO import StringIO
+from hashlib import md5
+from threading import Thread, Lock
+from zlib import crc32
+import struct
+import os
+
+
+STORE_VERSION = 1
+JOURNAL_MAGIC = "MHJ1"
+
+journalHeader = struct.Struct("<4sI")     # magic, generation
+batchHeader = struct.Struct("<II")        # length, crc32
+
+
+
+def dataPath(name):
+    return name + "-data.txt"
+
+
+def indexPath(name):
+    return name + "-index.txt"
+
+
+def journalPath(name):
+    return name + "-journal.txt"
+
+
+def isStore(name):
+    """
+    Return True if the save called name is a SaveStore and not the old format
+    """
+
+    with open(indexPath(name), "rb") as fh:
+        toc = pickle.load(fh)
+
+    return isinstance(toc, dict) and toc.get("version", None) == STORE_VERSION
+
+
+def replaceFile(temp, path):
+    if os.name == "nt" and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+def copyRecords(path, nodes, temp):
+    """
+    Copy the records in nodes from the data file at path to temp, in the
+    order they are in now.  Returns the new nodes.
+    """
+
+    copied = {}
+    with open(path, "rb") as src:
+        with open(temp, "wb") as fh:
+            for guid, (offset, length, digest) in sorted(nodes.items(),
+                                                key=lambda i: i[1][0]):
+                src.seek(offset)
+                copied[guid] = (fh.tell(), length, digest)
+                fh.write(src.read(length))
+
+    return copied
+
+
+def walkLoaded(roots):
+    """
+    Iterate over the roots and all of their children that are loaded.
+    Objects may be returned more than once.
+    """
+
+    for root in roots:
+        for node in root.iterLoaded():
+            yield node
+
+
+
+class SaveStore(object):
+    """
+    Reads and writes objects in a save.  Objects that have been read are kept,
+    so each object is only loaded once and references to it are all the same
+    object.
+    """
+
+    journalLimit = 256 * 1024   # fold the journal when it gets this large
+
+    def __init__(self, name):
+        self.name = name
+        self.root = None
+        self.nodes = {}         # guid: (offset, length, digest)
+        self.refs = {}          # guid: guids that the record refers to
+        self.loaded = {}        # guid: object
+        self.clean = {}         # guid: digest of the object when loaded
+        self.garbage = 0
+        self.generation = 0
+        self.folded = None      # (generation, offset) of the last fold
+        self.journalGeneration = None
+        self.records = {}       # guid: record of objects only in the journal
+        self.deltas = {}        # guid: (kind, changes) in the journal, not
+                                # loaded yet
+        self.journaled = set()  # guids of objects in the journal
+        self.journalSize = 0
+        self.compactor = None   # thread folding the journal
+        self.errors = []        # exceptions raised while folding
+        self.lock = Lock()      # held while the files are changed
+        self._fh = None
+        self._loading = []      # objects being loaded by get()
+
+
+    def __contains__(self, guid):
+        return guid in self.nodes or guid in self.records
+
+
+    def open(self, journalSize=None):
+        """
+        Read the index and journal of an existing save.  If journalSize is
+        given, only that much of the journal is read.
+        """
+
+        with open(indexPath(self.name), "rb") as fh:
+            toc = pickle.load(fh)
+
+        if not toc.get("version", None) == STORE_VERSION:
+            msg = "{} is not a save that can be read"
+            raise ValueError, msg.format(self.name)
+
+        self.root = toc["root"]
+        self.nodes = toc["nodes"]
+        self.refs = toc.get("refs", {})
+        self.garbage = toc["garbage"]
+        self.generation = toc.get("generation", 0)
+        self.folded = toc.get("folded", None)
+        self.readJournal(journalSize)
+
+
+    def readJournal(self, size=None):
+        path = journalPath(self.name)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read() if size is None else fh.read(size)
+        except IOError:
+            return
+
+        try:
+            magic, generation = journalHeader.unpack_from(data)
+        except struct.error:
+            magic, generation = None, None
+
+        if not magic == JOURNAL_MAGIC:
+            generation = None
+
+        if generation == self.generation:
+            pos = journalHeader.size
+
+        # the journal was folded, but the new one didn't replace it
+        elif self.folded is not None and generation == self.folded[0]:
+            pos = self.folded[1]
+
+        else:
+            # left over from before the last full save
+            if size is None:
+                os.remove(path)
+            return
+
+        self.journalGeneration = generation
+        while pos + batchHeader.size <= len(data):
+            length, crc = batchHeader.unpack_from(data, pos)
+            start = pos + batchHeader.size
+            batch = data[start:start+length]
+            if len(batch) < length or not crc32(batch) & 0xffffffff == crc:
+                break
+
+            pos = start + length
+            for kind, guid, payload in pickle.loads(batch):
+                if kind == "record":
+                    self.records[guid] = payload
+                    self.deltas.pop(guid, None)
+                else:
+                    self.deltas.setdefault(guid, []).append((kind, payload))
+                self.journaled.add(guid)
+
+        # a batch that was cut off would hide the ones written after it
+        if size is None and pos < len(data):
+            with open(path, "r+b") as fh:
+                fh.truncate(pos)
+
+        self.journalSize = pos
+
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+    def wait(self):
+        """
+        Wait for the journal to be folded, if it is being done
+        """
+
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+
+
+    def rename(self, name):
+        """
+        Copy the save to another name and use that from now on
+        """
+
+        import shutil
+
+        self.wait()
+        self.close()
+        if os.path.exists(dataPath(self.name)):
+            shutil.copyfile(dataPath(self.name), dataPath(name))
+
+        # the journal is not copied, so the next save must be a full one
+        self.journalSize = 0
+        self.name = name
+
+
+    def readRecord(self, guid):
+        try:
+            return self.records[guid]
+        except KeyError:
+            pass
+
+        offset, length, digest = self.nodes[guid]
+        if self._fh is None:
+            self._fh = open(dataPath(self.name), "rb")
+
+        self._fh.seek(offset)
+        return self._fh.read(length)
+
+
+    def readRefs(self, guid):
+        """
+        Return the guids that the record of guid refers to, without loading
+        any of them
+        """
+
+        try:
+            return self.refs[guid]
+        except KeyError:
+            pass
+
+        # saves from before the refs were kept in the index
+        refs = set()
+        def persistent_load(other):
+            refs.add(other)
+            return other
+
+        data = StringIO(self.readRecord(guid))
+        pickle.load(data)
+        unpickler = pickle.Unpickler(data)
+        unpickler.persistent_load = persistent_load
+        state = unpickler.load()
+        refs.update(state.get("_childrenGUID", ()))
+
+        refs = tuple(refs)
+        self.refs[guid] = refs
+        return refs
+
+
+    def loadState(self, data):
+        unpickler = pickle.Unpickler(data)
+        unpickler.persistent_load = self.get
+        return unpickler.load()
+
+
+    def get(self, guid):
+        """
+        Return the object for guid, loading it if needed
+        """
+
+        try:
+            return self.loaded[guid]
+        except KeyError:
+            pass
+
+        # the journal may be folded by another thread while this is read
+        with self.lock:
+            try:
+                data = StringIO(self.readRecord(guid))
+            except KeyError:
+                msg = "GUID ({}) not in save {}"
+                raise KeyError, msg.format(guid, self.name)
+            deltas = self.deltas.pop(guid, ())
+
+        # the object has to exist before its state is loaded, because other
+        # objects that it refers to may refer back to it
+        cls = pickle.load(data)
+        obj = cls.__new__(cls)
+        self.loaded[guid] = obj
+        self._loading.append(obj)
+
+        try:
+            state = self.loadState(data)
+            setstate = getattr(obj, "__setstate__", None)
+            if setstate is None:
+                obj.__dict__.update(state)
+            else:
+                setstate(state)
+
+            for kind, changes in deltas:
+                changes = self.loadState(StringIO(changes))
+                if kind == "moved":
+                    obj.applyMoved(changes)
+                else:
+                    obj.__dict__.update(changes)
+
+        except:
+            del self.loaded[guid]
+            self._loading = []
+            raise
+
+        obj.__dict__["_store"] = self
+
+        # a record that is pickled again won't always be the same bytes, even
+        # if nothing changed.  so remember what the objects look like now to
+        # tell if they changed later.  this has to wait until everything they
+        # refer to is loaded, too.
+        if obj is self._loading[0]:
+            for other in self._loading:
+                self.clean[other.guid] = md5(self.dump(other)).digest()
+            self._loading = []
+
+        return obj
+
+
+    def getState(self, obj):
+        """
+        Return the state of obj that is saved
+        """
+
+        getstate = getattr(obj, "__getstate__", None)
+        if getstate is None:
+            state = obj.__dict__.copy()
+        else:
+            state = getstate()
+            if state is obj.__dict__:
+                state = state.copy()
+
+        # children are saved by guid and loaded later, if needed
+        children = obj.__dict__.get("_children", None)
+        if children is not None:
+            state["_childrenGUID"] = [ c.guid for c in children ]
+        state.pop("_children", None)
+        state.pop("_store", None)
+        state.pop("_changed", None)
+
+        return state
+
+
+    def pickler(self, data, refs=None):
+        """
+        Return a pickler that writes GameObjects as references to their guid.
+        If refs is a set, the guids are added to it.
+        """
+
+        from objects import GameObject
+
+        def persistent_id(other):
+            if isinstance(other, GameObject) and other.guid is not None:
+                if refs is not None:
+                    refs.add(other.guid)
+                return other.guid
+            return None
+
+        pickler = pickle.Pickler(data, -1)
+        pickler.persistent_id = persistent_id
+        return pickler
+
+
+    def dump(self, obj, refs=None):
+        """
+        Return the record for obj.  If refs is a set, the guids of the objects
+        that the record refers to, children too, are added to it.
+        """
+
+        state = self.getState(obj)
+        if refs is not None:
+            refs.update(state.get("_childrenGUID", ()))
+
+        data = StringIO()
+        pickle.dump(obj.__class__, data, -1)
+        self.pickler(data, refs).dump(state)
+        return data.getvalue()
+
+
+    def dumpChanges(self, obj, names):
+        """
+        Return the attributes of obj in names, pickled like a record.
+        Returns None if none of them are saved.
+        """
+
+        state = self.getState(obj)
+        changes = {}
+        for name in names:
+            if name == "_children":
+                name = "_childrenGUID"
+            if name in state:
+                changes[name] = state[name]
+
+        if not changes:
+            return None
+
+        return self.dumpValue(changes)
+
+
+    def dumpValue(self, value):
+        """
+        Return value pickled like a record
+        """
+
+        data = StringIO()
+        self.pickler(data).dump(value)
+        return data.getvalue()
+
+
+    def assignGUIDs(self, root):
+        """
+        Give a guid to all the loaded objects that don't have one
+        """
+
+        # objects can be loaded without their parents' children, so start
+        # from all of them
+        nodes = list(walkLoaded([root] + self.loaded.values()))
+        used = set(self.nodes)
+        used.update(self.records)
+        used.update(node.guid for node in nodes)
+
+        i = 0
+        for node in nodes:
+            if node.guid is not None: continue
+            while i in used:
+                i += 1
+            node.setGUID(i)
+            used.add(i)
+
+        return nodes
+
+
+    def reachable(self, root):
+        """
+        Return the guids of the records that can be reached from the guid
+        root, through the records that each one refers to
+        """
+
+        guids = set([root])
+        stack = [root]
+        while stack:
+            for guid in self.readRefs(stack.pop()):
+                if guid in guids: continue
+                if not (guid in self.refs or guid in self): continue
+                guids.add(guid)
+                stack.append(guid)
+
+        return guids
+
+
+    def forget(self, guids):
+        """
+        Drop the objects with these guids from the save
+        """
+
+        for guid in guids:
+            node = self.nodes.pop(guid, None)
+            if node is not None:
+                self.garbage += node[1]
+
+            obj = self.loaded.pop(guid, None)
+            if obj is not None:
+                obj.__dict__.pop("_store", None)
+
+            self.clean.pop(guid, None)
+            self.refs.pop(guid, None)
+            self.records.pop(guid, None)
+            self.deltas.pop(guid, None)
+            self.journaled.discard(guid)
+
+
+    def save(self, root):
+        """
+        Write the objects that have changed since the last save.  Returns the
+        number of records that were written.
+        """
+
+        self.wait()
+
+        # objects in the journal are written again, so the journal can go
+        for guid in list(self.journaled):
+            self.get(guid)
+
+        nodes = self.assignGUIDs(root)
+
+        changed = []
+        seen = set()
+        for node in nodes:
+            if node.guid in seen: continue
+            seen.add(node.guid)
+            node.__dict__.pop("_changed", None)
+            node.__dict__.pop("_moved", None)
+
+            refs = set()
+            record = self.dump(node, refs)
+            self.refs[node.guid] = tuple(refs)
+            digest = md5(record).digest()
+            if self.clean.get(node.guid, None) == digest and \
+               not node.guid in self.journaled:
+                continue
+
+            changed.append((node, record, digest))
+
+        # objects removed from the tree are dropped, unless an object that is
+        # still in it refers to them
+        keep = self.reachable(root.guid)
+        self.forget((seen | set(self.nodes)) - keep)
+
+        written = 0
+        path = dataPath(self.name)
+
+        # a new save replaces whatever was there
+        mode = "ab" if self.nodes else "wb"
+
+        with open(path, mode) as fh:
+            fh.seek(0, 2)
+            for node, record, digest in changed:
+                if not node.guid in keep: continue
+
+                try:
+                    offset, length, old = self.nodes[node.guid]
+                except KeyError:
+                    pass
+                else:
+                    self.garbage += length
+
+                self.nodes[node.guid] = (fh.tell(), len(record), digest)
+                self.clean[node.guid] = digest
+                fh.write(record)
+                written += 1
+
+                # this is the object now, so keep it for the next save
+                self.loaded[node.guid] = node
+                node.__dict__["_store"] = self
+
+        self.root = root.guid
+
+        live = sum(length for offset, length, digest in self.nodes.values())
+        if self.garbage > live:
+            self.compact()
+
+        self.generation += 1
+        self.folded = None
+        self.writeIndex()
+
+        if os.path.exists(journalPath(self.name)):
+            os.remove(journalPath(self.name))
+        self.records = {}
+        self.deltas = {}
+        self.journaled = set()
+        self.journalSize = 0
+
+        return written
+
+
+    def autosave(self, root):
+        """
+        Write the attributes that were changed since the last save to the
+        journal, and any objects that are new.  Returns the number of objects
+        that were written.
+
+        If the journal is large, it is folded into the data file in a thread.
+        """
+
+        if not self.nodes or self.root is None or \
+           not os.path.exists(indexPath(self.name)):
+            return self.save(root)
+
+        nodes = self.assignGUIDs(root)
+
+        records = []
+        deltas = []
+        seen = set()
+        for node in nodes:
+            if node.guid in seen: continue
+            seen.add(node.guid)
+
+            changed = node.__dict__.pop("_changed", None)
+            moved = node.__dict__.pop("_moved", None)
+            if not self.loaded.get(node.guid, None) is node:
+                record = self.dump(node)
+                self.clean[node.guid] = md5(record).digest()
+                records.append(("record", node.guid, record))
+                self.loaded[node.guid] = node
+                node.__dict__["_store"] = self
+
+            else:
+                if changed:
+                    changes = self.dumpChanges(node, changed)
+                    if changes is not None:
+                        deltas.append(("delta", node.guid, changes))
+
+                # only the objects in an area that moved are written
+                if moved:
+                    changes = self.dumpValue(node.getMoved(moved))
+                    deltas.append(("moved", node.guid, changes))
+
+        entries = records + deltas
+        if entries:
+            self.writeJournal(entries)
+
+        if self.journalSize > self.journalLimit:
+            self.compactJournal()
+
+        return len(entries)
+
+
+    def writeJournal(self, entries):
+        batch = pickle.dumps(entries, -1)
+        header = batchHeader.pack(len(batch), crc32(batch) & 0xffffffff)
+
+        with self.lock:
+            with open(journalPath(self.name), "ab") as fh:
+                if not self.journalSize:
+                    fh.truncate(0)
+                    fh.write(journalHeader.pack(JOURNAL_MAGIC,
+                                                self.generation))
+                    self.journalGeneration = self.generation
+                fh.write(header)
+                fh.write(batch)
+                self.journalSize = fh.tell()
+
+            self.journaled.update(guid for kind, guid, data in entries)
+
+
+    def compactJournal(self):
+        """
+        Start folding the journal into the data file in a thread.  Returns
+        False if there is nothing to do, or it is already being done.
+        """
+
+        if self.compactor is not None:
+            if self.compactor.is_alive():
+                return False
+            self.compactor = None
+
+        if not self.journaled:
+            return False
+
+        # the objects in the journal are loaded again from the files, apart
+        # from the ones that are in the game.  batches written after this
+        # are kept for the next time.
+        with self.lock:
+            size = self.journalSize
+            journaled = self.journaled
+            self.journaled = set()
+
+        self.compactor = Thread(target=self._foldJournal,
+                                args=(size, journaled))
+        self.compactor.start()
+        return True
+
+
+    def _foldJournal(self, size, journaled):
+        try:
+            other = SaveStore(self.name)
+            other.open(size)
+
+            nodes = {}
+            refs = {}
+            with open(dataPath(self.name), "ab") as fh:
+                fh.seek(0, 2)
+                for guid in other.journaled:
+                    found = set()
+                    record = other.dump(other.get(guid), found)
+                    nodes[guid] = (fh.tell(), len(record), md5(record).digest())
+                    refs[guid] = tuple(found)
+                    fh.write(record)
+            other.close()
+
+            path = journalPath(self.name)
+            temp = path + ".tmp"
+            with self.lock:
+                with open(path, "rb") as fh:
+                    fh.seek(size)
+                    tail = fh.read()
+
+                with open(temp, "wb") as fh:
+                    fh.write(journalHeader.pack(JOURNAL_MAGIC,
+                                                self.generation + 1))
+                    fh.write(tail)
+                    journalSize = fh.tell()
+
+                for guid, node in nodes.items():
+                    old = self.nodes.get(guid, None)
+                    if old is not None:
+                        self.garbage += old[1]
+                    self.nodes[guid] = node
+                    self.refs[guid] = refs[guid]
+                    self.records.pop(guid, None)
+                    self.deltas.pop(guid, None)
+
+                # if the new journal doesn't make it, the records are in
+                # the index, so the old one is read from where this stopped
+                self.generation += 1
+                self.folded = (self.journalGeneration, size)
+                self.writeIndex()
+                replaceFile(temp, path)
+                self.journalGeneration = self.generation
+                self.journalSize = journalSize
+
+                live = sum(n[1] for n in self.nodes.values())
+                if self.garbage <= live:
+                    return
+                nodes = dict(self.nodes)
+
+            # nothing else writes to the data file until this is done, so
+            # it can be copied without holding the lock
+            path = dataPath(self.name)
+            nodes = copyRecords(path, nodes, path + ".tmp")
+
+            with self.lock:
+                self.close()
+                replaceFile(path + ".tmp", path)
+                self.nodes = nodes
+                self.garbage = 0
+                self.writeIndex()
+
+        except Exception, e:
+            # they will be written by the next full save
+            with self.lock:
+                self.journaled.update(journaled)
+            self.errors.append(e)
+
+
+    def compact(self):
+        """
+        Rewrite the data file without the garbage
+        """
+
+        path = dataPath(self.name)
+        nodes = copyRecords(path, self.nodes, path + ".tmp")
+
+        self.close()
+        replaceFile(path + ".tmp", path)
+
+        self.nodes = nodes
+        self.garbage = 0
+
+
+    def writeIndex(self):
+        path = indexPath(self.name)
+        temp = path + ".tmp"
+        toc = {"version": STORE_VERSION,
+               "root": self.root,
+               "nodes": self.nodes,
+               "refs": self.refs,
+               "garbage": self.garbage,
+               "generation": self.generation,
+               "folded": self.folded}
+
+        with open(temp, "wb") as fh:
+            pickle.dump(toc, fh, -1)
+
+        replaceFile(temp, path)
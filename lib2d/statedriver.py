@@ -20,6 +20,7 @@ along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
 
 import gfx
 import pygame
+from profiler import FrameProfiler, EVENTS, UPDATE, DRAW, DISPLAY
 from playerinput import KeyboardPlayerInput
 from collections import deque
 from itertools import cycle, islice
@@ -65,12 +66,21 @@ class StateDriver(object):
     A state is a logical way to break up "modes" of use for a game.
     For example, a title screen, options screen, normal play, pause,
     etc.
+
+    By default, the time of each frame is split into four updates before the
+    state is drawn.  A fixed timestep can be used instead, see set_timestep.
     """
 
     def __init__(self, parent=None):
         self.parent = parent
         self._states = deque()
 
+        self.target_fps = 20        # frames drawn per second (at most)
+        self.timestep = None        # ms per update, or None to split frames
+        self.max_updates = 5        # most updates allowed before each draw
+        self.interpolate = False    # tell states how far into the next step
+        self.profiler = None        # FrameProfiler, if enabled
+
         if parent != None:
             self.reload_screen()
 
@@ -109,6 +119,49 @@ class StateDriver(object):
         self.reload_screen()
 
 
+    def set_timestep(self, timestep, max_updates=5, interpolate=False):
+        """
+        Update the states at a fixed rate, independent of the frame rate.
+
+        Time is accumulated every frame and the state is updated once for each
+        whole timestep (in ms) that has passed.  Frames that are too short
+        will not update at all, and long frames will update at most
+        max_updates times; time beyond that is dropped so a slow machine
+        won't fall further and further behind.
+
+        If interpolate is True, the state's interpolate() method will be
+        called before each draw with the fraction (0-1) of a timestep that
+        is left over, so it can draw objects between their last two
+        positions.
+
+        Pass None as the timestep to go back to the default behavior.
+        """
+
+        if timestep is not None and timestep <= 0:
+            raise ValueError, "timestep must be greater than zero"
+
+        self.timestep = timestep
+        self.max_updates = max_updates
+        self.interpolate = interpolate
+
+
+    def enable_profiler(self, size=300, overlay=False):
+        """
+        Start timing each phase of the main loop.  Returns the profiler.
+
+        If overlay is True, a graph of the frame times will be drawn over the
+        screen.  See the profiler module.
+        """
+
+        self.profiler = FrameProfiler(size, 1000.0 / self.target_fps)
+        self.profiler.overlay = overlay
+        return self.profiler
+
+
+    def disable_profiler(self):
+        self.profiler = None
+
+
     def done(self):
         """
         deactivate the current state and activate the next state, if any
@@ -224,10 +277,18 @@ class StateDriver(object):
         rawcmds = 0
         cmdlist = []
         checkedcmds = []
+
+        # unused time when using a fixed timestep
+        accumulator = 0.0
         
         currentState = current_state()
         while currentState:
-            time = clock.tick(20)
+            time = clock.tick(self.target_fps)
+
+            profiler = self.profiler
+            if profiler:
+                profiler.frame()
+                profiler.start(EVENTS)
 
             event = event_poll()
             while event:
@@ -265,31 +326,81 @@ class StateDriver(object):
 
                 event = event_poll()
 
+            if profiler:
+                profiler.stop()
+
             originalState = current_state()
             currentState = originalState
 
             if currentState:
+                update = originalState.update
+                if profiler:
+                    update = profiler.timed(UPDATE, update)
+
+            if currentState and self.timestep:
+                timestep = self.timestep
+                accumulator += time
+                updates = 0
+
+                while accumulator >= timestep:
+                    if updates == self.max_updates:
+                        # too far behind, so drop the extra time
+                        accumulator %= timestep
+                        break
+
+                    update(timestep)
+                    accumulator -= timestep
+                    updates += 1
+
+                    currentState = current_state()
+                    if not currentState == originalState: break
+
+                # the new state shouldn't get time from the old one
+                if not currentState == originalState:
+                    accumulator = 0.0
+                    continue
+
+                if self.interpolate:
+                    currentState.interpolate(accumulator / timestep)
+
+            elif currentState:
                 time = time / 4.0
 
-                originalState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == originalState: continue
 
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == originalState: continue
 
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == originalState: continue
 
-                currentState.update(time)
+                update(time)
                 currentState = current_state()
                 if not currentState == originalState: continue
 
+            if currentState:
+                if profiler:
+                    profiler.start(DRAW)
+
                 dirty = currentState.draw(self._screen)
+
+                if profiler:
+                    profiler.stop()
+                    if profiler.overlay:
+                        rect = profiler.draw(self._screen)
+                        if dirty is not None:
+                            dirty = [dirty, rect]
+                    profiler.start(DISPLAY)
+
                 gfx.update_display(dirty)
 
+                if profiler:
+                    profiler.stop()
+
 
 # singleton type object
 # use this instead of instancing your own State Driver.
@@ -6,6 +6,8 @@ this time has tiled TMX maps built in and required
 
 import pygame
 from itertools import product, chain, ifilter
+from collections import OrderedDict
+from timeit import default_timer
 
 
 # this image will be used when a tile cannot be loaded
@@ -16,6 +18,43 @@ def generateDefaultImage(size):
     return i
 
 
+class TileAnimation(object):
+    """
+    Keeps the current frame of an animated tile.  frames is a list of
+    (image, duration) tuples.
+    """
+
+    __slots__ = ['frames', 'index', 'timer', 'image']
+
+    def __init__(self, frames):
+        self.frames = [ (image, max(1, duration)) for image, duration in frames ]
+        self.index = 0
+        self.timer = 0
+        self.image = self.frames[0][0]
+
+
+    def advance(self, time):
+        """
+        advance the animation.  returns True if the frame has changed
+        """
+
+        self.timer += time
+        index = self.index
+        duration = self.frames[index][1]
+
+        while self.timer >= duration:
+            self.timer -= duration
+            index = (index + 1) % len(self.frames)
+            duration = self.frames[index][1]
+
+        if index == self.index:
+            return False
+
+        self.index = index
+        self.image = self.frames[index][0]
+        return True
+
+
 class BufferedTilemapRenderer(object):
     """
     Class to render a map onto a buffer that is suitable for blitting onto
@@ -34,6 +73,21 @@ class BufferedTilemapRenderer(object):
     The original library for this, Lib2d updates 4 times for every draw.  To
     take advantage of the processing done inbetween screen updates, update()
     will blit any tiles needed to the offscreen buffer.
+
+    If chunkSize is passed, all the visible layers of the map will be
+    pre-rendered in blocks of chunkSize x chunkSize tiles, and the buffer will
+    be filled from those instead of tile by tile.  Scrolling will then only
+    need a few large blits.  The chunks that were used least recently are
+    thrown away when they take more than chunkBudget bytes.
+
+    By default, blitPerUpdate tiles are drawn in each update.  If blitBudget
+    is passed, tiles will be drawn until that many microseconds have been
+    used instead, and the tiles closest to the part of the buffer that is on
+    the screen will be drawn first.
+
+    Animated tiles will be animated unless animate is False.  The cells of the
+    buffer that have animated tiles are kept in an index, and only those cells
+    are drawn again when the frame changes.
     """
 
     def __init__(self, tmx, size, **kwargs):
@@ -42,6 +96,22 @@ class BufferedTilemapRenderer(object):
         self.default_image = generateDefaultImage((tmx.tilewidth,
                                                    tmx.tileheight))
         self.tmx = tmx
+
+        self.chunkSize = kwargs.get("chunkSize", None)
+        self.chunkBudget = kwargs.get("chunkBudget", 8 * 1024 * 1024)
+        self.chunks = OrderedDict()     # (cx, cy): surface
+        self.chunkMemory = 0
+
+        self.blitBudget = kwargs.get("blitBudget", None)
+
+        self.animations = {}        # gid: TileAnimation
+        self.animatedCells = {}     # gid: set of (x, y) cells in the buffer
+        if kwargs.get("animate", True):
+            for gid, frames in tmx.tile_animations.iteritems():
+                frames = [ (tmx.images[f], d) for f, d in frames ]
+                self.animations[gid] = TileAnimation(frames)
+
+        self.buildOcclusionIndex()
         self.setSize(size)
 
 
@@ -51,8 +121,6 @@ class BufferedTilemapRenderer(object):
         necessary to set the size with the function.
         """
 
-        import quadtree
-
         left, self.xoffset = divmod(size[0] / 2, self.tmx.tilewidth)
         top,  self.yoffset = divmod(size[1] / 2, self.tmx.tileheight)
 
@@ -76,18 +144,15 @@ class BufferedTilemapRenderer(object):
         # how many tiles are blitted to the buffer during an update
         self.blitPerUpdate = int(self.view.width * 1.5)
 
-        # quadtree is used to correctly draw tiles that cover 'sprites'
-        rects = []
-        p = product(range(self.view.width+2), range(self.view.height+2))
-        for x, y in p:
-            rect = pygame.Rect((x*self.tmx.tilewidth,y*self.tmx.tileheight),
-                               (self.tmx.tilewidth, self.tmx.tileheight))
-            rects.append(rect)
-        self.layerQuadtree = quadtree.FastQuadTree(rects, 4)
-
         self.blank = True 
         self.queue = None
 
+        # what was on the screen last draw, so only changes are reported
+        self.lastFrame = None
+        self.lastSprites = set()
+        self.changedCells = set()
+        self.bufferChanged = True
+
 
     def center(self, (x, y)):
         """
@@ -138,6 +203,11 @@ class BufferedTilemapRenderer(object):
         """
 
         try:
+            if self.animations:
+                gid = self.tmx.getTileGID(x, y, l)
+                if gid in self.animations:
+                    return self.animations[gid].image
+
             return self.tmx.getTileImage(x, y, l)
         except:
             return self.default_image
@@ -172,6 +242,9 @@ class BufferedTilemapRenderer(object):
 
         self.view = self.view.move((x, y))
 
+        if self.animations:
+            self.indexAnimatedCells()
+
         # scroll the image (much faster than reblitting the tiles!)
         self.buffer.scroll(-x * self.tmx.tilewidth, -y * self.tmx.tileheight)
 
@@ -204,6 +277,9 @@ class BufferedTilemapRenderer(object):
                     self.tilemap.images[i] = t.convert(depth, flags)
             self.buffer = self.buffer.convert(depth, flags)
 
+        # chunks will be rendered again in the new format
+        self.clearChunks()
+
 
     def queueEdgeTiles(self, (x, y)):
         """
@@ -220,6 +296,9 @@ class BufferedTilemapRenderer(object):
         if self.queue == None:
             self.queue = iter([])
 
+        if self.chunkSize:
+            self.queueEdgeChunks((x, y))
+            return
 
         # right
         if x > 0:
@@ -249,15 +328,46 @@ class BufferedTilemapRenderer(object):
                       xrange(len(self.tmx.visibleTileLayers)))
             self.queue = chain(p, self.queue)
 
+        if self.blitBudget:
+            self.prioritizeQueue()
+
+
+    def prioritizeQueue(self):
+        """
+        sort the queue so that the tiles that are on the screen, or will be
+        soon, are drawn first.  the layers of each tile stay in order.
+
+        for internal use only
+        """
+
+        tw = self.tmx.tilewidth
+        th = self.tmx.tileheight
+
+        # tiles that are on the screen right now
+        left = self.view.left + self.xoffset // tw
+        right = self.view.left + (self.xoffset + self.size[0] - 1) // tw
+        top = self.view.top + self.yoffset // th
+        bottom = self.view.top + (self.yoffset + self.size[1] - 1) // th
+
+        def priority((x, y, l)):
+            dx = max(left - x, x - right, 0)
+            dy = max(top - y, y - bottom, 0)
+            return max(dx, dy), y, x, l
+
+        self.queue = iter(sorted(self.queue, key=priority))
+
 
     def update(self, time):
         """
         the drawing operations and management of the buffer is handled here.
         if you notice that the tiles are being drawn while the screen
         is scrolling, you will need to adjust the number of tiles that are
-        bilt per update.
+        bilt per update, or set a time budget.
         """
 
+        if self.animations and time:
+            self.updateAnimations(time)
+
         if self.queue:
             bufblit = self.buffer.blit
             getTile = self.getTileImage
@@ -266,13 +376,31 @@ class BufferedTilemapRenderer(object):
             tw = self.tmx.tilewidth
             th = self.tmx.tileheight
 
-            for i in range(self.blitPerUpdate):
+            budget = self.blitBudget
+            if budget:
+                deadline = default_timer() + budget / 1000000.0
+
+            blits = 0
+            while 1:
+                if budget:
+                    if blits and default_timer() >= deadline: break
+                elif blits == self.blitPerUpdate:
+                    break
+                blits += 1
+
                 try:
-                    x,y,l = next(self.queue)
+                    item = next(self.queue)
                 except StopIteration:
                     self.queue = None
                     break
 
+                self.bufferChanged = True
+
+                if self.chunkSize:
+                    self.blitChunk(*item)
+                    continue
+
+                x, y, l = item
                 image = getTile((x, y, l))
                 if not image == 0:
                     bufblit(image, (x * tw - ltw, y * th - tth))
@@ -291,12 +419,18 @@ class BufferedTilemapRenderer(object):
         passing a list here will correctly draw the surfaces to create the
         illusion of depth.
 
-        TODO: make sure the soccrect rects are returned for dirty updates
+        only the parts of tiles that have something in them are drawn over the
+        surfaces.  see buildOcclusionIndex.
+
+        returns the rect of the surface that was drawn on if all of it has
+        changed since the last draw.  otherwise, returns a list of the rects
+        that changed: animated tiles and the surfaces that moved.
         """
 
         if self.blank:
             self.redraw()
             self.blank = False
+            self.bufferChanged = True
 
         surblit = surface.blit
         left, top = self.view.topleft
@@ -304,10 +438,19 @@ class BufferedTilemapRenderer(object):
         ox -= origin[0]
         oy -= origin[1]
         getTile = self.getTileImage
+        tw = self.tmx.tilewidth
+        th = self.tmx.tileheight
+        mapWidth = self.tmx.width
+        mapHeight = self.tmx.height
+        columns = self.view.width + 2
+        rows = self.view.height + 2
+        layers = len(self.tmx.visibleTileLayers)
+        layerData = [ self.tmx.getLayerData(l) for l in xrange(layers) ]
+        tileBounds = self.tileBounds
 
         # set clipping
         origClip = surface.get_clip()
-        drawArea = (origin, self.size)
+        drawArea = pygame.Rect(origin, self.size)
         surface.set_clip(drawArea)
 
         surblit(self.buffer, (-ox, -oy))
@@ -323,28 +466,76 @@ class BufferedTilemapRenderer(object):
 
         # redraw tiles that overlap surfaces that were passed in
         for dirtyRect, layer in dirty:
+            if not (dirtyRect.width and dirtyRect.height): continue
+            if layer >= layers: continue
+
             dirtyRect = dirtyRect.move(ox, oy)
-            for r in self.layerQuadtree.hit(dirtyRect):
-                x, y, tw, th = r
-                if dirtyRect.bottom < y+th:
+            covered = self.occlusion[layer]
+
+            x0 = max(dirtyRect.left // tw, 0)
+            x1 = min((dirtyRect.right - 1) // tw, columns - 1)
+            y0 = max(dirtyRect.top // th, 0)
+            y1 = min((dirtyRect.bottom - 1) // th, rows - 1)
+
+            for by in xrange(y0, y1 + 1):
+                my = by + top
+                if not 0 <= my < mapHeight: continue
+
+                for bx in xrange(x0, x1 + 1):
+                    mx = bx + left
+                    if not 0 <= mx < mapWidth: continue
+
+                    # skip cells that don't have anything to draw over it
+                    if not covered[my * mapWidth + mx]: continue
+
+                    x, y = bx * tw, by * th
+                    clip = dirtyRect.clip((x, y, tw, th)).move(-x, -y)
+
                     # create illusion of depth by sorting images and
                     # tiles that are on the same layer.  if the image is
                     # lower than the tile, don't reblit the tile
-                    tile = getTile((x/tw + left, y/th + top, layer))
-                    if not tile == 0:
-                        surblit(tile, (x-ox, y-oy))
+                    if dirtyRect.bottom < y+th:
+                        first = layer
+                    else:
+                        first = layer + 1
 
-                for l in range(layer+1,len(self.tmx.visibleTileLayers)):
                     # there is a collision between a tile and a image, so
-                    # we simply reblit the affected tiles over the sprite
-                    tile = getTile((x/tw + left, y/th + top, l))
-                    if not tile == 0:
-                        surblit(tile, (x-ox, y-oy))
+                    # we simply reblit the part of the tile over the sprite
+                    for l in xrange(first, layers):
+                        bounds = tileBounds.get(layerData[l][my][mx], None)
+                        if bounds is None: continue
+
+                        area = clip.clip(bounds)
+                        if area.width and area.height:
+                            tile = getTile((mx, my, l))
+                            surblit(tile, (x + area.x - ox, y + area.y - oy),
+                                    area)
 
         # restore clipping area
         surface.set_clip(origClip)
 
-        return drawArea
+        # if the map scrolled, everything has changed
+        frame = (self.view.topleft, ox, oy)
+        sprites = set((a[0], tuple(r)) for (r, l), a in zip(dirty, surfaces))
+        changedCells = self.changedCells
+        self.changedCells = set()
+
+        if self.bufferChanged or not frame == self.lastFrame:
+            self.bufferChanged = False
+            self.lastFrame = frame
+            self.lastSprites = sprites
+            return drawArea
+
+        changed = [ pygame.Rect(r) for i, r in sprites ^ self.lastSprites ]
+        self.lastSprites = sprites
+
+        for x, y in changedCells:
+            rect = drawArea.clip(((x - left) * tw - ox, (y - top) * th - oy,
+                                  tw, th))
+            if rect.width and rect.height:
+                changed.append(rect)
+
+        return changed
 
 
     def flushQueue(self):
@@ -352,7 +543,12 @@ class BufferedTilemapRenderer(object):
         draw all tiles that are sitting in the queue
         """
 
-        if self.queue:
+        if self.queue and self.chunkSize:
+            for item in self.queue:
+                self.blitChunk(*item)
+            self.queue = None
+
+        elif self.queue:
             tw = self.tmx.tilewidth
             th = self.tmx.tileheight
             blit = self.buffer.blit
@@ -376,13 +572,267 @@ class BufferedTilemapRenderer(object):
         buffer.  will be slow, you've been warned.
         """
 
-        self.queue = product(xrange(self.view.left, self.view.right + 2),
-                             xrange(self.view.top, self.view.bottom + 2),
-                             xrange(len(self.tmx.visibleTileLayers)))
+        if self.animations:
+            self.indexAnimatedCells()
+
+        if self.chunkSize:
+            v = self.view
+            rect = pygame.Rect(v.left, v.top, v.width + 2, v.height + 2)
+            self.queue = self.splitChunks(rect)
+        else:
+            self.queue = product(xrange(self.view.left, self.view.right + 2),
+                                 xrange(self.view.top, self.view.bottom + 2),
+                                 xrange(len(self.tmx.visibleTileLayers)))
 
         self.flushQueue()
 
 
+    def buildOcclusionIndex(self):
+        """
+        find the tiles that can be drawn over sprites.
+
+        tileBounds has the rect of each tile image that is not transparent,
+        by GID.  tiles that are completely transparent are left out.
+        occlusion has a bytearray for each layer, one byte per cell of the
+        map, that is set if there is a tile in that layer or any layer above
+        it that is not transparent.
+
+        must be called again if the map is changed.
+        """
+
+        tmx = self.tmx
+        layers = len(tmx.visibleTileLayers)
+
+        def opaqueRect(image):
+            if image == 0:
+                return None
+            rects = pygame.mask.from_surface(image).get_bounding_rects()
+            if not rects:
+                return None
+            return rects[0].unionall(rects[1:])
+
+        bounds = {}
+        for gid, image in enumerate(tmx.images):
+            rect = opaqueRect(image)
+            if rect is not None:
+                bounds[gid] = rect
+
+        # every frame of an animation has to be covered
+        for gid, animation in self.animations.iteritems():
+            rects = [ opaqueRect(image) for image, d in animation.frames ]
+            rects = [ r for r in rects if r is not None ]
+            if rects:
+                bounds[gid] = rects[0].unionall(rects[1:])
+            else:
+                bounds.pop(gid, None)
+
+        self.tileBounds = bounds
+
+        # work down from the top layer, so each one includes those above it
+        covered = bytearray(tmx.width * tmx.height)
+        occlusion = [None] * layers
+        for l in xrange(layers - 1, -1, -1):
+            covered = bytearray(covered)
+            i = 0
+            for row in tmx.getLayerData(l):
+                for gid in row:
+                    if gid in bounds:
+                        covered[i] = 1
+                    i += 1
+            occlusion[l] = covered
+
+        self.occlusion = occlusion
+
+
+    def indexAnimatedCells(self):
+        """
+        find the cells in the buffer that have animated tiles
+
+        for internal use only
+        """
+
+        cells = {}
+        animations = self.animations
+        v = self.view
+        top = max(v.top, 0)
+        bottom = min(v.bottom + 2, self.tmx.height)
+        left = max(v.left, 0)
+        right = min(v.right + 2, self.tmx.width)
+
+        for l in xrange(len(self.tmx.visibleTileLayers)):
+            data = self.tmx.getLayerData(l)
+            for y in xrange(top, bottom):
+                row = data[y]
+                for x in xrange(left, right):
+                    gid = row[x]
+                    if gid in animations:
+                        try:
+                            cells[gid].add((x, y))
+                        except KeyError:
+                            cells[gid] = set([(x, y)])
+
+        self.animatedCells = cells
+
+
+    def updateAnimations(self, time):
+        """
+        advance the animated tiles and redraw the cells that have changed
+        """
+
+        cells = set()
+        for gid, animation in self.animations.iteritems():
+            if animation.advance(time):
+                cells.update(self.animatedCells.get(gid, ()))
+
+        for x, y in cells:
+            self.redrawCell(x, y)
+
+        self.changedCells.update(cells)
+
+
+    def redrawCell(self, x, y):
+        """
+        draw all the layers of one cell onto the buffer
+        """
+
+        tw = self.tmx.tilewidth
+        th = self.tmx.tileheight
+        dest = ((x - self.view.left) * tw, (y - self.view.top) * th)
+        getTile = self.getTileImage
+
+        self.buffer.fill((0, 0, 0), (dest, (tw, th)))
+        for l in xrange(len(self.tmx.visibleTileLayers)):
+            image = getTile((x, y, l))
+            if not image == 0:
+                self.buffer.blit(image, dest)
+
+
+    def queueEdgeChunks(self, (x, y)):
+        """
+        same as queueEdgeTiles, but the queue will have parts of chunks
+        instead of tiles.  see blitChunk.
+
+        for internal use only
+        """
+
+        v = self.view
+        rects = []
+
+        if x > 0:
+            rects.append(pygame.Rect(v.right - x + 1, v.top, x + 1,
+                                     v.height + 2))
+        elif x < 0:
+            rects.append(pygame.Rect(v.left, v.top, -x, v.height + 2))
+
+        if y > 0:
+            rects.append(pygame.Rect(v.left, v.bottom - y + 1, v.width + 2,
+                                     y + 1))
+        elif y < 0:
+            rects.append(pygame.Rect(v.left, v.top, v.width + 2, -y))
+
+        for rect in rects:
+            self.queue = chain(self.splitChunks(rect), self.queue)
+
+
+    def splitChunks(self, rect):
+        """
+        split a rect of tiles into the parts that are in each chunk.
+        returns list of (chunk x, chunk y, rect of tiles)
+        """
+
+        n = self.chunkSize
+        parts = []
+
+        for cy in xrange(rect.top // n, (rect.bottom - 1) // n + 1):
+            for cx in xrange(rect.left // n, (rect.right - 1) // n + 1):
+                part = rect.clip((cx * n, cy * n, n, n))
+                if part.width and part.height:
+                    parts.append((cx, cy, part))
+
+        return parts
+
+
+    def blitChunk(self, cx, cy, part):
+        """
+        blit a rect of tiles from a chunk onto the buffer
+        """
+
+        n = self.chunkSize
+        tw = self.tmx.tilewidth
+        th = self.tmx.tileheight
+
+        area = ((part.left - cx * n) * tw, (part.top - cy * n) * th,
+                part.width * tw, part.height * th)
+        dest = ((part.left - self.view.left) * tw,
+                (part.top - self.view.top) * th)
+
+        self.buffer.blit(self.getChunk((cx, cy)), dest, area)
+
+        # chunks are rendered with whatever frame was current at the time
+        for cells in self.animatedCells.itervalues():
+            for x, y in cells:
+                if part.collidepoint(x, y):
+                    self.redrawCell(x, y)
+
+
+    def getChunk(self, key):
+        """
+        return the surface for a chunk, rendering it if needed
+        """
+
+        try:
+            chunk = self.chunks.pop(key)
+        except KeyError:
+            chunk = self.renderChunk(key)
+            self.chunkMemory += self.chunkBytes(chunk)
+
+            # throw away the chunks that were used least recently
+            while self.chunks and self.chunkMemory > self.chunkBudget:
+                old_key, old = self.chunks.popitem(last=False)
+                self.chunkMemory -= self.chunkBytes(old)
+
+        self.chunks[key] = chunk
+        return chunk
+
+
+    def chunkBytes(self, surface):
+        w, h = surface.get_size()
+        return w * h * surface.get_bytesize()
+
+
+    def renderChunk(self, (cx, cy)):
+        """
+        draw all the visible layers of a chunk onto a new surface
+        """
+
+        n = self.chunkSize
+        tw = self.tmx.tilewidth
+        th = self.tmx.tileheight
+        getTile = self.getTileImage
+
+        chunk = pygame.Surface((n * tw, n * th), 0, self.buffer)
+        blit = chunk.blit
+
+        p = product(xrange(n), xrange(n),
+                    xrange(len(self.tmx.visibleTileLayers)))
+
+        for x, y, l in p:
+            image = getTile((cx * n + x, cy * n + y, l))
+            if not image == 0:
+                blit(image, (x * tw, y * th))
+
+        return chunk
+
+
+    def clearChunks(self):
+        """
+        throw away all the chunks.  call this if the map has been changed.
+        """
+
+        self.chunks.clear()
+        self.chunkMemory = 0
+
+
     def toScreen(self, (x, y)):
         """
         Adjusted for change in the view
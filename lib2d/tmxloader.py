@@ -29,6 +29,8 @@ Features:
     Automatic flipping and rotation of tiles
     Supports base64, csv, gzip, zlib and uncompressed TMX
     Image loading with pygame
+    Optional precompiled map cache for fast loading
+    Animated tiles
 
 Missing:
     Polyline (new in 0.8.0)
@@ -132,6 +134,20 @@ Tiles properties are the exception here, and must be accessed through
     >>> tile["name"]
     'CobbleStone'
 
+
+Parsing the XML is slow for large maps.  Passing "cache=True" will save a
+compiled copy of the map data next to the .tmx file ("map.tmxc") and load
+that instead the next time, as long as the .tmx and any external tilesets
+have not been changed.  A directory can be passed instead of True to keep
+the compiled maps somewhere else.  Images are never cached.
+
+    >>> tmxdata = tmxloader.load_pygame("map.tmx", cache=True)
+
+Very large maps can be loaded with "mmap=True".  The tile layers will be
+read straight out of the compiled map with a memory map, so only the parts
+of the map that are used will be loaded into memory.  The layer data works
+the same way, but cannot be changed.  This implies "cache".
+
 """
 
 from itertools import chain, product
@@ -149,6 +165,11 @@ GID_TRANS_FLIPY = 1<<30
 GID_TRANS_ROT   = 1<<29
 
 
+# compiled map cache.  bump the version if TiledMap or the loader changes
+CACHE_MAGIC = "TMXC"
+CACHE_VERSION = 3
+
+
 class TiledElement(object):
     pass
 
@@ -174,6 +195,7 @@ class TiledMap(TiledElement):
         self.tilelayers   = []      # list of TiledLayer objects
         self.objectgroups = []      # list of TiledObjectGroup objects
         self.tile_properties = {}   # dict of tiles that have metadata
+        self.tile_animations = {}   # gid: list of (frame gid, duration in ms)
         self.gidmap = {}            # mapping between gid that are loaded
         self.filename = None
 
@@ -195,6 +217,10 @@ class TiledMap(TiledElement):
         self.loadgids = []  # gids that should be loaded for display
         self.maxgid = 1
 
+        # built when first needed.  see buildTileIndex
+        self._tileLocations = None  # gid: list of (x, y, layer)
+        self._layerGIDs = None      # set of gids used in each tile layer
+
 
     def getTileImage(self, x, y, layer):
         """
@@ -305,15 +331,88 @@ class TiledMap(TiledElement):
             raise ValueError, msg.format(layer)
 
 
+    def buildTileIndex(self):
+        """
+        build the indexes used to find tiles by their GID.
+
+        this is done automatically the first time they are needed, but must be
+        called again if the layer data is changed.
+        """
+
+        locations = {}
+        layergids = []
+
+        for l, layer in enumerate(self.tilelayers):
+            gids = set()
+            for y, row in enumerate(layer.data):
+                row = list(row)
+                gids.update(row)
+                for x, gid in enumerate(row):
+                    if gid:
+                        try:
+                            locations[gid].append((x, y, l))
+                        except KeyError:
+                            locations[gid] = [(x, y, l)]
+
+            layergids.append(gids)
+
+        # same order as scanning the map x, then y, then layer
+        for l in locations.itervalues():
+            l.sort()
+
+        self._tileLocations = locations
+        self._layerGIDs = layergids
+
+
     def getTileLocation(self, gid):
-        # experimental way to find locations of a tile by the GID
+        """
+        return a list of (x, y, layer) locations that use the tile with GID
+
+        empty tiles (GID 0) are not indexed, so will return an empty list.
+        """
+
+        if self._tileLocations is None:
+            self.buildTileIndex()
+
+        return list(self._tileLocations.get(gid, ()))
 
-        p = product(xrange(self.width),
-                    xrange(self.height),
-                    xrange(len(self.tilelayers)))
 
-        return [ (x,y,l) for (x,y,l) in p 
-               if self.tilelayers[l].data[y][x] == gid ]
+    def getTileLocations(self, gids):
+        """
+        return a dict of GID: list of locations for each GID in gids
+
+        same as calling getTileLocation for each one.
+        """
+
+        if self._tileLocations is None:
+            self.buildTileIndex()
+
+        get = self._tileLocations.get
+        return dict((gid, list(get(gid, ()))) for gid in gids)
+
+
+    def getLayerGIDs(self, layer):
+        """
+        return a set of the GIDs that are used in a tile layer
+        """
+
+        if self._layerGIDs is None:
+            self.buildTileIndex()
+
+        try:
+            return self._layerGIDs[layer]
+        except IndexError:
+            msg = "Layer {} does not exist."
+            raise ValueError, msg.format(layer)
+
+
+    def getTileAnimation(self, gid):
+        """
+        return a list of (gid, duration) for each frame if the tile with GID
+        is animated, otherwise None.  duration is in milliseconds.
+        """
+
+        return self.tile_animations.get(gid, None)
 
 
     def getTilePropertiesByGID(self, gid):
@@ -334,11 +433,8 @@ class TiledMap(TiledElement):
             msg = "Layer must be an integer"
             raise ValueError, msg
 
-        p = product(range(self.width),range(self.height))
-        layergids = set( self.tilelayers[layer].data[y][x] for x, y in p )
-
         props = []
-        for gid in layergids:
+        for gid in self.getLayerGIDs(layer):
             try:
                 props.append((gid, self.tile_properties[gid]))
             except:
@@ -359,6 +455,7 @@ class TiledTileset(TiledElement):
     def __init__(self):
         TiledElement.__init__(self)
         self.lastgid = 0
+        self.animations = {}    # tiled gid: list of (tiled gid, duration)
 
         # defaults from the specification
         self.firstgid = 0
@@ -381,6 +478,63 @@ class TiledLayer(TiledElement):
         self.opacity = 1.0
         self.visible = True
         
+class MappedLayerData(object):
+    """
+    read-only tile data for a layer, kept in a memory mapped file.
+    can be used just like the normal layer data:  gid = data[y][x]
+    """
+
+    __slots__ = ['mm', 'offset', 'width', 'height']
+
+    def __init__(self, mm, offset, width, height):
+        self.mm = mm
+        self.offset = offset
+        self.width = width
+        self.height = height
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError, "layer index out of range"
+
+        return MappedRow(self.mm, self.offset + y * self.width, self.width)
+
+    def __iter__(self):
+        for y in xrange(self.height):
+            yield MappedRow(self.mm, self.offset + y * self.width, self.width)
+
+class MappedRow(object):
+    __slots__ = ['mm', 'offset', 'width']
+
+    def __init__(self, mm, offset, width):
+        self.mm = mm
+        self.offset = offset
+        self.width = width
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError, "row index out of range"
+
+        return ord(self.mm[self.offset + x])
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tostring(self):
+        return self.mm[self.offset:self.offset + self.width]
+
+    def tolist(self):
+        return map(ord, self.tostring())
+
 class TiledObjectGroup(TiledElement):
     reserved = "name color x y width height opacity object properties".split()
 
@@ -416,8 +570,24 @@ def load_tmx(filename, *args, **kwargs):
 
     See the load_pygame func for an idea of what to do if you want to extend
     this further to load images.
+
+    Tile layers are decoded with numpy if it is installed, unless "numpy" is
+    passed as False.
+
+    If "cache" is passed, a compiled copy of the map will be used if it is
+    still fresh, or created if not.  "mmap" will memory map the tile layers
+    of the compiled map.  See the notes at the top of this file.
     """
 
+    use_numpy = kwargs.get("numpy", True)
+    mapped = kwargs.get("mmap", False)
+    cache = kwargs.get("cache", False) or mapped
+    if cache:
+        cachepath = get_cache_path(filename, cache)
+        tmxdata = load_cache(filename, cachepath, mapped)
+        if tmxdata is not None:
+            return tmxdata
+
     from xml.dom.minidom import parse
     from itertools import tee, islice, izip, chain, imap
     from collections import defaultdict 
@@ -564,6 +734,75 @@ def load_tmx(filename, *args, **kwargs):
         return gid, flags
 
 
+    def encode_gid(gid, flags):
+        # reverse of decode_gid
+        if flags & TRANS_FLIPX == TRANS_FLIPX: gid |= GID_TRANS_FLIPX
+        if flags & TRANS_FLIPY == TRANS_FLIPY: gid |= GID_TRANS_FLIPY
+        if flags & TRANS_ROT == TRANS_ROT: gid |= GID_TRANS_ROT
+        return gid
+
+
+    def get_gid(tmxdata, raw_gid):
+        """
+        return the gid used by the loader for a gid from tiled.  each tile
+        and transformation of a tile that is used gets a new gid.
+        """
+
+        real_gid, flags = decode_gid(raw_gid)
+
+        # we make a new gid based on the transformation of the tile
+        try:
+            return tmxdata.imagemap[(real_gid, flags)]
+        except KeyError:
+            gid = tmxdata.maxgid
+            tmxdata.maxgid += 1
+            tmxdata.imagemap[(real_gid, flags)] = gid
+
+            if flags == 0:
+                tmxdata.loadgids.append(real_gid)
+                tmxdata.gidmap[real_gid] = gid
+            else:
+                tmxdata.transgids[real_gid].append((gid, flags))
+
+            return gid
+
+
+    def decode_layer_numpy(tmxdata, layer, raw):
+        """
+        decode a whole layer at once with numpy.  raw is an array of the gids
+        from tiled.  returns the layer data, same as the loop in parse_layer.
+
+        there are only a few unique gids in a layer, so they are decoded one at
+        a time in the order they first appear (so the new gids are the same as
+        if the loop was used), then every tile is remapped with a lookup table.
+        """
+
+        import numpy
+
+        size = layer.width * layer.height
+        raw = raw[:size]
+        if len(raw) < size:
+            msg = "Layer {} does not have enough tiles."
+            raise Exception, msg.format(layer.name)
+
+        uniques, first, inverse = numpy.unique(raw, return_index=True,
+                                               return_inverse=True)
+
+        lut = numpy.zeros(len(uniques), dtype=numpy.uint32)
+        for i in numpy.argsort(first):
+            lut[i] = get_gid(tmxdata, int(uniques[i]))
+
+        # layer data is stored as bytes
+        if len(lut) and lut.max() > 255:
+            msg = "Too many unique tiles in map.  The limit is 255."
+            raise OverflowError, msg
+
+        gids = lut[inverse].astype(numpy.uint8).reshape(layer.height,
+                                                         layer.width)
+
+        return [ array.array("B", row.tostring()) for row in gids ]
+
+
     def parse_tileset(node, firstgid=None, mapping=None):
         """
         parse a tileset element and return a tileset object and properties for
@@ -587,6 +826,16 @@ def load_tmx(filename, *args, **kwargs):
             if child.nodeName == "tile":
                 p = get_properties(child)
                 gid = p["id"] + tileset.firstgid
+
+                # frames use the gids from tiled here.  they are changed to
+                # the gids used by the loader when the whole map is parsed
+                frames = [ (types["id"](f.getAttribute("tileid")) +
+                            tileset.firstgid,
+                            int(f.getAttribute("duration")))
+                           for f in child.getElementsByTagName("frame") ]
+                if frames:
+                    tileset.animations[gid] = frames
+
                 if mapping == None:
                     del p["id"]
                     tiles[gid] = p
@@ -612,6 +861,9 @@ def load_tmx(filename, *args, **kwargs):
                     msg = "Cannot load external tileset: {}"
                     raise Exception, msg.format(path)
 
+                # the cache has to be rebuilt if this changes
+                sources.append(path)
+
                 tileset_node = tsx.getElementsByTagName("tileset")[0]
                 tileset, tiles = parse_tileset(tileset_node, \
                                                 tileset.firstgid, mapping)
@@ -686,6 +938,23 @@ def load_tmx(filename, *args, **kwargs):
             msg = "TMX compression type: {} is not supported."
             raise Exception, msg.format(str(attr["compression"]))
      
+        # decoding the whole layer with numpy is much faster than the loop
+        # below.  tile elements are rare and slow anyway, so they don't use it
+        if use_numpy and not (data == next_gid == None):
+            try:
+                import numpy
+            except ImportError:
+                pass
+            else:
+                if data == None:
+                    raw = numpy.fromiter(next_gid, dtype=numpy.uint32,
+                                         count=layer.width * layer.height)
+                else:
+                    raw = numpy.frombuffer(data, dtype="<u4")
+
+                layer.data = decode_layer_numpy(tmxdata, layer, raw)
+                return layer
+
         # if data is None, then it was not decoded or decompressed, so
         # we assume here that it is going to be a bunch of tile elements
         # TODO: this will probably raise an exception if there are no tiles
@@ -708,25 +977,35 @@ def load_tmx(filename, *args, **kwargs):
             layer.data.append(array.array("B"))
 
             for x in xrange(layer.width):
-                real_gid, flags = decode_gid(next(next_gid))
+                layer.data[y].append(get_gid(tmxdata, next(next_gid)))
 
-                # we make a new gid based on the transformation of the tile
-                try:
-                    gid = tmxdata.imagemap[(real_gid, flags)]
-                except KeyError:
-                    gid = tmxdata.maxgid
-                    tmxdata.maxgid += 1
-                    tmxdata.imagemap[(real_gid, flags)] = gid
+        return layer
 
-                    if flags == 0:
-                        tmxdata.loadgids.append(real_gid)
-                        tmxdata.gidmap[real_gid] = gid
-                    else:
-                        tmxdata.transgids[real_gid].append((gid, flags))
 
-                layer.data[y].append(gid)
+    def parse_animations(tmxdata, tileset):
+        """
+        set the animations for the tiles of a tileset that are used in the
+        map.  the frames will be loaded even if they are not used in the map.
+        transformed tiles get frames that are transformed the same way.
+        """
 
-        return layer
+        for real_gid, frames in tileset.animations.iteritems():
+            used = list(tmxdata.transgids.get(real_gid, []))
+            try:
+                used.append((tmxdata.gidmap[real_gid], 0))
+            except KeyError:
+                pass
+
+            for gid, flags in used:
+                animation = []
+                for frame, duration in frames:
+                    # the image of a transformed tile is made from the
+                    # original, so that has to be loaded as well
+                    get_gid(tmxdata, frame)
+                    frame = get_gid(tmxdata, encode_gid(frame, flags))
+                    animation.append((frame, duration))
+
+                tmxdata.tile_animations[gid] = animation
 
 
     def parse_objectgroup(node):
@@ -771,10 +1050,16 @@ def load_tmx(filename, *args, **kwargs):
             tmxdata.tilesets.append(t)
             tmxdata.tile_properties.update(tiles)
 
+        for t in tmxdata.tilesets:
+            parse_animations(tmxdata, t)
+
         # we need to create references from the rotated tiles to their original
         # in order for tile properties to work (since they have a new GID)
         for realgid, l in tmxdata.transgids.items():
-            d = tmxdata.tile_properties[tmxdata.gidmap[realgid]]
+            try:
+                d = tmxdata.tile_properties[tmxdata.gidmap[realgid]]
+            except KeyError:
+                continue
             for gid, flags in l:
                 tmxdata.tile_properties[gid] = d
 
@@ -786,10 +1071,199 @@ def load_tmx(filename, *args, **kwargs):
         return tmxdata
 
 
+    sources = [ filename ]
     dom = parse(filename)
     map_node = dom.getElementsByTagName("map")[0]
+    tmxdata = parse_map(map_node)
 
-    return parse_map(map_node)
+    if cache:
+        save_cache(tmxdata, sources, cachepath)
+
+        # use the memory map, not the layers that were just parsed
+        if mapped:
+            mappeddata = load_cache(filename, cachepath, True)
+            if mappeddata is not None:
+                return mappeddata
+
+    return tmxdata
+
+
+def get_cache_path(filename, cache=True):
+    """
+    return the path of the compiled map for a tmx file.
+
+    if cache is a string, it is used as the directory to store the compiled
+    map in.  otherwise it will be in the same directory as the tmx file.
+    """
+
+    import os
+
+    if isinstance(cache, basestring):
+        return os.path.join(cache, os.path.basename(filename) + "c")
+    else:
+        return filename + "c"
+
+
+def _source_key(path):
+    # mtime and size are checked first, so the file only has to be hashed
+    # if the mtime changed (ie: the file was copied or checked out again)
+    import os
+
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+def _source_digest(path):
+    from hashlib import md5
+
+    with open(path, "rb") as fh:
+        return md5(fh.read()).hexdigest()
+
+
+def _source_fresh((path, mtime, size, digest)):
+    try:
+        key = _source_key(path)
+    except OSError:
+        return False
+
+    if key == (mtime, size):
+        return True
+    elif key[1] == size:
+        return _source_digest(path) == digest
+    else:
+        return False
+
+
+def load_cache(filename, cachepath=None, mapped=False):
+    """
+    load a compiled map.  returns None if the compiled map doesn't exist,
+    cannot be read, or is older than the tmx it was made from.
+
+    the compiled map is a pickle of the TiledMap without any layer data,
+    followed by the gid's of each tile layer as raw bytes.
+
+    if mapped is True, the layer data will be MappedLayerData objects that
+    read from a memory map of the file.
+    """
+
+    import cPickle as pickle
+    from cStringIO import StringIO
+    from array import array
+    import mmap
+
+    if cachepath is None:
+        cachepath = get_cache_path(filename)
+
+    try:
+        with open(cachepath, "rb") as src:
+            if mapped:
+                fh = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                fh = StringIO(src.read())
+
+    # mmap will raise ValueError if the file is empty
+    except (EnvironmentError, ValueError):
+        return None
+
+    try:
+        if not fh.read(len(CACHE_MAGIC)) == CACHE_MAGIC:
+            return None
+
+        version, sources = pickle.load(fh)
+        if not version == CACHE_VERSION:
+            return None
+
+        for source in sources:
+            if not _source_fresh(source):
+                return None
+
+        tmxdata = pickle.load(fh)
+        offset = fh.tell()
+        for layer in tmxdata.tilelayers:
+            width = layer.width
+            size = width * layer.height
+
+            if mapped:
+                if offset + size > len(fh):
+                    return None
+                layer.data = MappedLayerData(fh, offset, width, layer.height)
+                offset += size
+                continue
+
+            raw = fh.read(size)
+            if not len(raw) == size:
+                return None
+
+            layer.data = []
+            for y in xrange(layer.height):
+                row = array("B")
+                row.fromstring(raw[y*width:(y+1)*width])
+                layer.data.append(row)
+
+    # a damaged cache is not fatal; the map will just be parsed again
+    except Exception:
+        return None
+
+    tmxdata.filename = filename
+    return tmxdata
+
+
+def save_cache(tmxdata, sources, cachepath=None):
+    """
+    save a compiled copy of tmxdata.  sources is a list of paths to the files
+    that it was loaded from.  must be called before images are loaded.
+
+    failing to write the compiled map is not an error.
+    """
+
+    import cPickle as pickle
+    import tempfile
+    import os
+
+    if cachepath is None:
+        cachepath = get_cache_path(tmxdata.filename)
+
+    sources = [ (path,) + _source_key(path) + (_source_digest(path),)
+                for path in sources ]
+
+    layers = tmxdata.tilelayers
+    data = [ layer.data for layer in layers ]
+    temppath = None
+
+    try:
+        for layer in layers:
+            layer.data = None
+
+        # the map may be cached by more than one thread at once (see
+        # preload), so each one writes its own temp file
+        fd, temppath = tempfile.mkstemp(dir=os.path.dirname(cachepath) or ".")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(CACHE_MAGIC)
+            pickle.dump((CACHE_VERSION, sources), fh, 2)
+            pickle.dump(tmxdata, fh, 2)
+            for rows in data:
+                fh.write("".join(row.tostring() for row in rows))
+
+        # replace the old cache in one step so a reader never sees half of it
+        try:
+            os.rename(temppath, cachepath)
+        except OSError:
+            os.remove(cachepath)
+            os.rename(temppath, cachepath)
+        temppath = None
+
+    except (IOError, OSError):
+        pass
+
+    finally:
+        for layer, rows in zip(layers, data):
+            layer.data = rows
+
+        if temppath is not None:
+            try:
+                os.remove(temppath)
+            except OSError:
+                pass
 
 
 def load_images_pygame(tmxdata, mapping, *args, **kwargs):
@@ -826,6 +1300,9 @@ def load_images_pygame(tmxdata, mapping, *args, **kwargs):
     force_colorkey = kwargs.get("force_colorkey", False)
     force_bitdepth = kwargs.get("depth", False)
 
+    # the tileset images may have been loaded already, ie: in another thread
+    image_loader   = kwargs.get("image_loader", pygame.image.load)
+
     if force_colorkey:
         try:
             force_colorkey = pygame.Color(*force_colorkey)
@@ -841,7 +1318,7 @@ def load_images_pygame(tmxdata, mapping, *args, **kwargs):
     for firstgid, t in sorted([ (t.firstgid, t) for t in tmxdata.tilesets ]):
         path = os.path.join(os.path.dirname(tmxdata.filename), t.source)
 
-        image = pygame.image.load(path)
+        image = image_loader(path)
 
         w, h = image.get_size()
         tile_size = (t.tilewidth, t.tileheight)
@@ -901,6 +1378,15 @@ def load_images_pygame(tmxdata, mapping, *args, **kwargs):
 
             gid += 1
 
+    # copy the tiles into a few large surfaces.  atlas can be a TextureAtlas
+    # if the tiles should be packed with other images
+    atlas = kwargs.get("atlas", False)
+    if atlas:
+        from atlas import TextureAtlas
+        if not isinstance(atlas, TextureAtlas):
+            atlas = TextureAtlas()
+        tmxdata.images = atlas.pack(tmxdata.images)
+
 
     del tmxdata.imagemap
     del tmxdata.loadgids
@@ -936,6 +1422,9 @@ def load_pygame(filename, *args, **kwargs):
     colorkey transparency or per-pixel alphas.  for tiles that completely fill
     the surface, it is not needed to set colorkey or alpha and will result in
     much quicker blitting *for those tiles*
+
+    with "atlas=True", the tiles will be packed into a few large surfaces,
+    and the images will be subsurfaces of them.  see atlas.TextureAtlas.
     """
 
     tmxdata = load_tmx(filename, *args, **kwargs)
@@ -944,11 +1433,14 @@ def load_pygame(filename, *args, **kwargs):
     return tmxdata
 
 
-def buildDistributionRects(tmxmap, layer, gid=None):
+def buildDistributionRects(tmxmap, layer, gid=None, minimal=False):
     """
     generate a set of non-overlapping rects that represents the distribution
     of the specfied gid.  if gid is not passed, then will choose one.
 
+    if minimal is True, the fewest rects possible will be returned, but it
+    will take longer.  see maputils.decompose.
+
     useful for collision detection
     """
     
@@ -958,7 +1450,6 @@ def buildDistributionRects(tmxmap, layer, gid=None):
         gid = tmxmap.gidmap[tmxmap.tilesets[layer].firstgid]
 
     layer_data = tmxmap.getLayerData(layer)
-    p = product(xrange(tmxmap.width), xrange(tmxmap.height))
-    points = [ (x,y) for (x,y) in p if layer_data[y][x] == gid ]
-    rects = maputils.simplify(points, tmxmap.tilewidth, tmxmap.tileheight)
-    return rects
+    grid = [ [ g == gid for g in row ] for row in layer_data ]
+    return maputils.decompose(grid, tmxmap.tilewidth, tmxmap.tileheight,
+                              minimal)
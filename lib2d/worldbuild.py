@@ -0,0 +1,213 @@
+"""
+build a world without doing the same work twice.
+
+building a world has two steps.  first, each area's map is compiled (see
+env.compileMap).  this is the slow part, and the result only depends on the
+map, its tilesets and the code that compiles it.  so the result is kept in a
+cache, with a hash of all of those, and is only compiled again when one of
+them changes.  maps that have to be compiled are done at the same time on a
+pool of processes.
+
+then the world is put together from the compiled maps and the objects in it.
+that is quick, and is always done unless nothing at all has changed:
+
+    >>> builder = WorldBuilder("build")
+    >>> inputs = builder.hashFiles(files)
+    >>> if not builder.isCurrent("mh", inputs):
+    ...     compiled = builder.compileMaps(paths)
+    ...     (make the world and save it)
+    ...     builder.setCurrent("mh", inputs)
+
+Copyright 2010, 2011  Leif Theden
+
+
+This file is part of lib2d.
+
+lib2d is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+lib2d is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lib2d.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from env import compileMap
+
+import cPickle as pickle
+from hashlib import md5
+import os
+
+
+# bump this if what compileMap returns changes
+BUILD_VERSION = 1
+
+# the code that the compiled maps depend on
+compilerFiles = ("env.py", "tmxloader.py", "maputils.py")
+
+
+
+def fileDigest(path):
+    """
+    Return the md5 of a file, or None if it doesn't exist
+    """
+
+    try:
+        with open(path, "rb") as fh:
+            return md5(fh.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def mapSources(path):
+    """
+    Return the files that a tmx map is made of: the map and its external
+    tilesets.  Only the start of the map is read.
+    """
+
+    from xml.etree.cElementTree import iterparse
+
+    sources = [ path ]
+    dirname = os.path.dirname(path)
+
+    # the tilesets are always before the layers
+    for event, node in iterparse(path, ("start",)):
+        if node.tag == "tileset":
+            source = node.get("source", None)
+            if source:
+                sources.append(os.path.abspath(os.path.join(dirname, source)))
+        elif node.tag in ("layer", "objectgroup"):
+            break
+
+    return sources
+
+
+
+class WorldBuilder(object):
+    """
+    Compiles maps, keeping the results in cachedir.  Maps are compiled on
+    worker processes.  If workers is None, it is the number of cpus.
+    """
+
+    def __init__(self, cachedir, workers=None):
+        self.cachedir = cachedir
+        self.workers = workers
+        self.compiled = []      # paths of maps compiled by compileMaps
+        self.cached = []        # paths of maps that were in the cache
+
+        libdir = os.path.dirname(os.path.abspath(__file__))
+        self.compilerDigest = self.hashFiles(
+            [ os.path.join(libdir, name) for name in compilerFiles ])
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+
+    def hashFiles(self, paths, extra=None):
+        """
+        Return a hash of the contents of the files in paths.  extra can be
+        anything with a repr() that doesn't change between runs.
+        """
+
+        digest = md5(str(BUILD_VERSION))
+        if extra is not None:
+            digest.update(repr(extra))
+
+        for path in paths:
+            digest.update(os.path.basename(path))
+            digest.update(str(fileDigest(path)))
+
+        return digest.hexdigest()
+
+
+    def mapDigest(self, path):
+        return self.hashFiles(mapSources(path), self.compilerDigest)
+
+
+    def cachePath(self, name):
+        return os.path.join(self.cachedir, os.path.basename(name) + ".build")
+
+
+    def readCache(self, name, digest):
+        """
+        Return what was kept for name, if it was kept with the same digest
+        """
+
+        try:
+            with open(self.cachePath(name), "rb") as fh:
+                version, kept, value = pickle.load(fh)
+        except Exception:
+            # a damaged cache is not fatal; it will just be built again
+            return None
+
+        if version == BUILD_VERSION and kept == digest:
+            return value
+
+        return None
+
+
+    def writeCache(self, name, digest, value):
+        path = self.cachePath(name)
+        temp = path + ".tmp"
+
+        with open(temp, "wb") as fh:
+            pickle.dump((BUILD_VERSION, digest, value), fh, 2)
+
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+
+
+    def compileMaps(self, paths):
+        """
+        Return a dict of path: compiled map.  Only maps that changed since
+        they were last compiled are compiled.
+        """
+
+        result = {}
+        todo = []
+        for path in paths:
+            digest = self.mapDigest(path)
+            compiled = self.readCache(path, digest)
+            if compiled is None:
+                todo.append((path, digest))
+            else:
+                result[path] = compiled
+
+        self.cached = sorted(result)
+        self.compiled = [ path for path, digest in todo ]
+
+        if len(todo) > 1 and not self.workers == 1:
+            from multiprocessing import Pool, cpu_count
+
+            pool = Pool(min(self.workers or cpu_count(), len(todo)))
+            try:
+                done = pool.map(compileMap, self.compiled)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            done = map(compileMap, self.compiled)
+
+        for (path, digest), compiled in zip(todo, done):
+            self.writeCache(path, digest, compiled)
+            result[path] = compiled
+
+        return result
+
+
+    def isCurrent(self, name, digest):
+        """
+        Return True if name was last built from the same inputs
+        """
+
+        return self.readCache(name, digest) is not None
+
+
+    def setCurrent(self, name, digest):
+        self.writeCache(name, digest, True)
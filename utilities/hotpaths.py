@@ -0,0 +1,425 @@
+"""
+headless benchmarks for the hot paths of lib2d and pygoap.
+
+unlike benchmarks.py, this doesn't need a display; the SDL dummy video driver
+is used, and random data is seeded, so runs can be compared with each other.
+the results are saved as json:
+
+    python utilities/hotpaths.py -o before.json
+    (make some changes)
+    python utilities/hotpaths.py -o after.json -b before.json
+
+each benchmark is run a few times and the fastest, mean and median times are
+recorded in milliseconds.  when a baseline is given, the ratio of the median
+times is printed (less than 1.0 is faster).
+"""
+
+import os, sys
+
+# must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "lib2d"))
+
+import json, platform, random, time
+from timeit import default_timer
+
+import pygame
+
+
+screen_size = (320, 240)
+benchmarks = []
+
+
+def benchmark(name, number=1):
+    """
+    register a benchmark.  the decorated function does the setup and returns
+    a function that will be timed.  number is how many times to call it for
+    each run; the time reported is for one call.
+    """
+
+    def register(func):
+        benchmarks.append((name, func, number))
+        return func
+
+    return register
+
+
+def mapPath(name):
+    return os.path.join(root, "resources", "maps", name)
+
+
+def commonGID(tmxdata, layer):
+    # the most used gid in a layer, so there is something to work with
+    counts = {}
+    for row in tmxdata.getLayerData(layer):
+        for gid in row:
+            if gid:
+                counts[gid] = counts.get(gid, 0) + 1
+    return max(counts, key=counts.get)
+
+
+# =============================================================================
+# MAP LOADING
+
+@benchmark("tmxloader.load_tmx")
+def bench_load_tmx(options):
+    import tmxloader
+    path = mapPath(options.map)
+    return lambda: tmxloader.load_tmx(path)
+
+
+@benchmark("tmxloader.load_tmx cached")
+def bench_load_tmx_cached(options):
+    import tmxloader
+    import tempfile, shutil
+
+    path = mapPath(options.map)
+    cachedir = tempfile.mkdtemp()
+    tmxloader.load_tmx(path, cache=cachedir)
+
+    def run():
+        tmxloader.load_tmx(path, cache=cachedir)
+
+    run.cleanup = lambda: shutil.rmtree(cachedir, True)
+    return run
+
+
+@benchmark("tmxloader.load_pygame")
+def bench_load_pygame(options):
+    import tmxloader
+    path = mapPath(options.map)
+    return lambda: tmxloader.load_pygame(path, force_colorkey=(128,128,0))
+
+
+@benchmark("tmxloader.buildDistributionRects")
+def bench_distribution(options):
+    import tmxloader
+    data = tmxloader.load_tmx(mapPath(options.map))
+    gid = commonGID(data, 0)
+    return lambda: tmxloader.buildDistributionRects(data, 0, gid)
+
+
+@benchmark("tmxloader.buildDistributionRects minimal")
+def bench_distribution_minimal(options):
+    import tmxloader
+    data = tmxloader.load_tmx(mapPath(options.map))
+    gid = commonGID(data, 0)
+    return lambda: tmxloader.buildDistributionRects(data, 0, gid, True)
+
+
+# =============================================================================
+# COLLISION
+
+def randomRects(count, size=1024, largest=32):
+    return [ pygame.Rect(random.randint(0, size), random.randint(0, size),
+                         random.randint(1, largest), random.randint(1, largest))
+             for i in xrange(count) ]
+
+
+@benchmark("FastQuadTree build")
+def bench_quadtree_build(options):
+    from quadtree import FastQuadTree
+    rects = randomRects(2000)
+    return lambda: FastQuadTree(rects, 4)
+
+
+@benchmark("FastQuadTree hit")
+def bench_quadtree_hit(options):
+    from quadtree import FastQuadTree
+    tree = FastQuadTree(randomRects(2000), 4)
+    queries = randomRects(1000, largest=64)
+
+    def run():
+        hit = tree.hit
+        for rect in queries:
+            hit(rect)
+
+    return run
+
+
+@benchmark("FastQuadTree hitIndexes")
+def bench_quadtree_hitindexes(options):
+    from quadtree import FastQuadTree
+    tree = FastQuadTree(randomRects(2000), 4)
+    queries = randomRects(1000, largest=64)
+
+    def run():
+        hit = tree.hitIndexes
+        for rect in queries:
+            hit(rect)
+
+    return run
+
+
+def makeArea(options, bboxStore=False):
+    from env import Area
+    from objects import GameObject
+    from bbox import BBox
+
+    area = Area()
+    area.setExtent(((0, 0), (1024, 1024)))
+    # the area only checks layer 4 for now
+    area.setLayerGeometry(4, randomRects(200, 1000, 16))
+
+    objects = []
+    for i in xrange(500):
+        obj = GameObject()
+        area.add(obj)
+        area.setBBox(obj, BBox(random.randint(0, 1000),
+                               random.randint(0, 1000), 0, 8, 8, 8))
+        objects.append(obj)
+
+    if bboxStore:
+        area.useBBoxStore()
+
+    moves = [ (obj, (random.randint(0, 1000), random.randint(0, 1000), 0))
+              for obj in objects ]
+
+    return area, moves
+
+
+@benchmark("Area.setPosition")
+def bench_area_setposition(options):
+    area, moves = makeArea(options)
+
+    def run():
+        setPosition = area.setPosition
+        for obj, position in moves:
+            setPosition(obj, position)
+
+    return run
+
+
+@benchmark("Area.setPosition bboxstore")
+def bench_area_setposition_store(options):
+    area, moves = makeArea(options, bboxStore=True)
+
+    def run():
+        setPosition = area.setPosition
+        for obj, position in moves:
+            setPosition(obj, position)
+
+    return run
+
+
+# =============================================================================
+# RENDERING
+
+def makeRenderer(options, **kwargs):
+    import tmxloader
+    from tilemap import BufferedTilemapRenderer
+
+    data = tmxloader.load_pygame(mapPath(options.map),
+                                 force_colorkey=(128,128,0))
+    renderer = BufferedTilemapRenderer(data, screen_size, **kwargs)
+
+    # a path across the map and back again
+    w = data.width * data.tilewidth - screen_size[0]
+    h = data.height * data.tileheight - screen_size[1]
+    hw, hh = screen_size[0] / 2, screen_size[1] / 2
+    path = [ (hw + w * i / 100, hh + h * i / 100) for i in xrange(100) ]
+    path.extend(reversed(path))
+
+    return data, renderer, path
+
+
+@benchmark("BufferedTilemapRenderer scroll")
+def bench_renderer_scroll(options):
+    data, renderer, path = makeRenderer(options)
+    renderer.redraw()
+
+    def run():
+        for position in path:
+            renderer.center(position)
+            renderer.update(16)
+        renderer.flushQueue()
+
+    return run
+
+
+@benchmark("BufferedTilemapRenderer scroll chunked")
+def bench_renderer_scroll_chunks(options):
+    data, renderer, path = makeRenderer(options, chunkSize=8)
+    renderer.redraw()
+
+    def run():
+        for position in path:
+            renderer.center(position)
+            renderer.update(16)
+        renderer.flushQueue()
+
+    return run
+
+
+@benchmark("BufferedTilemapRenderer draw", 20)
+def bench_renderer_draw(options):
+    data, renderer, path = makeRenderer(options)
+    surface = pygame.Surface(screen_size)
+    renderer.center(path[50])
+    renderer.redraw()
+
+    sprite = pygame.Surface((16, 24))
+    layers = len(data.visibleTileLayers)
+    sprites = [ (sprite, pygame.Rect(random.randint(0, screen_size[0]),
+                                     random.randint(0, screen_size[1]),
+                                     16, 24),
+                 random.randint(0, layers - 1)) for i in xrange(30) ]
+
+    return lambda: renderer.draw(surface, sprites)
+
+
+@benchmark("Avatar.update", 20)
+def bench_avatar_update(options):
+    from avatar import Avatar, Animation
+
+    avatars = []
+    for i in xrange(200):
+        avatar = Avatar()
+        animation = Animation("warrior-male-walk.png", "walk", [0,1,2,1], 4)
+        animation.load()
+        avatar.add(animation)
+        avatar.play("walk")
+        avatars.append(avatar)
+
+    def run():
+        for avatar in avatars:
+            avatar.update(16)
+
+    return run
+
+
+# =============================================================================
+# PLANNING
+
+@benchmark("pygoap.planning.plan")
+def bench_plan(options):
+    from pygoap.planning import plan, InstancedAction
+    from pygoap.actions import ActionBuilder
+    from pygoap.goals import SimpleGoal
+    from pygoap.blackboard import Blackboard, Tag
+
+    # a chain of steps that must be done in order, with a few useless
+    # actions to make the planner search
+    class Step(InstancedAction):
+        def __init__(self, tag):
+            InstancedAction.__init__(self)
+            self.tag = tag
+
+        def touch(self, bb):
+            bb.post(Tag(**self.tag))
+
+    class StepBuilder(ActionBuilder):
+        def get_actions(self, caller, bb):
+            if self.needs is None or self.needs in bb.read():
+                return [ Step(self.gives) ]
+            return []
+
+    depth = 5
+    actions = [ StepBuilder(needs=None, gives={"idle": i}) for i in xrange(2) ]
+    actions.extend(StepBuilder(needs={"step": i} if i else None,
+                               gives={"step": i + 1}) for i in xrange(depth))
+
+    goal = SimpleGoal(step=depth)
+
+    def run():
+        success, path = plan(None, actions, InstancedAction(), Blackboard(),
+                             goal)
+        assert success
+
+    return run
+
+
+# =============================================================================
+
+def run(options):
+    pygame.init()
+    pygame.display.set_mode(screen_size)
+
+    # resources are loaded relative to the root of the project
+    os.chdir(root)
+
+    results = {}
+    for name, setup, number in benchmarks:
+        if options.only and not any(o in name for o in options.only):
+            continue
+
+        random.seed(options.seed)
+        func = setup(options)
+
+        times = []
+        for i in xrange(options.repeat):
+            start = default_timer()
+            for n in xrange(number):
+                func()
+            times.append((default_timer() - start) * 1000.0 / number)
+
+        cleanup = getattr(func, "cleanup", None)
+        if cleanup:
+            cleanup()
+
+        times.sort()
+        results[name] = {
+            "min": times[0],
+            "mean": sum(times) / len(times),
+            "median": times[len(times) / 2],
+            "repeat": options.repeat,
+            "number": number,
+        }
+
+        print "{0:45} {1:10.3f} ms".format(name, results[name]["median"])
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "map": options.map,
+            "seed": options.seed,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline):
+    print
+    print "{0:45} {1:>10} {2:>10} {3:>7}".format("", "baseline", "now", "ratio")
+    for name in sorted(results["results"]):
+        try:
+            old = baseline["results"][name]["median"]
+        except KeyError:
+            continue
+
+        new = results["results"][name]["median"]
+        ratio = new / old if old else 0.0
+        print "{0:45} {1:10.3f} {2:10.3f} {3:7.2f}".format(name, old, new,
+                                                          ratio)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="save the results as json")
+    parser.add_argument("-b", "--baseline", help="json results to compare to")
+    parser.add_argument("-m", "--map", default="village.tmx",
+                        help="map in resources/maps to use")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-s", "--seed", type=int, default=1)
+    parser.add_argument("only", nargs="*",
+                        help="only run benchmarks with these in the name")
+    options = parser.parse_args()
+
+    results = run(options)
+
+    if options.output:
+        with open(options.output, "w") as fh:
+            json.dump(results, fh, indent=1, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as fh:
+            compare(results, json.load(fh))